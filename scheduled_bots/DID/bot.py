@@ -1,12 +1,12 @@
 from wikidataintegrator import wdi_core, wdi_login
 from wikidataintegrator.ref_handlers import update_retrieved_if_new_multiple_refs
-import pandas as pd
-from pandas import read_csv
-import requests
-from tqdm import trange, tqdm
+import os
+from tqdm import tqdm
 from datetime import datetime
 import copy
 
+from scheduled_bots.DID.triples import property_dict, load_triples, get_existing_claims, group_new_statements
+
 
 
 def create_reference():
@@ -29,31 +29,22 @@ except ImportError:
         WDPASS = os.environ['WDPASS']
     else:
         raise ValueError("WDUSER and WDPASS must be specified in local.py or as environment variables")
-        
-        
-        
+login = wdi_login.WDLogin(WDUSER, WDPASS)
+
+
 ## Load clean triples and write to Wikidata
-statement_types = ['cause','may_prevent','may_treat']
-property_dict = {'cause':'P1542','may_prevent':'P4954','may_treat':'P2175'}
 filelocation = 'results/'
 
-drug_qid_column_to_use = 'drug_cas_wdid'
-phen_qid_column_to_use = 'phen_cui_wdid'
-
-for each_did_type in statement_types:
-    statement_filename = filelocation+each_did_type+'.tsv'
-    triples = read_csv(statement_filename,delimiter='\t',header=0)
-    triples_clean = triples[[drug_qid_column_to_use,phen_qid_column_to_use]].copy()
-    triples_clean.drop_duplicates(keep='first',inplace=True)
-    triples_clean.reset_index(inplace=True)
-    i=0
-    for i in tqdm(range(len(triples_clean))):
-        drug_qid = triples_clean.iloc[i][drug_qid_column_to_use]
-        phen_qid = triples_clean.iloc[i][phen_qid_column_to_use]
-        reference = create_reference()
-        print(each_did_type,drug_qid,phen_qid,property_dict[each_did_type])
-        statement = [wdi_core.WDItemID(value=phen_qid, prop_nr=property_dict[each_did_type], references=[copy.deepcopy(reference)])]
-        item = wdi_core.WDItemEngine(wd_item_id=drug_qid, data=statement, append_value=property_dict[each_did_type],
-                           global_ref_mode='CUSTOM', ref_handler=update_retrieved_if_new_multiple_refs)
-        item.write(login)
-        i=i+1        
+triples = load_triples(filelocation, drug_qid_column_to_use='drug_cas_wdid', phen_qid_column_to_use='phen_cui_wdid')
+# the cause, may_prevent and may_treat statements each drug doesn't have yet, so each drug is written once
+existing = get_existing_claims(triples.drug.unique())
+new_statements = group_new_statements(triples, existing)
+print("{} new statements on {} drugs".format(sum(len(x) for x in new_statements.values()), len(new_statements)))
+
+for drug_qid, pairs in tqdm(new_statements.items()):
+    reference = create_reference()
+    statements = [wdi_core.WDItemID(value=phen_qid, prop_nr=pid, references=[copy.deepcopy(reference)])
+                  for pid, phen_qid in pairs]
+    item = wdi_core.WDItemEngine(wd_item_id=drug_qid, data=statements, append_value=list(property_dict.values()),
+                                 global_ref_mode='CUSTOM', ref_handler=update_retrieved_if_new_multiple_refs)
+    item.write(login)
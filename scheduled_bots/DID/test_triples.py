@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+from scheduled_bots.DID.triples import load_triples, existing_from_bindings, group_new_statements
+
+
+def write_tsv(path, rows):
+    with open(path, 'w') as f:
+        f.write("\traw_drug_name\tdrug_cas_wdid\tphen_cui_wdid\n")
+        for i, (drug, phen) in enumerate(rows):
+            f.write("{}\tx\t{}\t{}\n".format(i, drug, phen))
+
+
+def test_group_new_statements():
+    d = tempfile.mkdtemp()
+    write_tsv(os.path.join(d, "cause.tsv"), [("Q1", "Q10")])
+    write_tsv(os.path.join(d, "may_prevent.tsv"), [("Q2", "Q20")])
+    write_tsv(os.path.join(d, "may_treat.tsv"), [("Q1", "Q11"), ("Q1", "Q11"), ("Q1", "Q12"), ("Q2", "Q21")])
+    triples = load_triples(d)
+    assert len(triples) == 5
+
+    entity = "http://www.wikidata.org/entity/"
+    existing = existing_from_bindings([{'drug': {'value': entity + "Q1"}, 'prop': {'value': "P2175"},
+                                        'value': {'value': entity + "Q12"}}])
+    assert existing == {("Q1", "P2175", "Q12")}
+    assert group_new_statements(triples, existing) == {'Q1': [('P1542', 'Q10'), ('P2175', 'Q11')],
+                                                       'Q2': [('P4954', 'Q20'), ('P2175', 'Q21')]}
@@ -0,0 +1,65 @@
+"""
+The drug - indication triples from the DID results, grouped by drug, without the ones already in wikidata
+
+triples = load_triples("results/")
+existing = get_existing_claims(triples.drug.unique())
+new_statements = group_new_statements(triples, existing)  # drug qid -> [(pid, phenotype qid)]
+"""
+import os
+
+import pandas as pd
+from wikidataintegrator import wdi_core
+
+from scheduled_bots.utils import grouper
+
+property_dict = {'cause': 'P1542', 'may_prevent': 'P4954', 'may_treat': 'P2175'}
+
+# claims of the DID properties on a chunk of drugs, of any rank
+existing_query = """
+SELECT ?drug ?prop ?value WHERE {{
+  VALUES ?drug {{ {drugs} }}
+  VALUES (?p ?ps ?prop) {{ {props} }}
+  ?drug ?p ?statement .
+  ?statement ?ps ?value .
+}}"""
+
+
+def load_triples(filelocation, drug_qid_column_to_use='drug_cas_wdid', phen_qid_column_to_use='phen_cui_wdid'):
+    """
+    :param filelocation: dir with cause.tsv, may_prevent.tsv and may_treat.tsv
+    :return: DataFrame of unique (drug, prop, phen)
+    """
+    dfs = []
+    for each_did_type, pid in property_dict.items():
+        triples = pd.read_csv(os.path.join(filelocation, each_did_type + '.tsv'), delimiter='\t', header=0)
+        triples = triples[[drug_qid_column_to_use, phen_qid_column_to_use]].dropna()
+        triples.columns = ['drug', 'phen']
+        triples.insert(1, 'prop', pid)
+        dfs.append(triples)
+    return pd.concat(dfs, ignore_index=True).drop_duplicates(keep='first').reset_index(drop=True)
+
+
+def get_existing_claims(drugs, chunk_size=200):
+    # set of (drug, prop, value) in wikidata
+    props = " ".join("(p:{0} ps:{0} \"{0}\")".format(pid) for pid in property_dict.values())
+    bindings = []
+    for chunk in grouper(chunk_size, sorted(drugs)):
+        query = existing_query.format(drugs=" ".join("wd:" + drug for drug in chunk), props=props)
+        bindings.extend(wdi_core.WDItemEngine.execute_sparql_query(query)['results']['bindings'])
+    return existing_from_bindings(bindings)
+
+
+def existing_from_bindings(bindings):
+    return {tuple(b[k]['value'].replace("http://www.wikidata.org/entity/", "") for k in ('drug', 'prop', 'value'))
+            for b in bindings}
+
+
+def group_new_statements(triples, existing):
+    """
+    :param triples: from `load_triples`
+    :param existing: set of (drug, prop, value) already in wikidata
+    :return: drug qid -> list of (prop, phen) that aren't there yet
+    """
+    keys = list(zip(triples.drug, triples.prop, triples.phen))
+    new = triples[[key not in existing for key in keys]]
+    return {drug: list(zip(group.prop, group.phen)) for drug, group in new.groupby('drug', sort=True)}
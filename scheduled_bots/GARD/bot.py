@@ -6,6 +6,9 @@ import requests
 import time
 from datetime import datetime
 import copy
+import os
+
+from scheduled_bots.utils import get_values_multi
 
 
 ## Login for Scheduled bot
@@ -41,9 +44,11 @@ def create_reference(gard_url):
 
 
 ## Fetch data from GARD
+## One session is reused for all API calls so the connection is kept alive between diseases
 header_info = {GARDUSER: GARDPASS}
-gard_results = requests.get('https://api.rarediseases.info.nih.gov/api/diseases',
-                           headers=header_info)
+gard_session = requests.Session()
+gard_session.headers.update(header_info)
+gard_results = gard_session.get('https://api.rarediseases.info.nih.gov/api/diseases')
 
 ## Parse GARD data
 gard_df = pd.read_json(gard_results.text)
@@ -59,8 +64,7 @@ synonyms_df = pd.DataFrame(columns=['diseaseId','name','source'])
 i=0
 while i < len(gard_id_list):
     try:
-        sample_result = requests.get('https://api.rarediseases.info.nih.gov/api/diseases/'+str(gard_df.iloc[i]['diseaseId']),
-                                   headers=header_info)
+        sample_result = gard_session.get('https://api.rarediseases.info.nih.gov/api/diseases/'+str(gard_df.iloc[i]['diseaseId']))
         json_result = sample_result.json()
         data_of_interest = json_result.get(key_of_interest)
         sourced_syn = data_of_interest.get('synonyms-with-source')
@@ -110,23 +114,20 @@ prop_id_dict = {'OMIM':'P492', 'ORPHANET':'P1550', 'UMLS':'P2892',
                 'ICD 10-CM':'P4229', 'MeSH':'P486'}
 
 ## Pull diseases from WD based on misc identifiers
-sparql_start = 'SELECT * WHERE {?item wdt:'
-sparql_end = '}'
-
+## Only the identifiers of the missing GARD diseases are looked up, in chunked VALUES queries,
+## instead of scanning every item using each property
 identifier_megalist=[]
 
 for eachidtype in property_list:
-    sparqlQuery = sparql_start + prop_id_dict[eachidtype] + ' ?identifierId'+sparql_end
-    result = wdi_core.WDItemEngine.execute_sparql_query(sparqlQuery)
-    i=0
-    while i in < len(result["results"]["bindings"]):
-        id_id = result["results"]["bindings"][i]['identifierId']["value"]
-        wdid = result["results"]["bindings"][i]["item"]["value"].replace("http://www.wikidata.org/entity/", "")
-        identifier_megalist.append({'WDID':wdid,'identifierId':id_id, 'identifierType':eachidtype})
-    i=i+1
-    time.sleep(2)
+    if eachidtype not in prop_id_dict:
+        continue
+    id_ids = gard_not_in_wd.loc[gard_not_in_wd['identifierType'] == eachidtype, 'identifierId']
+    id_qids = get_values_multi(prop_id_dict[eachidtype], id_ids)
+    for id_id, wdids in id_qids.items():
+        for wdid in wdids:
+            identifier_megalist.append({'WDID':wdid,'identifierId':id_id, 'identifierType':eachidtype})
         
-identifier_megadf = pd.DataFrame(identifier_megalist)
+identifier_megadf = pd.DataFrame(identifier_megalist, columns=['WDID', 'identifierId', 'identifierType'])
 
 ## For each Gard Disease Entry, check for multiple mappings to the same WDID
 missing_gard_merge = gard_not_in_wd.merge(identifier_megadf,on=(['identifierId', 'identifierType']), how="inner")
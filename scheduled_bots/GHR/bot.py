@@ -8,6 +8,9 @@ import xml.etree.ElementTree as et
 import time
 from datetime import datetime
 import copy
+import os
+
+from scheduled_bots.utils import get_values_multi, partition_mappings
 
 datasrc = 'https://ghr.nlm.nih.gov/download/TopicIndex.xml'
 
@@ -157,24 +160,16 @@ no_orphanet_dups = orphanet_ghr.drop_duplicates('url')
 print("Original Orphanet Xref list: ", len(orphanet_ghr), "Orphanet Xref list less dups: ",len(no_orphanet_dups))
 orphanet_id_list = no_orphanet_dups['key'].tolist()
 
-# Retrieve the QIDs for each Orphanet ID (The property for Orphanet IDs is P1550)
-i=0
-wdmap = []
-wdmapfail = []
-for i in tqdm(range(len(orphanet_id_list))):
-    orph_id = orphanet_id_list[i]
-    try:
-        sparqlQuery = "SELECT * WHERE {?topic wdt:P1550 \""+orph_id+"\"}"
-        result = wdi_core.WDItemEngine.execute_sparql_query(sparqlQuery)
-        orpha_qid = result["results"]["bindings"][0]["topic"]["value"].replace("http://www.wikidata.org/entity/", "")
-        wdmap.append({'Orphanet':orph_id,'WDID':orpha_qid})
-    except:
-        wdmapfail.append(orph_id)
-    i=i+1
+# Retrieve the QIDs for all Orphanet IDs at once (The property for Orphanet IDs is P1550)
+orpha_qids = get_values_multi("P1550", orphanet_id_list)
+orpha_unique, orpha_multiple, orpha_absent = partition_mappings(orphanet_id_list, orpha_qids)
+wdmap = [{'Orphanet': orph_id, 'WDID': orpha_qid} for orph_id, orpha_qid in orpha_unique.items()]
+wdmapfail = sorted(orpha_absent)
 
 ## Inspect the results for mapping or coverage issues
-wdid_orpha_df = pd.DataFrame(wdmap)
+wdid_orpha_df = pd.DataFrame(wdmap, columns=['Orphanet', 'WDID'])
 print("resulting mapping table has: ",len(wdid_orpha_df)," rows.")
+print("Orphanet IDs not in Wikidata: ", len(orpha_absent), " used on multiple items (skipped): ", len(orpha_multiple))
 
 
 
@@ -5,59 +5,77 @@ from pandas import read_csv
 import requests
 from datetime import datetime
 import copy
+import os
+
+from scheduled_bots.utils import get_values_multi
 
 exppath = 'results/'
+drug_label_cache = 'data/drug_labels.tsv'
+
+## instance of (P31) types searched for drugs, in order of preference
+drug_types = {'Q28885102': 'pharmaceutical product', 'Q12140': 'medication'}
 
 
 
 def disease_search(spl_adr_raw):
-    sparqlQuery = "SELECT * WHERE {?topic wdt:P2892 ?CUI}"
-    result = wdi_core.WDItemEngine.execute_sparql_query(sparqlQuery)
-    wdmap = []
-    i=0
-    while i < len(result["results"]["bindings"]):
-        umls_qid = result["results"]["bindings"][i]["topic"]["value"].replace("http://www.wikidata.org/entity/", "")
-        cui_id = result["results"]["bindings"][i]["CUI"]["value"]
-        tmpdict = {'UMLS CUI':cui_id,'disease_WDID':umls_qid}
-        wdmap.append(tmpdict)
-        i=i+1
-    wdid_umls_all = pd.DataFrame(wdmap)
+    ## Only the CUIs in the ADR table are looked up, in a few chunked queries
     umls_cui_list = spl_adr_raw['UMLS CUI'].unique().tolist()
-    wdid_umls_df = wdid_umls_all.loc[wdid_umls_all['UMLS CUI'].isin(umls_cui_list)]
+    cui_qids = get_values_multi("P2892", umls_cui_list)
+    wdmap = [{'UMLS CUI':cui_id,'disease_WDID':umls_qid} for cui_id, qids in cui_qids.items() for umls_qid in sorted(qids)]
+    wdid_umls_df = pd.DataFrame(wdmap, columns=['UMLS CUI', 'disease_WDID'])
     wdid_umls_df_unique = wdid_umls_df.drop_duplicates(subset='disease_WDID').copy()
     wdid_umls_df_unique.drop_duplicates(subset='UMLS CUI',inplace=True) 
     return wdid_umls_df_unique
 
 
 
-def drug_search(drug_list):
-    pharm_start = 'SELECT ?item ?itemLabel WHERE {?item wdt:P31 wd:Q28885102; rdfs:label ?itemLabel.  FILTER(CONTAINS(LCASE(?itemLabel), "'
-    med_start = 'SELECT ?item ?itemLabel WHERE {?item wdt:P31 wd:Q12140; rdfs:label ?itemLabel. FILTER(CONTAINS(LCASE(?itemLabel), "'
-    query_end = '"@en)).}'
+def load_drug_labels(cache_path=drug_label_cache, refresh=False):
+    ## English labels and aliases of every pharmaceutical product and medication, from one query
+    ## The result is cached on disk; delete the file or use refresh=True to fetch it again
+    if os.path.exists(cache_path) and not refresh:
+        return read_csv(cache_path, sep='\t', dtype=str, keep_default_na=False)
+    sparqlQuery = """SELECT ?item ?type ?label ?is_alias WHERE {
+      VALUES ?type {wd:""" + " wd:".join(drug_types) + """}
+      ?item wdt:P31 ?type .
+      {?item rdfs:label ?label BIND(false AS ?is_alias)} UNION {?item skos:altLabel ?label BIND(true AS ?is_alias)}
+      FILTER(LANG(?label) = "en")
+    }"""
+    result = wdi_core.WDItemEngine.execute_sparql_query(sparqlQuery)
+    drug_labels = pd.DataFrame([{'drug_WDID': x['item']['value'].replace("http://www.wikidata.org/entity/", ""),
+                                 'type': x['type']['value'].replace("http://www.wikidata.org/entity/", ""),
+                                 'label': x['label']['value'],
+                                 'is_alias': x['is_alias']['value']} for x in result["results"]["bindings"]],
+                               columns=['drug_WDID', 'type', 'label', 'is_alias'])
+    drug_labels.to_csv(cache_path, sep='\t', index=False)
+    return drug_labels
+
+
+
+def drug_search(drug_list, drug_labels=None):
+    ## Match drug names against the preloaded labels: an exact label or alias match first, then a label containing
+    ## the name (as the per-drug CONTAINS queries did). Pharmaceutical products are preferred over medications
+    if drug_labels is None:
+        drug_labels = load_drug_labels()
+    type_rank = {t: n for n, t in enumerate(drug_types)}
+    drug_labels = drug_labels.assign(rank=drug_labels['type'].map(type_rank), lower=drug_labels['label'].str.lower())
+    drug_labels = drug_labels.sort_values(['rank', 'drug_WDID'])
+    exact_index = drug_labels.drop_duplicates('lower').set_index('lower')
+    labels_only = drug_labels[drug_labels['is_alias'] != 'true']
     drug_wdid_list = []
     drug_match_failed = []
-    i=0
-    while i < len(drug_list):
-        query_subject = drug_list[i].lower()
-        try:
-            sparqlQuery = pharm_start+query_subject+query_end
-            result = wdi_core.WDItemEngine.execute_sparql_query(sparqlQuery)
-            drug_qid = result["results"]["bindings"][0]["item"]["value"].replace("http://www.wikidata.org/entity/", "")
-            drug_label = result["results"]["bindings"][0]["itemLabel"]["value"]
-            drug_wdid_list.append({'Drug Name':drug_list[i], 'drug_WDID':drug_qid, 'drug_wd_label':drug_label, 
-                                   'instance_of':'pharmaceutical product'})
-        except:
-            try:
-                sparqlQuery = med_start+query_subject+query_end
-                result = wdi_core.WDItemEngine.execute_sparql_query(sparqlQuery)
-                drug_qid = result["results"]["bindings"][0]["item"]["value"].replace("http://www.wikidata.org/entity/", "")
-                drug_label = result["results"]["bindings"][0]["itemLabel"]["value"]
-                drug_wdid_list.append({'Drug Name':drug_list[i], 'drug_WDID':drug_qid, 'drug_wd_label':drug_label, 
-                                       'instance_of':'medication'})
-            except:
-                drug_match_failed.append(drug_list[i])
-        i=i+1
-    drug_wdid_df = pd.DataFrame(drug_wdid_list)    
+    for drug_name in drug_list:
+        query_subject = drug_name.lower()
+        if query_subject in exact_index.index:
+            match = exact_index.loc[query_subject]
+        else:
+            contains = labels_only[labels_only['lower'].str.contains(query_subject, regex=False)]
+            if contains.empty:
+                drug_match_failed.append(drug_name)
+                continue
+            match = contains.iloc[0]
+        drug_wdid_list.append({'Drug Name':drug_name, 'drug_WDID':match['drug_WDID'], 'drug_wd_label':match['label'],
+                               'instance_of':drug_types[match['type']]})
+    drug_wdid_df = pd.DataFrame(drug_wdid_list, columns=['Drug Name', 'drug_WDID', 'drug_wd_label', 'instance_of'])
     return drug_wdid_df, drug_match_failed
 
 
@@ -124,7 +142,7 @@ with open('data/run_no.txt', 'r') as run_file:
 if run_number ==0:
     datasrc = 'data/FinalReferenceStandard200Labels.csv'
 else:
-    datasrc = exppath+'qid_missing_not_attempted.tsv
+    datasrc = exppath+'qid_missing_not_attempted.tsv'
 
 print("run started: ",datetime.now())
 spl_adr_raw = read_csv(datasrc, delimiter="|", header=0, dtype={'Index':int,'PT ID':str,'LLT ID':str}).fillna('None')
@@ -142,7 +160,7 @@ else:
     drug_list = []
     with open(exppath+'drug_match_failed.txt','r') as drug_match_failed:
         for line in drug_match_failed:
-            drug_list.append(line+'\n')
+            drug_list.append(line.strip())
 
 drug_wdid_df, drug_match_failed = drug_search(drug_list)
 
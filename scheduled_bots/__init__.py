@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 PROPS = {
     'ATC code': 'P267',
     'Archive url': 'P1065',
@@ -175,8 +177,10 @@ DEFAULT_CORE_PROPS = ['NCBI Taxonomy ID', 'National Cancer Thesaurus ID', 'UNII'
 DEFAULT_CORE_PROPS_PIDS = set(PROPS[x] for x in DEFAULT_CORE_PROPS)
 
 
+@lru_cache(maxsize=None)
 def get_default_core_props(sparql_endpoint_url='https://query.wikidata.org/sparql') -> set:
     # get the distinct value props from wikidata, and merge that list with the default_core_props listed here
+    # cached, so bots can call this when they build an item instead of at import time
     from wikidataintegrator import wdi_core, wdi_helpers
     h = wdi_helpers.WikibaseHelper(sparql_endpoint_url)
     pids = set(h.get_pid(x) for x in DEFAULT_CORE_PROPS_PIDS)
@@ -28,6 +28,8 @@ from datetime import datetime
 import pandas as pd
 import numpy as np
 
+from scheduled_bots.utils import get_values_multi
+
 import ssl
 ssl._create_default_https_context = ssl._create_unverified_context
 
@@ -85,25 +87,28 @@ df.to_csv("ClinGenBot_Data-Input_" + now.isoformat() + ".csv")  # isoformat
 
 start_time = time.time() # Keep track of how long it takes loop to run
 
+### Normalize the Gene and Disease columns to the format used in Wikidata
+HGNC_ids = df['HGNC Gene ID'].str.replace("HGNC:", "")
+MONDO_ids = df['MONDO Disease ID'].str.replace("_", ":")
+
+### Resolve every HGNC ID (P354) and MonDO ID (P5270) with a few bulk queries instead of two queries per row
+### Each maps an ID to the set of QIDs using it, so IDs on multiple items are kept and flagged below
+HGNC_qids = get_values_multi("P354", HGNC_ids)
+MONDO_qids = get_values_multi("P5270", MONDO_ids)
+
 for index, row in df.iterrows(): 
         
     ### Identify the string in the Gene or Disease column for a given row
-    HGNC = df.loc[index, 'HGNC Gene ID'].replace("HGNC:", "") 
-    MONDO = df.loc[index, 'MONDO Disease ID'].replace("_", ":")
-    
-    ### SparQL query to search for Gene or Disease in Wikidata based on HGNC ID (P354) or MonDO ID (P5270)
-    sparqlQuery_HGNC = "SELECT * WHERE {?gene wdt:P354 \""+HGNC+"\"}" 
-    result_HGNC = wdi_core.WDItemEngine.execute_sparql_query(sparqlQuery_HGNC) 
-    sparqlQuery_MONDO = "SELECT * WHERE {?disease wdt:P5270 \""+MONDO+"\"}" 
-    result_MONDO = wdi_core.WDItemEngine.execute_sparql_query(sparqlQuery_MONDO)
+    HGNC = HGNC_ids[index]
+    MONDO = MONDO_ids[index]
     
-    ### Assign resultant length of dictionary for either Gene or Disease (number of Qid)
-    HGNC_qlength = len(result_HGNC["results"]["bindings"]) 
-    MONDO_qlength = len(result_MONDO["results"]["bindings"])
+    ### Assign resultant number of Qids for either Gene or Disease
+    HGNC_qlength = len(HGNC_qids.get(HGNC, ()))
+    MONDO_qlength = len(MONDO_qids.get(MONDO, ()))
     
     ### Conditional utilizing length value for output table, accounts for absent/present combos
     if HGNC_qlength == 1:
-        HGNC_qid = result_HGNC["results"]["bindings"][0]["gene"]["value"].replace("http://www.wikidata.org/entity/", "")
+        HGNC_qid = next(iter(HGNC_qids[HGNC]))
         df.at[index, 'Gene QID'] = HGNC_qid # Input HGNC Qid in 'Gene QID" cell
     if HGNC_qlength < 1: # If no Qid
         df.at[index, 'Status'] = "error" 
@@ -113,7 +118,7 @@ for index, row in df.iterrows():
         df.at[index, 'Gene QID'] = "multiple"
         
     if MONDO_qlength == 1:
-        MONDO_qid = result_MONDO["results"]["bindings"][0]["disease"]["value"].replace("http://www.wikidata.org/entity/", "") 
+        MONDO_qid = next(iter(MONDO_qids[MONDO]))
         df.at[index, 'Disease QID'] = MONDO_qid  
     if MONDO_qlength < 1: 
         df.at[index, 'Status'] = "error" 
@@ -131,7 +136,7 @@ for index, row in df.iterrows():
         df.at[index, 'Definitive'] = "yes" 
   
     ### Conditional continues to write into WikiData only if 1 Qid for each + Definitive classification 
-    if HGNC_qlength == 1 & MONDO_qlength == 1:
+    if HGNC_qlength == 1 and MONDO_qlength == 1:
         
         ### Call upon create_reference() function created   
         reference = create_reference() 
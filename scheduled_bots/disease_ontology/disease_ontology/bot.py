@@ -2,11 +2,20 @@ from wikidataintegrator import wdi_core, wdi_login, wdi_helpers, wdi_rdf
 from wikidataintegrator.wdi_helpers import try_write
 import os
 from rdflib import Graph, URIRef
-import pandas as pd
 import copy
 from datetime import datetime
 import traceback
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduled_bots.disease_ontology.disease_ontology.do_tables import extract_tables, creation_levels
+from scheduled_bots.shextest.entity_schema import EntitySchemaValidator
+from scheduled_bots.utils import RateLimiter
+
+WORKERS = 4
+EDITS_PER_MINUTE = 60
+# EntitySchema check results of item revisions, kept across runs
+SCHEMA_CACHE = "E323_results.json"
 
 print("Logging in...")
 if "WDUSER" in os.environ and "WDPASS" in os.environ:
@@ -30,11 +39,13 @@ def createIORef():
     referenceURL = wdi_core.WDUrl("https://registry.identifiers.org/registry/doid", prop_nr="P854", is_reference=True)
     return [statedin, referenceURL]
 
-def create(doid):
+def create(doid, limiter=None):
     if doid in doQids.keys(): # check if the DOID is already in wikidata
         qid = doQids[doid].replace("http://www.wikidata.org/entity/", "")
-        item = wdi_core.WDItemEngine(wd_item_id=qid) # get the json for the item to evaluate with ShEx
-        precheck = item.check_entity_schema(eid="E323", output="result")
+        # checked in one batch before the run, see validate_items
+        precheck = prechecks.get(qid)
+        if precheck is None:
+            precheck = validator.validate(wdi_core.WDItemEngine(wd_item_id=qid).get_wd_json_representation())
         if not precheck["result"]:
             wdi_core.WDItemEngine.log("ERROR", "Updating "+qid+" was skipped before updating, it does not fit the EntitySchema provided")
             wdi_core.WDItemEngine.log("ERROR", qid + precheck["reason"])
@@ -46,65 +57,43 @@ def create(doid):
     do_reference = createDOReference(doid) # create the reference to the DOID
     identorg_reference = createIORef() # create the reference to the Identifier.org
 
-    # Select the data from DO to update in Wikidata which is stored in a pandas dataframe
-    tuple = df_doNative[df_doNative["doid"]==doid] # get the row of the dataframe with the DOID
-    dorow = tuple.iloc[0]
+    # Select the data from DO to update in Wikidata from the tables extracted from the ontology
+    dorow = do_tables.terms[doid]
 
     # prepare the statement to update
     statements = []
     # Disease Ontology ID (P31)
-    statements.append(wdi_core.WDString(value=dorow["doid"], prop_nr="P699", references=[copy.deepcopy(do_reference)]))
+    statements.append(wdi_core.WDString(value=doid, prop_nr="P699", references=[copy.deepcopy(do_reference)]))
     # exact match (P2888)
     statements.append(wdi_core.WDUrl(value=dorow["do_uri"], prop_nr="P2888", references=[copy.deepcopy(do_reference)]))
     # identifiers.org URI
-    statements.append(wdi_core.WDUrl("http://identifiers.org/doid/"+dorow["doid"], prop_nr="P2888", references=[copy.deepcopy(identorg_reference)]))
-    uri = str(dorow["do_uri"])
-
-    query = """PREFIX obo: <http://www.geneontology.org/formats/oboInOwl#>
-            PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-            PREFIX oboInOwl: <http://www.geneontology.org/formats/oboInOwl#>
-
-            SELECT * WHERE {"""
-    query += "<" + uri + "> rdfs:subClassOf [ owl:onProperty doid:has_symptom ; owl:someValuesFrom ?symptom ] .} "
+    statements.append(wdi_core.WDUrl("http://identifiers.org/doid/"+doid, prop_nr="P2888", references=[copy.deepcopy(identorg_reference)]))
 
     # symptoms
-    for row in doGraph.query(query):
-        if str(row[0]) not in soQids.keys():
+    for symptom in do_tables.symptoms.get(doid, []):
+        if symptom not in soQids.keys():
             continue
-        statements.append(wdi_core.WDItemID(value=soQids[str(row[0])].replace("http://www.wikidata.org/entity/", ""),
+        statements.append(wdi_core.WDItemID(value=soQids[symptom].replace("http://www.wikidata.org/entity/", ""),
                                           prop_nr="P780", references=[copy.deepcopy(do_reference)]))
 
-    query="""PREFIX obo: <http://www.geneontology.org/formats/oboInOwl#>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        PREFIX oboInOwl: <http://www.geneontology.org/formats/oboInOwl#>
-
-        SELECT ?subClassOf WHERE {"""
-    query+= "<"+uri+"> rdfs:subClassOf ?subClassOf .  FILTER (REGEX(str(?subClassOf), 'http', 'i'))} "
-
     #subclass of
-    for row in doGraph.query(query):
-        if row[0].replace("http://purl.obolibrary.org/obo/DOID_", "DOID:") not in doQids.keys():
-            doQids[row[0].replace("http://purl.obolibrary.org/obo/DOID_", "DOID:")] = create(row[0].replace("http://purl.obolibrary.org/obo/DOID_", "DOID:"))
-        if not (row[0] is None):
-            try:
-                statements.append(wdi_core.WDItemID(value=doQids[row[0].replace("http://purl.obolibrary.org/obo/DOID_", "DOID:")].replace("http://www.wikidata.org/entity/", ""),
-                                           prop_nr="P279", references=[copy.deepcopy(do_reference)]))
-            except:
-                print("doQids is empty for: "+ row[0])
-    query="""PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
-
-        SELECT ?exactMatch WHERE {"""
-    query+= "<"+uri+"> skos:exactMatch ?exactMatch .}"
-    for row in doGraph.query(query):
-        extID = row[0]
+    # missing parents were created in an earlier level, see creation_levels
+    for parent in do_tables.subclass_of.get(doid, []):
+        try:
+            statements.append(wdi_core.WDItemID(value=doQids[parent].replace("http://www.wikidata.org/entity/", ""),
+                                       prop_nr="P279", references=[copy.deepcopy(do_reference)]))
+        except:
+            print("doQids is empty for: "+ parent)
+
+    for extID in do_tables.exact_match.get(doid, []):
         # if "MESH:" in extID:
-        #    statements.append(wdi_core.WDExternalID(row["exactMatch"].replace("MESH:", ""), prop_nr="P486", references=[copy.deepcopy(do_reference)]))
+        #    statements.append(wdi_core.WDExternalID(extID.replace("MESH:", ""), prop_nr="P486", references=[copy.deepcopy(do_reference)]))
         if "NCI:" in extID:
-            statements.append(wdi_core.WDExternalID(row["exactMatch"], prop_nr="P1748", references=[copy.deepcopy(do_reference)]))
+            statements.append(wdi_core.WDExternalID(extID, prop_nr="P1748", references=[copy.deepcopy(do_reference)]))
         if "ICD10CM:" in extID:
-            statements.append(wdi_core.WDExternalID(row["exactMatch"], prop_nr="P4229", references=[copy.deepcopy(do_reference)]))
+            statements.append(wdi_core.WDExternalID(extID, prop_nr="P4229", references=[copy.deepcopy(do_reference)]))
         if "UMLS_CUI:" in extID:
-            statements.append(wdi_core.WDExternalID(row["exactMatch"], prop_nr="P2892", references=[copy.deepcopy(do_reference)]))
+            statements.append(wdi_core.WDExternalID(extID, prop_nr="P2892", references=[copy.deepcopy(do_reference)]))
 
     # refetch the item from Wikidata to add the prepared statements to it and write back to wikidata
     item = wdi_core.WDItemEngine(data=statements, keep_good_ref_statements=True)
@@ -121,18 +110,32 @@ def create(doid):
 
     # Recheck the updated item with ShEx before update to Wikidata
     if qid:
-        postcheck = item.check_entity_schema(eid="E323")
-        if not postcheck:
-            wdi_core.WDItemEngine.log("ERROR Writing " + qid + " was skipped after updating, it does not fit the EntitySchema provided")
+        postcheck = validator.validate(dict(item.get_wd_json_representation(), id=qid), use_cache=False)
+        if not postcheck["result"]:
+            wdi_core.WDItemEngine.log("ERROR", "Writing " + qid + " was skipped after updating, it does not fit the EntitySchema provided")
             curation_report[qid] = postcheck["reason"]
-    else:
+            return
+
+    # only the writes are spaced out, not the loading and checking of the items
+    if limiter and item.require_write:
+        limiter.wait()
+    try_write(item, record_id=doid, record_prop="P699", edit_summary="Updated a Disease Ontology term",
+              login=login)
+    doQids[doid] = item.wd_item_id
+    print(doQids[doid])
+
 
-        # doQids[doid].replace("http://www.wikidata.org/entity/", "")
-        try_write(item, record_id=doid, record_prop="P699", edit_summary="Updated a Disease Ontology term",
-                  login=login)
-        doQids[doid] = item.wd_item_id
-        print(doQids[doid])
+def create_all(doids, limiter=None):
+    # create or update the terms, WORKERS at a time
+    def create_one(doid):
+        try:
+            create(doid, limiter)
+        except Exception as e:
+            traceback.print_exc()
+            wdi_core.WDItemEngine.log("ERROR", wdi_helpers.format_msg(doid, "P699", None, str(e), type(e)))
 
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        list(executor.map(create_one, doids))
 
 
 try:
@@ -142,27 +145,8 @@ try:
     doGraph = Graph()
     doGraph.parse(url, format="xml")
 
-    df_doNative = pd.DataFrame(columns=["do_uri", "doid", "label"])
-
-    qres = doGraph.query(
-        """
-           PREFIX obo: <http://www.geneontology.org/formats/oboInOwl#>
-           PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-           PREFIX oboInOwl: <http://www.geneontology.org/formats/oboInOwl#>
-    
-           SELECT DISTINCT ?do_uri ?doid ?label 
-           WHERE {
-              ?do_uri obo:id ?doid ;
-                      rdfs:label ?label .
-              FILTER NOT EXISTS {?do_uri <http://www.w3.org/2002/07/owl#deprecated> ?value .}
-           } """)
-
-    for row in qres:
-        df_doNative = df_doNative.append({
-         "do_uri": str(row[0]),
-         "doid": str(row[1]),
-         "label":  str(row[2]),
-          }, ignore_index=True)
+    # labels, parents, symptoms and exact matches of all terms, so create() doesn't query the graph
+    do_tables = extract_tables(doGraph)
 
     query = """
       SELECT DISTINCT ?disease ?doid WHERE {?disease  wdt:P699 ?doid .}
@@ -188,12 +172,23 @@ try:
     inwikidata = wdi_core.WDFunctionsEngine.execute_sparql_query(query, as_dataframe=True)
     for index, sorow in inwikidata.iterrows():
         soQids["http://purl.obolibrary.org/obo/SYMP_" + sorow["soid"]] = sorow["symptom"]
-    for index, row in df_doNative.iterrows():
-        doid = row["doid"]
-        create(doid)
-        #print(doid)
+    limiter = RateLimiter(EDITS_PER_MINUTE)
+    existing = [doid for doid in do_tables.terms if doid in doQids]
+    # only the items that conform to the EntitySchema are updated
+    validator = EntitySchemaValidator("E323", cache_path=SCHEMA_CACHE)
+    prechecks = validator.validate_items([doQids[doid].replace("http://www.wikidata.org/entity/", "") for doid in existing])
+    validator.save()
+    curation_report = {}
+
+    # the terms that aren't in wikidata yet, parents before children, so each P279 value exists before it's used
+    missing = [doid for doid in do_tables.terms if doid not in doQids]
+    for level in creation_levels(do_tables.subclass_of, missing):
+        print("Creating {} terms".format(len(level)))
+        create_all(level, limiter)
+    # then the terms that already were
+    create_all(existing, limiter)
 
 except Exception as e:
     traceback.print_exc()
-    wdi_core.WDItemEngine.log("ERROR", wdi_helpers.format_msg(doid, "P699", None, str(e), type(e)))
+    wdi_core.WDItemEngine.log("ERROR", wdi_helpers.format_msg(None, "P699", None, str(e), type(e)))
 
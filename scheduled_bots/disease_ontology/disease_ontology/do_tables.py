@@ -0,0 +1,92 @@
+"""
+Tables of the Disease Ontology terms, extracted from the parsed doid.owl in one pass over the graph
+
+tables = extract_tables(doGraph)
+tables.terms["DOID:162"]  # {'do_uri': 'http://purl.obolibrary.org/obo/DOID_162', 'label': 'cancer'}
+tables.subclass_of["DOID:162"]  # ['DOID:14566']
+"""
+from collections import namedtuple, defaultdict
+
+from rdflib import URIRef, BNode
+from rdflib.namespace import RDFS, OWL, SKOS
+
+OBO_ID = URIRef("http://www.geneontology.org/formats/oboInOwl#id")
+HAS_SYMPTOM = URIRef("http://purl.obolibrary.org/obo/doid#has_symptom")
+DOID_PREFIX = "http://purl.obolibrary.org/obo/DOID_"
+
+# terms: doid -> {'do_uri', 'label'}
+# subclass_of: doid -> [parent doid], symptoms: doid -> [symptom uri], exact_match: doid -> [xref, e.g. 'NCI:C2852']
+DOTables = namedtuple("DOTables", ["terms", "subclass_of", "symptoms", "exact_match"])
+
+
+def uri_to_doid(uri):
+    return str(uri).replace(DOID_PREFIX, "DOID:")
+
+
+def extract_tables(graph):
+    """
+    Non deprecated terms that have an id and a label, and their parents, symptoms and exact matches
+    :param graph: rdflib graph of doid.owl
+    :return: DOTables
+    """
+    deprecated = set(graph.subjects(OWL.deprecated, None))
+    labels = dict()
+    for s, label in graph.subject_objects(RDFS.label):
+        labels.setdefault(s, str(label))
+
+    uri_doid = dict()
+    terms = dict()
+    for s, doid in graph.subject_objects(OBO_ID):
+        if s in deprecated or s not in labels:
+            continue
+        doid = str(doid)
+        uri_doid[s] = doid
+        terms.setdefault(doid, {'do_uri': str(s), 'label': labels[s]})
+
+    # restrictions (blank nodes) on has_symptom, and the symptom they are on
+    symptom_of_restriction = dict()
+    for restriction in graph.subjects(OWL.onProperty, HAS_SYMPTOM):
+        for symptom in graph.objects(restriction, OWL.someValuesFrom):
+            symptom_of_restriction[restriction] = str(symptom)
+
+    subclass_of = defaultdict(list)
+    symptoms = defaultdict(list)
+    for s, o in graph.subject_objects(RDFS.subClassOf):
+        if s not in uri_doid:
+            continue
+        if isinstance(o, BNode):
+            if o in symptom_of_restriction:
+                symptoms[uri_doid[s]].append(symptom_of_restriction[o])
+        elif "http" in str(o).lower():
+            subclass_of[uri_doid[s]].append(uri_to_doid(o))
+
+    exact_match = defaultdict(list)
+    for s, xref in graph.subject_objects(SKOS.exactMatch):
+        if s in uri_doid:
+            exact_match[uri_doid[s]].append(str(xref))
+
+    return DOTables(terms, dict(subclass_of), dict(symptoms), dict(exact_match))
+
+
+def creation_levels(subclass_of, missing):
+    """
+    Order the terms that aren't in Wikidata yet so that each one comes after its parents that aren't either
+    :param subclass_of: doid -> [parent doid]
+    :param missing: doids of the terms to create
+    :return: list of levels, lists of doids whose missing parents are all in earlier levels
+    """
+    missing = set(missing)
+    parents = {doid: (set(subclass_of.get(doid, [])) & missing) - {doid} for doid in missing}
+    levels = []
+    while parents:
+        level = sorted(doid for doid, missing_parents in parents.items() if not missing_parents)
+        if not level:
+            # a subclass cycle. create the rest together, without the parents in the cycle
+            levels.append(sorted(parents))
+            break
+        levels.append(level)
+        for doid in level:
+            del parents[doid]
+        for missing_parents in parents.values():
+            missing_parents.difference_update(level)
+    return levels
@@ -0,0 +1,49 @@
+from rdflib import Graph
+
+from scheduled_bots.disease_ontology.disease_ontology.do_tables import extract_tables, creation_levels
+
+owl = """
+@prefix obo: <http://purl.obolibrary.org/obo/> .
+@prefix doid: <http://purl.obolibrary.org/obo/doid#> .
+@prefix oboInOwl: <http://www.geneontology.org/formats/oboInOwl#> .
+@prefix owl: <http://www.w3.org/2002/07/owl#> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+
+obo:DOID_4 oboInOwl:id "DOID:4" ; rdfs:label "disease" .
+obo:DOID_162 oboInOwl:id "DOID:162" ; rdfs:label "cancer" ;
+    rdfs:subClassOf obo:DOID_14566 ;
+    skos:exactMatch "NCI:C9305", "UMLS_CUI:C0006826" .
+obo:DOID_14566 oboInOwl:id "DOID:14566" ; rdfs:label "disease of cellular proliferation" ;
+    rdfs:subClassOf obo:DOID_4 .
+obo:DOID_8469 oboInOwl:id "DOID:8469" ; rdfs:label "influenza" ;
+    rdfs:subClassOf obo:DOID_4, [ a owl:Restriction ; owl:onProperty doid:has_symptom ;
+                                  owl:someValuesFrom obo:SYMP_0000613 ],
+                    [ a owl:Restriction ; owl:onProperty obo:RO_0002452 ; owl:someValuesFrom obo:SYMP_0000000 ] .
+obo:DOID_1 oboInOwl:id "DOID:1" ; rdfs:label "obsolete term" ; owl:deprecated true ;
+    rdfs:subClassOf obo:DOID_4 .
+"""
+
+
+def test_extract_tables():
+    graph = Graph()
+    graph.parse(data=owl, format="turtle")
+    tables = extract_tables(graph)
+
+    assert set(tables.terms) == {"DOID:4", "DOID:162", "DOID:14566", "DOID:8469"}
+    assert tables.terms["DOID:162"] == {'do_uri': "http://purl.obolibrary.org/obo/DOID_162", 'label': "cancer"}
+    # restrictions aren't parents, and deprecated terms are left out
+    assert tables.subclass_of == {"DOID:162": ["DOID:14566"], "DOID:14566": ["DOID:4"], "DOID:8469": ["DOID:4"]}
+    assert tables.symptoms == {"DOID:8469": ["http://purl.obolibrary.org/obo/SYMP_0000613"]}
+    assert sorted(tables.exact_match["DOID:162"]) == ["NCI:C9305", "UMLS_CUI:C0006826"]
+
+
+def test_creation_levels():
+    subclass_of = {"DOID:162": ["DOID:14566"], "DOID:14566": ["DOID:4"], "DOID:8469": ["DOID:4"],
+                   "DOID:1612": ["DOID:162", "DOID:3459"], "DOID:3459": ["DOID:162"]}
+    # DOID:4 is already in wikidata
+    levels = creation_levels(subclass_of, ["DOID:1612", "DOID:3459", "DOID:162", "DOID:14566", "DOID:8469"])
+    assert levels == [["DOID:14566", "DOID:8469"], ["DOID:162"], ["DOID:3459"], ["DOID:1612"]]
+    # a cycle doesn't stop the terms in it from being created
+    assert creation_levels({"DOID:1": ["DOID:2"], "DOID:2": ["DOID:1"], "DOID:3": []},
+                           ["DOID:1", "DOID:2", "DOID:3"]) == [["DOID:3"], ["DOID:1", "DOID:2"]]
@@ -6,6 +6,7 @@ from tqdm import tqdm
 from scheduled_bots.drugs.chemspider import ChemSpiderMolecule
 from scheduled_bots.drugs.unii import UNIIMolecule
 from scheduled_bots.drugs.pubchem import PubChemMolecule
+from scheduled_bots.drugs.resolver import CompoundResolver, Source
 from wikidataintegrator import wdi_core, wdi_login
 from wikidataintegrator import wdi_property_store
 
@@ -20,8 +21,20 @@ except ImportError:
 
 login = wdi_login.WDLogin(user=WDUSER, pwd=WDPASS)
 
-MOL_TYPES = [UNIIMolecule, ChemSpiderMolecule, PubChemMolecule]
-# MOL_TYPES = [UNIIMolecule]
+# in order of precedence of their statements, by the name of the mol's ID, which its constructor takes
+MOL_TYPES = [('unii', UNIIMolecule), ('csid', ChemSpiderMolecule), ('cid', PubChemMolecule)]
+# MOL_TYPES = MOL_TYPES[:1]
+# lookups a minute, unii is a local file
+PER_MINUTE = {'unii': None, 'csid': 60, 'cid': 300}
+
+
+def id_lookup(name, mol_type):
+    return lambda inchi_key: getattr(mol_type(inchi_key=inchi_key), name)
+
+
+# InChIKey -> (UNII, CSID, CID), kept across runs
+resolver = CompoundResolver([Source(name, id_lookup(name, mol_type), per_minute=PER_MINUTE[name])
+                             for name, mol_type in MOL_TYPES], cache_path="compound_ids.json")
 
 
 for x in wdi_property_store.wd_properties.values():
@@ -31,14 +44,27 @@ wdi_property_store.wd_properties['P231']['core_id'] = True
 
 # inchi_key = "MIXMJCQRHVAJIO-TZHJZOAOSA-N"
 
-def create_item(inchi_key):
+def create_items(inchi_keys):
+    # resolve all the keys at once, then create the items one by one
+    ids = resolver.resolve(inchi_keys)
+    return {inchi_key: create_item(inchi_key, ids[inchi_key]) for inchi_key in tqdm(ids)}
+
+
+def create_item(inchi_key, ids=None):
+    """
+    :param ids: {source name: ID} of the compound, from `resolver`. resolved here if not given
+    """
+    if ids is None:
+        ids = resolver.resolve([inchi_key])[inchi_key]
     mol_instances = []
     wd_data = []
     curr_props = set()
 
-    for mol_type in MOL_TYPES:
+    for name, mol_type in MOL_TYPES:
+        if not ids.get(name):
+            continue
         try:
-            mol = mol_type(inchi_key=inchi_key)
+            mol = mol_type(**{name: ids[name]})
             mol_instances.append(mol)
             wd_data.extend([x for x in mol.to_wikidata() if x.get_prop_nr() not in curr_props])
             curr_props.update(set([x.get_prop_nr() for x in wd_data]))
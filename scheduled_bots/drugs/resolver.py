@@ -0,0 +1,89 @@
+"""
+Resolves InChIKeys to the ID of the compound in each of several sources (e.g. UNII, ChemSpider, PubChem).
+
+All sources are queried at the same time, each from its own threads and at its own rate, so a list of keys takes as
+long as the slowest source needs for it. The IDs are kept in a json file across runs:
+
+resolver = CompoundResolver([Source('cid', lambda key: PubChemMolecule(inchi_key=key).cid, per_minute=300)],
+                            cache_path="compound_ids.json")
+ids = resolver.resolve(inchi_keys)  # inchi_key -> {'cid': 'CID2244'} (None if the source doesn't have it)
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from scheduled_bots.utils import RateLimiter
+
+
+class Source:
+    def __init__(self, name, lookup, per_minute=None, workers=4):
+        """
+        :param name: key of the source's IDs in the results
+        :param lookup: function of an InChIKey that returns the source's ID, and raises ValueError if it has none
+        :param per_minute: max lookups a minute, or None for no limit
+        :param workers: lookups at the same time
+        """
+        self.name = name
+        self.lookup = lookup
+        self.limiter = RateLimiter(per_minute) if per_minute else None
+        self.workers = workers
+
+
+class CompoundResolver:
+    def __init__(self, sources, cache_path=None):
+        self.sources = sources
+        # inchi_key -> {source name: ID, or None if the source doesn't have the compound}
+        self.ids = dict()
+        self.lock = threading.Lock()
+        self.cache_path = None
+        if cache_path:
+            self.load(cache_path)
+
+    def load(self, cache_path):
+        self.cache_path = cache_path
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                self.ids.update(json.load(f))
+
+    def save(self):
+        if self.cache_path:
+            with self.lock:
+                with open(self.cache_path, 'w') as f:
+                    json.dump(self.ids, f, indent=2)
+
+    def lookup(self, source, inchi_key):
+        if source.limiter:
+            source.limiter.wait()
+        try:
+            value = source.lookup(inchi_key)
+        except ValueError:
+            value = None
+        except Exception as e:
+            # not cached, so it's tried again
+            print("{} lookup of {} failed: {}".format(source.name, inchi_key, e))
+            return
+        with self.lock:
+            self.ids.setdefault(inchi_key, dict())[source.name] = value
+
+    def resolve(self, inchi_keys):
+        """
+        Look up the keys each source hasn't resolved yet
+        :return: inchi_key -> {source name: ID or None}
+        """
+        inchi_keys = list(dict.fromkeys(inchi_keys))
+        executors = {source.name: ThreadPoolExecutor(max_workers=source.workers) for source in self.sources}
+        try:
+            futures = [executors[source.name].submit(self.lookup, source, inchi_key)
+                       for inchi_key in inchi_keys for source in self.sources
+                       if source.name not in self.ids.get(inchi_key, dict())]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                future.result()
+        finally:
+            for executor in executors.values():
+                executor.shutdown()
+        self.save()
+        return {inchi_key: {source.name: self.ids.get(inchi_key, dict()).get(source.name) for source in self.sources}
+                for inchi_key in inchi_keys}
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import time
+
+from scheduled_bots.drugs.resolver import CompoundResolver, Source
+
+
+def slow_lookup(ids, delay, calls):
+    def lookup(inchi_key):
+        calls.append(inchi_key)
+        time.sleep(delay)
+        if inchi_key not in ids:
+            raise ValueError("not found")
+        return ids[inchi_key]
+    return lookup
+
+
+def test_resolve():
+    cache_path = os.path.join(tempfile.mkdtemp(), "compound_ids.json")
+    calls = {'cid': [], 'csid': []}
+    sources = [Source('cid', slow_lookup({'A': 'CID1', 'B': 'CID2'}, 0.05, calls['cid']), workers=4),
+               Source('csid', slow_lookup({'A': '11'}, 0.05, calls['csid']), workers=4)]
+    resolver = CompoundResolver(sources, cache_path=cache_path)
+    start = time.monotonic()
+    ids = resolver.resolve(['A', 'B', 'C', 'D', 'A'])
+    # 8 lookups of 0.05 s, at the same time
+    assert time.monotonic() - start < 0.3
+    assert ids == {'A': {'cid': 'CID1', 'csid': '11'}, 'B': {'cid': 'CID2', 'csid': None},
+                   'C': {'cid': None, 'csid': None}, 'D': {'cid': None, 'csid': None}}
+    assert sorted(calls['cid']) == ['A', 'B', 'C', 'D']
+
+    # from the cache
+    resolver = CompoundResolver(sources, cache_path=cache_path)
+    assert resolver.resolve(['B'])['B'] == {'cid': 'CID2', 'csid': None}
+    assert len(calls['cid']) == 4
+
+
+def test_failed_lookup_is_retried():
+    def lookup(inchi_key):
+        raise IOError("timed out")
+    resolver = CompoundResolver([Source('cid', lookup)])
+    assert resolver.resolve(['A']) == {'A': {'cid': None}}
+    assert resolver.ids == {}
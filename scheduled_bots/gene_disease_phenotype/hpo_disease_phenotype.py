@@ -10,9 +10,13 @@ http://compbio.charite.de/jenkins/job/hpo.annotations.2018/
 
 
 """
-import pandas as pd
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 
+import pandas as pd
+
 from tqdm import tqdm
 
 from scheduled_bots import PROPS
@@ -67,77 +71,132 @@ HPO_QID = h.get_qid("Q17027854")
 
 EXT_ID_MAP = dict()
 
-
-def retrieve_qid_from_curie(curie):
-    pid, ext_id_value = cu.parse_curie(curie)
-    pid = h.get_pid(pid)
-    if pid not in EXT_ID_MAP:
-        EXT_ID_MAP[pid] = wdi_helpers.id_mapper(pid, endpoint=h.sparql_endpoint_url)
-    if ext_id_value not in EXT_ID_MAP[pid]:
-        print("Curie not found: {}".format(curie))
-        return None
-    qid = EXT_ID_MAP[pid][ext_id_value]
-    return qid
-
-
-pd.set_option('display.max_columns', 50)
-
-# disease -> phenotypes
-dfdp = pd.read_csv("phenotype.hpoa", sep='\t')
-
-dfdp['disease_curie'] = dfdp['#DB'].map(str) + ":" + dfdp['DB_Object_ID'].map(str)
-dfdp = dfdp.query("Aspect == 'P'")
-dfdp = dfdp[dfdp.Frequency.isnull() | dfdp.Frequency.str.startswith("HP:")]
-dfdp = dfdp[dfdp.Qualifier.isnull()]
-dfdp = dfdp[dfdp['#DB'].isin({'OMIM', 'ORPHA'})]
-
-all_refs = set(chain(*dfdp.DB_Reference.str.split(";")))
-all_pmids = set(x[5:] for x in all_refs if x.startswith("PMID:"))
-
-# if wikibase, create these pmid items
-if WIKIBASE:
-    all_pmid_wd_qid = wdi_helpers.get_values("P698", all_pmids)
-    all_pmid_qid = {pmid: h.URI_QID.get("http://www.wikidata.org/entity/" + v) for pmid, v in all_pmid_wd_qid.items()}
-    all_pmid_qid = {k: v for k, v in all_pmid_qid.items() if v}
-else:
-    for pmid in all_pmids:
-        p = PublicationHelper(pmid, 'pmid', 'europepmc').get_or_create(wd_login)
-    all_pmid_qid = wdi_helpers.get_values("P698", all_pmids)
-
-
-for col in {'Qualifier', 'Onset', 'Frequency', 'Sex', 'Modifier', 'Aspect', 'Date_Created', 'Assigned_By',
-            'DB_Object_ID', '#DB'}:
-    del dfdp[col]
-
-# dfdp = dfdp[dfdp.DB_Reference.str.contains("PMID")]
-gb = dfdp.groupby("disease_curie")
-gb = list(gb)
-for disease_curie, thisdf in tqdm(gb[5358+795+425:]):
-    disease_qid = retrieve_qid_from_curie(disease_curie)
-    if not disease_qid:
-        continue
-    data = []
-    for _, row in thisdf.iterrows():
-        det_method = row.Evidence
-        hpo_id = row.HPO_ID
-        refs = row.DB_Reference.split(";")
-        ref_pmids = set(x[5:] for x in refs if x.startswith("PMID:"))
-        pmid_qids = set(all_pmid_qid[pmid] for pmid in ref_pmids if pmid in all_pmid_qid)
-        hpo_qid = retrieve_qid_from_curie(hpo_id)
-        if not hpo_qid:
-            continue
-
-        qualifiers = [wdi_core.WDItemID(DET_METHOD[det_method], PROPS['determination method'], is_qualifier=True)]
-        ref = [wdi_core.WDItemID(HPO_QID, PROPS['stated in'], is_reference=True)]
-        ref.extend([wdi_core.WDItemID(pmid_qid, PROPS['stated in'], is_reference=True) for pmid_qid in pmid_qids])
-
-        s = wdi_core.WDItemID(hpo_qid, PROPS['symptoms'],
-                              qualifiers=qualifiers, references=[ref])
-        data.append(s)
-
-    item = item_engine(wd_item_id=disease_qid, data=data, append_value=PROPS['symptoms'],
-                       global_ref_mode='CUSTOM', ref_handler=update_retrieved_if_new_multiple_refs)
-    item.write(login)
+# disease curies that have been written are appended to this file, after a first line with the hash of the input file,
+# so a restarted run on the same input skips them. it is deleted when the run finishes
+CHECKPOINT_PATH = "hpo_disease_phenotype.checkpoint"
+
+
+def map_curies(curies, max_workers=4):
+    """
+    Map a Series of curies to qids. The id_mapper for every prefix used is loaded into EXT_ID_MAP up front,
+    in parallel, instead of one at a time when the first curie with that prefix is seen
+    :param curies: pd.Series of curies
+    :return: pd.Series of qids (None if not found)
+    """
+    curie_pid_value = dict()
+    for curie in curies.unique():
+        pid, ext_id_value = cu.parse_curie(curie)
+        curie_pid_value[curie] = (h.get_pid(pid), ext_id_value)
+
+    pids = {pid for pid, _ in curie_pid_value.values() if pid not in EXT_ID_MAP}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        id_maps = executor.map(lambda pid: wdi_helpers.id_mapper(pid, endpoint=h.sparql_endpoint_url), pids)
+        EXT_ID_MAP.update(zip(pids, id_maps))
+
+    curie_qid = {curie: (EXT_ID_MAP[pid] or dict()).get(value) for curie, (pid, value) in curie_pid_value.items()}
+    missing = sorted(curie for curie, qid in curie_qid.items() if not qid)
+    if missing:
+        print("Curies not found ({}): {}".format(len(missing), missing[:20]))
+    return curies.map(curie_qid)
+
+
+def load_hpoa(path="phenotype.hpoa"):
+    # disease -> phenotypes
+    dfdp = pd.read_csv(path, sep='\t')
+
+    dfdp['disease_curie'] = dfdp['#DB'].map(str) + ":" + dfdp['DB_Object_ID'].map(str)
+    dfdp = dfdp.query("Aspect == 'P'")
+    dfdp = dfdp[dfdp.Frequency.isnull() | dfdp.Frequency.str.startswith("HP:")]
+    dfdp = dfdp[dfdp.Qualifier.isnull()]
+    dfdp = dfdp[dfdp['#DB'].isin({'OMIM', 'ORPHA'})]
+
+    dfdp = dfdp[['disease_curie', 'HPO_ID', 'Evidence', 'DB_Reference']].copy()
+    # DB_Reference is a semicolon separated list (e.g. PMID:18382993;OMIM:123456)
+    dfdp['pmids'] = dfdp.DB_Reference.fillna("").str.findall(r"PMID:(\d+)")
+    return dfdp
+
+
+def get_pmid_qids(all_pmids):
+    # if wikibase, create these pmid items
+    if WIKIBASE:
+        all_pmid_wd_qid = wdi_helpers.get_values("P698", all_pmids)
+        all_pmid_qid = {pmid: h.URI_QID.get("http://www.wikidata.org/entity/" + v) for pmid, v in all_pmid_wd_qid.items()}
+        all_pmid_qid = {k: v for k, v in all_pmid_qid.items() if v}
+    else:
+        for pmid in all_pmids:
+            p = PublicationHelper(pmid, 'pmid', 'europepmc').get_or_create(wd_login)
+        all_pmid_qid = wdi_helpers.get_values("P698", all_pmids)
+    return all_pmid_qid
+
+
+def disease_statement_batches(dfdp, all_pmid_qid, skip=frozenset()):
+    """
+    Yields (disease_curie, disease_qid, statements) for each disease, skipping the disease curies in `skip`
+    `dfdp` must have the disease_qid and hpo_qid columns set (see `map_curies`)
+    """
+    dfdp = dfdp[dfdp.disease_qid.notnull() & dfdp.hpo_qid.notnull() & ~dfdp.disease_curie.isin(skip)]
+    cols = ['hpo_qid', 'Evidence', 'pmids']
+    for (disease_curie, disease_qid), thisdf in dfdp.groupby(['disease_curie', 'disease_qid']):
+        data = []
+        for hpo_qid, det_method, pmids in zip(*(thisdf[col] for col in cols)):
+            pmid_qids = set(all_pmid_qid[pmid] for pmid in pmids if pmid in all_pmid_qid)
+
+            qualifiers = [wdi_core.WDItemID(DET_METHOD[det_method], PROPS['determination method'], is_qualifier=True)]
+            ref = [wdi_core.WDItemID(HPO_QID, PROPS['stated in'], is_reference=True)]
+            ref.extend([wdi_core.WDItemID(pmid_qid, PROPS['stated in'], is_reference=True) for pmid_qid in pmid_qids])
+
+            s = wdi_core.WDItemID(hpo_qid, PROPS['symptoms'],
+                                  qualifiers=qualifiers, references=[ref])
+            data.append(s)
+        yield disease_curie, disease_qid, data
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_checkpoint(input_hash, path=CHECKPOINT_PATH):
+    # the disease curies done in a previous run on the same input. a checkpoint of another input is ignored
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if not lines or lines[0] != input_hash:
+        return set()
+    return set(lines[1:])
+
+
+def main(path="phenotype.hpoa", checkpoint_path=CHECKPOINT_PATH):
+    dfdp = load_hpoa(path)
+    all_pmids = set(chain(*dfdp.pmids))
+    all_pmid_qid = get_pmid_qids(all_pmids)
+
+    dfdp['disease_qid'] = map_curies(dfdp.disease_curie)
+    dfdp['hpo_qid'] = map_curies(dfdp.HPO_ID)
+
+    input_hash = file_hash(path)
+    done = read_checkpoint(input_hash, checkpoint_path)
+    print("skipping {} diseases already done".format(len(done)))
+    batches = disease_statement_batches(dfdp, all_pmid_qid, skip=done)
+    total = dfdp.disease_curie.nunique() - len(done)
+    with open(checkpoint_path, 'a' if done else 'w') as checkpoint:
+        if not done:
+            checkpoint.write(input_hash + "\n")
+        for disease_curie, disease_qid, data in tqdm(batches, total=total):
+            item = item_engine(wd_item_id=disease_qid, data=data, append_value=PROPS['symptoms'],
+                               global_ref_mode='CUSTOM', ref_handler=update_retrieved_if_new_multiple_refs)
+            item.write(login)
+            checkpoint.write(disease_curie + "\n")
+            checkpoint.flush()
+    os.remove(checkpoint_path)
+
+
+if __name__ == "__main__":
+    main()
 
 
 """
@@ -1,16 +1,17 @@
 import argparse
 import json
 import os
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from datetime import datetime
 from functools import partial
-from time import gmtime, strftime
+from sys import intern
+from time import gmtime, strftime, time
 
 import pytz
 from tqdm import tqdm
 
 from scheduled_bots import PROPS, get_default_core_props
-from scheduled_bots.utils import get_values
+from scheduled_bots.utils import get_values_multi
 from wikidataintegrator import ref_handlers
 from wikidataintegrator import wdi_core, wdi_helpers, wdi_login
 from wikidataintegrator.wdi_helpers import id_mapper
@@ -35,75 +36,63 @@ __metadata__ = {
 }
 
 
-class GWASCatalog(object):
-    def __init__(self, catalog_tsv_path=GWAS_PATH):
-        self.data = set()
-        self.header = None
-        line_num = 0
-        with open(catalog_tsv_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-
-                # Ignore header comments
-                if line.startswith("#"):
-                    continue
-
-                line_num += 1
-
-                # Parse field headers
-                if line_num == 1:
-                    self.header = line.split("\t")
-                    continue
-
-                # Parse TSV
-                try:
-                    fields = line.split("\t")
-                    for phenotype, uri in zip(fields[4].split(";"), fields[6].split(";")):
-                        # Skip non Disease Ontology entries
-                        if "DOID" not in uri:
-                            continue
-
-                        gdr = GeneDiseaseRelationship(ncbi=fields[1],
-                                                      symbol=fields[2],
-                                                      taxon=fields[3],
-                                                      relationship=fields[5],
-                                                      doid=uri.split("_")[1],
-                                                      phenotype=phenotype,
-                                                      pmid=fields[7],
-                                                      link=fields[8])
-
-                        self.data.add(gdr)
-                except IndexError:
-                    raise ValueError("TSV Parsing failed for line: '{}'".format(line))
-
-
-class GeneDiseaseRelationship:
-    phenocarta_ref_source = 'https://gemma.msl.ubc.ca/phenotypes.html?phenotypeUrlId=DOID_{doid}&ncbiId={ncbi}'
+def parse_gwas_catalog(catalog_tsv_path=GWAS_PATH):
+    """
+    Stream the GWAS catalog TSV, yielding a GeneDiseaseRelationship for each (gene, Disease Ontology phenotype) pair.
+    IDs are interned, as the same gene, disease and pmid strings are repeated on many lines
+    """
+    line_num = 0
+    with open(catalog_tsv_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+
+            # Ignore header comments
+            if line.startswith("#"):
+                continue
+
+            line_num += 1
+
+            # Skip field headers
+            if line_num == 1:
+                continue
+
+            # Parse TSV
+            try:
+                fields = line.split("\t")
+                ncbi, symbol, taxon = intern(fields[1]), intern(fields[2]), intern(fields[3])
+                relationship, pmid, link = intern(fields[5]), intern(fields[7]), fields[8]
+                for phenotype, uri in zip(fields[4].split(";"), fields[6].split(";")):
+                    # Skip non Disease Ontology entries
+                    if "DOID" not in uri:
+                        continue
+                    yield GeneDiseaseRelationship(ncbi, symbol, taxon, relationship, intern(uri.split("_")[1]),
+                                                  phenotype, pmid, link)
+            except IndexError:
+                raise ValueError("TSV Parsing failed for line: '{}'".format(line))
 
-    def __init__(self, ncbi, symbol, taxon, relationship, doid, phenotype, pmid, link):
-        self.ncbi = ncbi
-        self.symbol = symbol
-        self.taxon = taxon
-        self.relationship = relationship
-        self.doid = doid
-        self.phenotype = phenotype
-        self.pmid = pmid
-        self.link = link
 
-        self.phenocarta_url = GeneDiseaseRelationship.phenocarta_ref_source.format(doid=self.doid, ncbi=self.ncbi)
+class GWASCatalog(object):
+    def __init__(self, catalog_tsv_path=GWAS_PATH):
+        # keep the first relationship seen for each (gene, disease) pair
+        data = dict()
+        for gdr in parse_gwas_catalog(catalog_tsv_path):
+            data.setdefault((gdr.ncbi, gdr.doid), gdr)
+        self.data = list(data.values())
 
-    def __hash__(self):
-        return hash((self.ncbi, self.doid))
 
-    def __eq__(self, other):
-        return (self.ncbi, self.doid) == (other.ncbi, other.doid)
+class GeneDiseaseRelationship(namedtuple('GeneDiseaseRelationship',
+                                         ['ncbi', 'symbol', 'taxon', 'relationship', 'doid', 'phenotype', 'pmid',
+                                          'link'])):
+    __slots__ = ()
+    phenocarta_ref_source = 'https://gemma.msl.ubc.ca/phenotypes.html?phenotypeUrlId=DOID_{doid}&ncbiId={ncbi}'
 
-    def __ne__(self, other):
-        return not (self == other)
+    @property
+    def phenocarta_url(self):
+        return GeneDiseaseRelationship.phenocarta_ref_source.format(doid=self.doid, ncbi=self.ncbi)
 
 
 class GeneDiseaseBot(object):
-    def __init__(self, catalog_tsv_path=GWAS_PATH, login=None, fast_run=False, write=True):
+    def __init__(self, catalog_tsv_path=GWAS_PATH, login=None, fast_run=True, write=True):
         self.gwas_catalog = GWASCatalog(catalog_tsv_path=catalog_tsv_path)
 
         self.fast_run_base_gene_filter = {PROPS['Entrez Gene ID']: "", PROPS['found in taxon']: 'Q15978631'}
@@ -124,21 +113,31 @@ class GeneDiseaseBot(object):
 
         self.wd_items = []
 
+    def get_pmid_qids(self, pmids):
+        # the catalog has "PMID:123" or "123". Look up all of them at once, then create the missing ones
+        pmid_values = {pmid: pmid.replace("PMID:", "") for pmid in pmids}
+        value_qids = get_values_multi(PROPS['PubMed ID'], pmid_values.values())
+        # if there are duplicate items for a pmid, the oldest one
+        pmid_qid_map = {pmid: min(value_qids[value], key=lambda qid: int(qid[1:]))
+                        for pmid, value in pmid_values.items() if value in value_qids}
+        print("Found {} pmids".format(len(pmid_qid_map)))
+        for pmid in pmids - set(pmid_qid_map.keys()):
+            qid, _, success = wdi_helpers.PublicationHelper(pmid_values[pmid], id_type="pmid",
+                                                            source="europepmc").get_or_create(self.login)
+            if success:
+                pmid_qid_map[pmid] = qid
+        return pmid_qid_map
+
     def run(self):
+        # list of statements to add to each gene/disease item, and the relationship it came from
         wd_genes = defaultdict(list)
         wd_diseases = defaultdict(list)
-        gdrs = list(self.gwas_catalog.data)
+        gdrs = self.gwas_catalog.data
 
         print("Get or create references")
         pmids = set([x.pmid for x in gdrs])
         print("Need {} pmids".format(len(pmids)))
-        self.pmid_qid_map = get_values("P698", pmids)
-        print("Found {} pmids".format(len(self.pmid_qid_map)))
-        for pmid in pmids - set(self.pmid_qid_map.keys()):
-            qid, _, success = wdi_helpers.PublicationHelper(pmid.replace("PMID:", ""), id_type="pmid",
-                                                            source="europepmc").get_or_create(self.login)
-            if success:
-                self.pmid_qid_map[pmid] = qid
+        self.pmid_qid_map = self.get_pmid_qids(pmids)
 
         print("Building relationships & references")
         for gdr in tqdm(gdrs):
@@ -172,21 +171,21 @@ class GeneDiseaseBot(object):
                                                                  type(e)))
                 continue
 
-            gdr.gene_wditem = items['gene_item']
-            gdr.disease_wditem = items['disease_item']
-
             # Aggregating data to reduce wikidata updates
-            wd_genes[gene_wdid].append(gdr)
-            wd_diseases[doid_wdid].append(gdr)
+            wd_genes[gene_wdid].append((gdr, items['disease_item']))
+            wd_diseases[doid_wdid].append((gdr, items['gene_item']))
 
+        # With fast_run, both sides share one fastrun container each (per base filter), so items whose
+        # genetic association statements are unchanged are compared locally and skipped without being fetched
         print("Begin creating Wikidata Gene items with new relationships")
 
         # Create Wikidata items for genes
-        for wdid, gdrs in tqdm(wd_genes.items()):
+        for wdid, gdr_statements in tqdm(wd_genes.items()):
+            gdr = gdr_statements[0][0]
             # Attach updated disease information to gene
             try:
                 gene_wd_item = wdi_core.WDItemEngine(wd_item_id=wdid,
-                                                     data=[gdr.disease_wditem for gdr in gdrs],
+                                                     data=[statement for _, statement in gdr_statements],
                                                      append_value=[PROPS["genetic association"]],
                                                      fast_run=self.fast_run,
                                                      fast_run_base_filter=self.fast_run_base_gene_filter,
@@ -194,7 +193,7 @@ class GeneDiseaseBot(object):
                                                      ref_handler=update_retrieved_if_new,
                                                      global_ref_mode="CUSTOM",
                                                      core_props=core_props)
-                wd_item = {'item': gene_wd_item, 'record_id': gdrs[0].ncbi, 'record_prop': PROPS['Entrez Gene ID']}
+                wd_item = {'item': gene_wd_item, 'record_id': gdr.ncbi, 'record_prop': PROPS['Entrez Gene ID']}
                 self.write_item(wd_item)
             except Exception as e:
                 msg = "Problem Creating Gene WDItem; skipping {}".format(gdr.ncbi)
@@ -202,11 +201,12 @@ class GeneDiseaseBot(object):
                                           wdi_helpers.format_msg(gdr.ncbi, PROPS['Entrez Gene ID'], wdid, msg, type(e)))
 
         print("Begin creating Wikidata Disease items with new relationships")
-        for wdid, gdrs in tqdm(wd_diseases.items()):
+        for wdid, gdr_statements in tqdm(wd_diseases.items()):
+            gdr = gdr_statements[0][0]
             # Attach updated gene information to disease
             try:
                 disease_wd_item = wdi_core.WDItemEngine(wd_item_id=wdid,
-                                                        data=[gdr.gene_wditem for gdr in gdrs],
+                                                        data=[statement for _, statement in gdr_statements],
                                                         append_value=[PROPS["genetic association"]],
                                                         fast_run=self.fast_run,
                                                         fast_run_base_filter=self.fast_run_base_disease_filter,
@@ -214,7 +214,7 @@ class GeneDiseaseBot(object):
                                                         ref_handler=update_retrieved_if_new,
                                                         global_ref_mode="CUSTOM",
                                                         core_props=core_props)
-                wd_item = {'item': disease_wd_item, 'record_id': "DOID:{}".format(gdrs[0].doid),
+                wd_item = {'item': disease_wd_item, 'record_id': "DOID:{}".format(gdr.doid),
                            'record_prop': PROPS['Disease Ontology ID']}
                 self.write_item(wd_item)
             except Exception as e:
@@ -303,6 +303,7 @@ if __name__ == "__main__":
     parser.add_argument('--dummy', help='do not actually do write', action='store_true')
     parser.add_argument('--fastrun', dest='fastrun', action='store_true')
     parser.add_argument('--no-fastrun', dest='fastrun', action='store_false')
+    parser.add_argument('--benchmark', help='only parse the catalog and report the throughput', action='store_true')
     parser.set_defaults(fastrun=True)
 
     args = parser.parse_args()
@@ -310,6 +311,14 @@ if __name__ == "__main__":
 
     assert os.path.exists(path), "Cannot find {}".format(path)
 
+    if args.benchmark:
+        t = time()
+        n = sum(1 for _ in parse_gwas_catalog(path))
+        t = time() - t
+        print("parsed {} relationships in {:.2f} s ({:.0f} per second)".format(n, t, n / t))
+        print("{} unique (gene, disease) pairs".format(len(GWASCatalog(path).data)))
+        exit(0)
+
     last_modified = datetime.fromtimestamp(os.path.getmtime(path), pytz.timezone("UTC"))
 
     run_id = datetime.now().strftime('%Y%m%d_%H:%M')
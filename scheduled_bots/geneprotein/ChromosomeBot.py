@@ -18,8 +18,6 @@ import pandas as pd
 from scheduled_bots import get_default_core_props
 from wikidataintegrator import wdi_core, wdi_helpers
 
-core_props = get_default_core_props()
-
 
 class ChromosomeBot:
 
@@ -168,7 +166,7 @@ class ChromosomeBot:
         wd_item = wdi_core.WDItemEngine(data=statements,
                                         append_value=['P31'], fast_run=True,
                                         fast_run_base_filter={'P703': organism_info['wdid'], 'P2249': ''},
-                                        core_props=core_props)
+                                        core_props=get_default_core_props())
         if wd_item.wd_item_id:
             return wd_item.wd_item_id
 
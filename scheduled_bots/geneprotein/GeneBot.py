@@ -27,8 +27,10 @@ import json
 import os
 import sys
 import time
+import tracemalloc
 import traceback
-from datetime import datetime
+from collections import namedtuple
+from datetime import datetime, timedelta
 from functools import partial
 from itertools import chain
 
@@ -36,11 +38,11 @@ from tqdm import tqdm
 
 from scheduled_bots import get_default_core_props, PROPS
 from scheduled_bots.geneprotein.Downloader import MyGeneDownloader
+from scheduled_bots.utils import StageTimer, RecordedResponses, grouper
 from wikidataintegrator import wdi_login, wdi_core, wdi_helpers
 from wikidataintegrator.ref_handlers import update_retrieved_if_new
 from wikidataintegrator.wdi_fastrun import FastRunContainer
 
-core_props = get_default_core_props()
 
 FASTRUN_PROPS = {'Entrez Gene ID', 'strand orientation', 'Saccharomyces Genome Database ID', 'RefSeq RNA ID',
                  'ZFIN Gene ID', 'Ensembl Transcript ID', 'HGNC ID', 'encodes', 'genomic assembly', 'found in taxon',
@@ -51,10 +53,14 @@ FASTRUN_PROPS = {'Entrez Gene ID', 'strand orientation', 'Saccharomyces Genome D
 DAYS = 120
 update_retrieved_if_new = partial(update_retrieved_if_new, days=DAYS)
 
+# per-stage timings for the run: download, validate, tag, statements, fastrun, write
+timer = StageTimer()
+
 from scheduled_bots.geneprotein import HelperBot, organisms_info, type_of_gene_map, descriptions_by_type, not_worth_adding
 from scheduled_bots.geneprotein.ChromosomeBot import ChromosomeBot
 from scheduled_bots.geneprotein.MicrobialChromosomeBot import MicrobialChromosomeBot
-from scheduled_bots.geneprotein.HelperBot import make_ref_source, parse_mygene_src_version, source_items
+from scheduled_bots.geneprotein.HelperBot import make_ref_source, parse_mygene_src_version, source_items, \
+    item_qualifiers
 
 try:
     from scheduled_bots.local import WDUSER, WDPASS
@@ -63,7 +69,8 @@ except ImportError:
         WDUSER = os.environ['WDUSER']
         WDPASS = os.environ['WDPASS']
     else:
-        raise ValueError("WDUSER and WDPASS must be specified in local.py or as environment variables")
+        # only needed to login, which --offline/--record runs don't do
+        WDUSER = WDPASS = None
 
 __metadata__ = {
     'name': 'GeneBot',
@@ -77,6 +84,16 @@ source_ref_id = {
     'entrez': 'Entrez Gene ID'
 }
 
+ASSEMBLY_QID = {'hg38': 'Q20966585', 'hg19': 'Q21067546'}
+
+# one genomic_pos entry from mygene, with start/end as the strings that go into the statements
+GenomicPos = namedtuple('GenomicPos', ['chr', 'start', 'end', 'strand', 'assembly'])
+
+
+def parse_genomic_pos(genomic_pos_values, assembly=None):
+    return [GenomicPos(x['chr'], str(int(x['start'])), str(int(x['end'])),
+                       'Q22809680' if x['strand'] == 1 else 'Q22809711', assembly) for x in genomic_pos_values]
+
 
 class Gene:
     """
@@ -285,29 +302,33 @@ class Gene:
         return s
 
     def create_item(self, fast_run=True, write=True):
-        self.parse_external_ids()
-        self.statements = self.create_statements()
-        # remove subclass of gene statements
-        # s = wdi_core.WDItemID("Q7187", "P279")
-        # setattr(s, 'remove', '')
-        self.create_label()
-        self.create_description()
-        self.create_aliases()
+        with timer.stage('statements'):
+            self.parse_external_ids()
+            self.statements = self.create_statements()
+            # remove subclass of gene statements
+            # s = wdi_core.WDItemID("Q7187", "P279")
+            # setattr(s, 'remove', '')
+            self.create_label()
+            self.create_description()
+            self.create_aliases()
 
         self.fast_run_base_filter = {PROPS['Entrez Gene ID']: '',
                                      PROPS['found in taxon']: self.organism_info['wdid']}
 
-        self.wd_item_gene = wdi_core.WDItemEngine(data=self.statements,
-                                                  append_value=[PROPS['instance of']],
-                                                  fast_run=fast_run, fast_run_base_filter=self.fast_run_base_filter,
-                                                  fast_run_use_refs=True, ref_handler=update_retrieved_if_new,
-                                                  global_ref_mode="CUSTOM",
-                                                  core_props=core_props)
+        with timer.stage('fastrun'):
+            self.wd_item_gene = wdi_core.WDItemEngine(data=self.statements,
+                                                      append_value=[PROPS['instance of']],
+                                                      fast_run=fast_run,
+                                                      fast_run_base_filter=self.fast_run_base_filter,
+                                                      fast_run_use_refs=True, ref_handler=update_retrieved_if_new,
+                                                      global_ref_mode="CUSTOM",
+                                                      core_props=get_default_core_props())
+            self.wd_item_gene = self.set_label_desc_aliases(self.wd_item_gene)
 
-        self.wd_item_gene = self.set_label_desc_aliases(self.wd_item_gene)
-        self.status = wdi_helpers.try_write(self.wd_item_gene, self.external_ids['Entrez Gene ID'],
-                                            PROPS['Entrez Gene ID'],
-                                            self.login, write=write)
+        with timer.stage('write'):
+            self.status = wdi_helpers.try_write(self.wd_item_gene, self.external_ids['Entrez Gene ID'],
+                                                PROPS['Entrez Gene ID'],
+                                                self.login, write=write)
 
 
 class ChromosomalGene(Gene):
@@ -362,8 +383,9 @@ class ChromosomalGene(Gene):
                                                list(self.external_ids['Ensembl Gene ID'])[0], login=self.login)
 
     def create_item(self, fast_run=True, write=True):
-        self.parse_external_ids()
-        self.create_ref_sources()
+        with timer.stage('statements'):
+            self.parse_external_ids()
+            self.create_ref_sources()
         return super().create_item(fast_run, write)
 
     def create_gp_statements_chr(self):
@@ -384,19 +406,20 @@ class ChromosomalGene(Gene):
             raise ValueError()
         if not genomic_pos_ref:
             return None
-        all_chr = set([self.chr_num_wdid[x['chr']] for x in genomic_pos_values])
-        all_strand = set(['Q22809680' if x['strand'] == 1 else 'Q22809711' for x in genomic_pos_values])
+        genomic_pos_values = parse_genomic_pos(genomic_pos_values)
+        all_chr = set([self.chr_num_wdid[x.chr] for x in genomic_pos_values])
+        all_strand = set([x.strand for x in genomic_pos_values])
 
         s = []
         for genomic_pos_value in genomic_pos_values:
             # create qualifier for start/stop/orientation
-            chrom_wdid = self.chr_num_wdid[genomic_pos_value['chr']]
-            qualifiers = [wdi_core.WDItemID(chrom_wdid, PROPS['chromosome'], is_qualifier=True)]
+            chrom_wdid = self.chr_num_wdid[genomic_pos_value.chr]
+            qualifiers = item_qualifiers((chrom_wdid, PROPS['chromosome']))
 
             # genomic start and end
-            s.append(wdi_core.WDString(str(int(genomic_pos_value['start'])), PROPS['genomic start'],
+            s.append(wdi_core.WDString(genomic_pos_value.start, PROPS['genomic start'],
                                        references=[genomic_pos_ref], qualifiers=qualifiers))
-            s.append(wdi_core.WDString(str(int(genomic_pos_value['end'])), PROPS['genomic end'],
+            s.append(wdi_core.WDString(genomic_pos_value.end, PROPS['genomic end'],
                                        references=[genomic_pos_ref], qualifiers=qualifiers))
 
         for chr in all_chr:
@@ -459,7 +482,7 @@ class MicrobeGene(Gene):
         # create qualifier for chromosome (which has the refseq ID on it)
         chr_refseq = genomic_pos_value['chr']
         chr_qid = self.refseq_qid_chrom[chr_refseq]
-        qualifiers = [wdi_core.WDItemID(value=chr_qid, prop_nr=PROPS['chromosome'], is_qualifier=True)]
+        qualifiers = item_qualifiers((chr_qid, PROPS['chromosome']))
 
         # strand orientation
         strand_orientation = 'Q22809680' if genomic_pos_value['strand'] == 1 else 'Q22809711'
@@ -478,13 +501,11 @@ class HumanGene(ChromosomalGene):
     def create_statements(self):
         # create gene statements
         s = Gene.create_statements(self)
-        entrez_ref = make_ref_source(self.record['entrezgene']['@source'], PROPS['Entrez Gene ID'],
-                                     self.external_ids['Entrez Gene ID'], login=self.login)
 
         # add on human specific gene statements
         for key in ['HGNC ID', 'HGNC Gene Symbol']:
             if key in self.external_ids:
-                s.append(wdi_core.WDString(self.external_ids[key], PROPS[key], references=[entrez_ref]))
+                s.append(wdi_core.WDString(self.external_ids[key], PROPS[key], references=[self.entrez_ref]))
 
         # add on gene position statements
         if 'genomic_pos' in self.record:
@@ -515,9 +536,7 @@ class HumanGene(ChromosomalGene):
         if not self.entrez_ref:
             self.create_ref_sources()
 
-        genomic_pos_values = self.record['genomic_pos']['@value']
         genomic_pos_source = self.record['genomic_pos']['@source']
-        genomic_pos_id_prop = source_ref_id[genomic_pos_source['id']]
         if genomic_pos_source['id'] == "entrez":
             genomic_pos_ref = self.entrez_ref
         elif genomic_pos_source['id'] == "ensembl":
@@ -526,70 +545,58 @@ class HumanGene(ChromosomalGene):
             raise ValueError()
         if not genomic_pos_ref:
             return None
-        assembly_hg38 = wdi_core.WDItemID("Q20966585", PROPS['genomic assembly'], is_qualifier=True)
-
-        for x in genomic_pos_values:
-            x['assembly'] = 'hg38'
+        assembly_hg38 = (ASSEMBLY_QID['hg38'], PROPS['genomic assembly'])
+        assembly_hg19 = (ASSEMBLY_QID['hg19'], PROPS['genomic assembly'])
 
+        # combine hg38 and hg19 together, without touching the record
+        genomic_pos_values = parse_genomic_pos(self.record['genomic_pos']['@value'], 'hg38')
         do_hg19 = False
         if 'genomic_pos_hg19' in self.record:
             do_hg19 = True
-            genomic_pos_value_hg19 = self.record['genomic_pos_hg19']['@value']
-            genomic_pos_source_hg19 = self.record['genomic_pos_hg19']['@source']
-            genomic_pos_id_prop_hg19 = source_ref_id[genomic_pos_source_hg19['id']]
-            assembly_hg19 = wdi_core.WDItemID("Q21067546", PROPS['genomic assembly'], is_qualifier=True)
-            # combine all together
-            for x in genomic_pos_value_hg19:
-                x['assembly'] = 'hg19'
-            genomic_pos_values.extend(genomic_pos_value_hg19)
+            genomic_pos_values.extend(parse_genomic_pos(self.record['genomic_pos_hg19']['@value'], 'hg19'))
 
         # remove those where we don't know the chromosome
-        genomic_pos_values = [x for x in genomic_pos_values if x['chr'] in self.chr_num_wdid]
-        # print(len(genomic_pos_values))
+        genomic_pos_values = [x for x in genomic_pos_values if x.chr in self.chr_num_wdid]
 
-        all_chr = set([self.chr_num_wdid[x['chr']] for x in genomic_pos_values])
-        all_strand = set(['Q22809680' if x['strand'] == 1 else 'Q22809711' for x in genomic_pos_values])
+        all_chr = set([self.chr_num_wdid[x.chr] for x in genomic_pos_values])
+        all_strand = set([x.strand for x in genomic_pos_values])
 
         s = []
         for genomic_pos_value in genomic_pos_values:
-
             # create qualifiers (chromosome and assembly)
-            chrom_wdid = self.chr_num_wdid[genomic_pos_value['chr']]
-            qualifiers = [wdi_core.WDItemID(chrom_wdid, PROPS['chromosome'], is_qualifier=True)]
-            if genomic_pos_value['assembly'] == 'hg38':
-                qualifiers.append(assembly_hg38)
-                ref = genomic_pos_ref
-            elif genomic_pos_value['assembly'] == 'hg19':
-                qualifiers.append(assembly_hg19)
-                ref = genomic_pos_ref
+            chrom_wdid = self.chr_num_wdid[genomic_pos_value.chr]
+            assembly = assembly_hg38 if genomic_pos_value.assembly == 'hg38' else assembly_hg19
+            qualifiers = item_qualifiers((chrom_wdid, PROPS['chromosome']), assembly)
 
             # genomic start and end
-            s.append(wdi_core.WDString(str(int(genomic_pos_value['start'])), PROPS['genomic start'],
-                                       references=[ref], qualifiers=qualifiers))
-            s.append(wdi_core.WDString(str(int(genomic_pos_value['end'])), PROPS['genomic end'],
-                                       references=[ref], qualifiers=qualifiers))
+            s.append(wdi_core.WDString(genomic_pos_value.start, PROPS['genomic start'],
+                                       references=[genomic_pos_ref], qualifiers=qualifiers))
+            s.append(wdi_core.WDString(genomic_pos_value.end, PROPS['genomic end'],
+                                       references=[genomic_pos_ref], qualifiers=qualifiers))
+
+        assembly_qualifiers = item_qualifiers(assembly_hg38, assembly_hg19) if do_hg19 else item_qualifiers(assembly_hg38)
 
         # strand orientations
         # if the same for all, only put one statement
         if len(all_strand) == 1 and do_hg19:
             strand_orientation = list(all_strand)[0]
             s.append(wdi_core.WDItemID(strand_orientation, PROPS['strand orientation'],
-                                       references=[genomic_pos_ref], qualifiers=[assembly_hg38, assembly_hg19]))
+                                       references=[genomic_pos_ref], qualifiers=assembly_qualifiers))
         elif len(all_strand) == 1 and not do_hg19:
             strand_orientation = list(all_strand)[0]
             s.append(wdi_core.WDItemID(strand_orientation, PROPS['strand orientation'],
-                                       references=[genomic_pos_ref], qualifiers=[assembly_hg38]))
+                                       references=[genomic_pos_ref], qualifiers=assembly_qualifiers))
 
         # chromosome
         # if the same for all, only put one statement
         if do_hg19 and len(all_chr) == 1:
             chrom_wdid = list(all_chr)[0]
             s.append(wdi_core.WDItemID(chrom_wdid, PROPS['chromosome'],
-                                       references=[genomic_pos_ref], qualifiers=[assembly_hg38, assembly_hg19]))
+                                       references=[genomic_pos_ref], qualifiers=assembly_qualifiers))
         elif len(all_chr) == 1 and not do_hg19:
             chrom_wdid = list(all_chr)[0]
             s.append(wdi_core.WDItemID(chrom_wdid, PROPS['chromosome'],
-                                       references=[genomic_pos_ref], qualifiers=[assembly_hg38]))
+                                       references=[genomic_pos_ref], qualifiers=assembly_qualifiers))
 
         # print(s)
         return s
@@ -638,12 +645,12 @@ class GeneBot:
             else:
                 yield record
 
-    def cleanup(self, releases, last_updated):
+    def cleanup(self, releases, last_updated, write=True):
         """
 
         :param releases:
         :param last_updated:
-        :param failed: list of entrez ids to skip
+        :param write: actually perform write
         :return:
         """
         print(self.failed)
@@ -651,12 +658,9 @@ class GeneBot:
         print(len(entrez_qid))
         entrez_qid = {entrez: qid for entrez, qid in entrez_qid.items() if entrez not in self.failed}
         print(len(entrez_qid))
-        filter = {PROPS['Entrez Gene ID']: '', PROPS['found in taxon']: self.organism_info['wdid']}
-        frc = FastRunContainer(wdi_core.WDBaseDataType, wdi_core.WDItemEngine, base_filter=filter, use_refs=True)
-        frc.clear()
         props = [PROPS[x] for x in FASTRUN_PROPS]
-        for qid in tqdm(entrez_qid.values()):
-            remove_deprecated_statements(qid, frc, releases, last_updated, props, self.login)
+        cleanup_taxon(entrez_qid.values(), PROPS['Entrez Gene ID'], self.organism_info, releases, last_updated, props,
+                      self.login, write=write)
 
 
 class ChromosomalGeneBot(GeneBot):
@@ -692,36 +696,100 @@ class MicrobeGeneBot(ChromosomalGeneBot):
     GENE_CLASS = MicrobeGene
 
 
-def remove_deprecated_statements(qid, frc, releases, last_updated, props, login):
+# with more candidate items than this, load the whole taxon into a fastrun container instead of item by item
+FRC_MIN_ITEMS = 1000
+
+
+def find_deprecated_candidates(taxon_qid, id_prop, releases, last_updated, props, chunk_size=50):
+    """
+    Find the items that `remove_deprecated_statements` would change, with a few bulk queries instead of looking at
+    every item in the taxon: those with a statement on one of `props` that has a reference stated in one of
+    `releases`, or stated in a source in `last_updated` and retrieved more than DAYS before it was last updated
+
+    :param taxon_qid: only items found in this taxon
+    :param id_prop: and having this (external id) property
+    :param releases: release qids, see `remove_deprecated_statements`
+    :param last_updated: {source qid: datetime}, see `remove_deprecated_statements`
+    :param props: look at statements on these props
+    :param chunk_size: max number of releases per query
+    :return: set of qids
+    """
+    values_p = " ".join("p:" + p for p in props)
+    queries = []
+    for chunk in grouper(chunk_size, sorted(releases)):
+        queries.append("""SELECT DISTINCT ?item WHERE {
+          VALUES ?p { %s }
+          VALUES ?release { %s }
+          ?item wdt:P703 wd:%s ; wdt:%s [] ; ?p ?statement .
+          ?statement prov:wasDerivedFrom/pr:P248 ?release .
+        }""" % (values_p, " ".join("wd:" + r for r in chunk), taxon_qid, id_prop))
+    for db, date in last_updated.items():
+        cutoff = (date - timedelta(days=DAYS)).strftime('%Y-%m-%dT00:00:00Z')
+        queries.append("""SELECT DISTINCT ?item WHERE {
+          VALUES ?p { %s }
+          ?item wdt:P703 wd:%s ; wdt:%s [] ; ?p ?statement .
+          ?statement prov:wasDerivedFrom ?ref .
+          ?ref pr:P248 wd:%s ; pr:P813 ?retrieved .
+          FILTER(?retrieved < "%s"^^xsd:dateTime)
+        }""" % (values_p, taxon_qid, id_prop, db, cutoff))
+
+    qids = set()
+    for query in queries:
+        bindings = wdi_core.WDItemEngine.execute_sparql_query(query)['results']['bindings']
+        qids.update(x['item']['value'].replace("http://www.wikidata.org/entity/", "") for x in bindings)
+    return qids
+
+
+def prime_fastrun_container(frc, props):
+    # load the data for these props for the whole taxon, so that `reconstruct_statements` can be used
+    for prop in props:
+        frc.write_required([wdi_core.WDString("fake value", prop)])
+
+
+def is_deprecated_ref(ref, releases, last_updated):
+    """
+    :param ref: a reference (list of snaks)
+    :param releases: set of release qids (as int)
+    :param last_updated: {source qid: datetime}
+    """
+    stated_in = ["Q{}".format(x.get_value()) for x in ref if x.get_prop_nr() == 'P248']
+    if any(int(qid[1:]) in releases for qid in stated_in):
+        return True
+    dbs = [qid for qid in stated_in if qid in last_updated]
+    if dbs:
+        db = dbs[0]
+        for x in ref:
+            if x.get_prop_nr() == 'P813':
+                retrieved = datetime.strptime(x.get_value()[0], '+%Y-%m-%dT%H:%M:%SZ')
+                if (last_updated[db] - retrieved).days > DAYS:
+                    return True
+    return False
+
+
+def remove_deprecated_statements(qid, frc, releases, last_updated, props, login, write=True):
     """
     :param qid: qid of item
-    :param frc: a fastrun container
+    :param frc: a fastrun container, primed with `prime_fastrun_container`. If None, the item is retrieved
     :param releases: list of releases to remove (a statement that has a reference that is stated in one of these
             releases will be removed)
     :param last_updated: looks like {'Q20641742': datetime.date(2017,5,6)}. a statement that has a reference that is
             stated in Q20641742 (entrez) and was retrieved more than DAYS before 2017-5-6 will be removed
     :param props: look at these props
     :param login:
+    :param write: actually perform write
     :return:
     """
-    for prop in props:
-        frc.write_required([wdi_core.WDString("fake value", prop)])
-    orig_statements = frc.reconstruct_statements(qid)
+    if frc is None:
+        orig_statements = [s for s in wdi_core.WDItemEngine(wd_item_id=qid).statements if s.get_prop_nr() in props]
+    else:
+        orig_statements = frc.reconstruct_statements(qid)
     releases = set(int(r[1:]) for r in releases)
 
     s_dep = []
     for s in orig_statements:
-        if any(any(x.get_prop_nr() == 'P248' and x.get_value() in releases for x in r) for r in s.get_references()):
+        if any(is_deprecated_ref(r, releases, last_updated) for r in s.get_references()):
             setattr(s, 'remove', '')
             s_dep.append(s)
-        else:
-            for r in s.get_references():
-                dbs = [x.get_value() for x in r if x.get_value() in last_updated]
-                if dbs:
-                    db = dbs[0]
-                    if any(x.get_prop_nr() == 'P813' and last_updated[db] - x.get_value() > DAYS for x in r):
-                        setattr(s, 'remove', '')
-                        s_dep.append(s)
     if s_dep:
         print("-----")
         print(qid)
@@ -729,10 +797,70 @@ def remove_deprecated_statements(qid, frc, releases, last_updated, props, login)
         print([(x.get_prop_nr(), x.value) for x in s_dep])
         print([(x.get_references()[0]) for x in s_dep])
         wd_item = wdi_core.WDItemEngine(wd_item_id=qid, data=s_dep, fast_run=False)
-        wdi_helpers.try_write(wd_item, '', '', login, edit_summary="remove deprecated statements")
+        wdi_helpers.try_write(wd_item, '', '', login, edit_summary="remove deprecated statements", write=write)
+
+
+def cleanup_taxon(qids, id_prop, organism_info, releases, last_updated, props, login, write=True):
+    """
+    Remove deprecated statements from the items in `qids` (the items of one taxon having `id_prop`), only
+    touching those found by `find_deprecated_candidates`
+    """
+    candidates = find_deprecated_candidates(organism_info['wdid'], id_prop, releases, last_updated, props)
+    candidates &= set(qids)
+    print("{} of {} items have deprecated statements".format(len(candidates), len(qids)))
+    frc = None
+    if len(candidates) > FRC_MIN_ITEMS:
+        filter = {id_prop: '', PROPS['found in taxon']: organism_info['wdid']}
+        frc = FastRunContainer(wdi_core.WDBaseDataType, wdi_core.WDItemEngine, base_filter=filter, use_refs=True)
+        frc.clear()
+        prime_fastrun_container(frc, props)
+    for qid in tqdm(sorted(candidates)):
+        remove_deprecated_statements(qid, frc, releases, last_updated, props, login, write=write)
 
 
-def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=True, entrez=None):
+def benchmark_statements(bot, records):
+    """
+    Build, but don't write, the statements for every record and report the statements per second and the peak
+    memory used building them. Memory is measured in a second pass, as tracemalloc slows everything down.
+
+    :param bot: a ChromosomalGeneBot (or subclass)
+    :param records: tagged mygene records
+    :return: dict with n_genes, n_statements, seconds, statements_per_second, peak_memory_mb
+    """
+    records = list(bot.filter(records))
+
+    def build_all():
+        n_genes = n_statements = 0
+        for record in records:
+            gene = bot.GENE_CLASS(record, bot.organism_info, bot.chr_num_wdid, bot.login)
+            try:
+                gene.parse_external_ids()
+                gene.create_ref_sources()
+                n_statements += len(gene.create_statements())
+                n_genes += 1
+            except Exception:
+                # these would be logged as failed in a real run
+                continue
+        return n_genes, n_statements
+
+    t = time.time()
+    n_genes, n_statements = build_all()
+    t = time.time() - t
+
+    tracemalloc.start()
+    build_all()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {'n_genes': n_genes, 'n_statements': n_statements, 'seconds': t,
+              'statements_per_second': n_statements / t if t else 0, 'peak_memory_mb': peak / 1024 / 1024}
+    print("built {n_statements} statements for {n_genes} genes in {seconds:.2f} s "
+          "({statements_per_second:.0f} per second), peak memory {peak_memory_mb:.2f} MB".format(**result))
+    return result
+
+
+def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=True, entrez=None, benchmark=False,
+         responses=None):
     """
     Main function for creating/updating genes
 
@@ -748,8 +876,14 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
     :type write: bool
     :param entrez: Only run this one gene
     :type entrez: int
+    :param benchmark: only build the statements and report the throughput (see `benchmark_statements`)
+    :type benchmark: bool
+    :param responses: record or replay wikidata, mygene and ncbi responses with this. No login, no writes
+    :type responses: RecordedResponses
     :return: None
     """
+    # the data that doesn't come through `requests` is recorded separately
+    cached = responses.cached_json if responses else lambda name, f: f()
 
     # make sure the organism is found in wikidata
     taxid = int(taxid)
@@ -759,7 +893,13 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
         return None
 
     # login
-    login = wdi_login.WDLogin(user=WDUSER, pwd=WDPASS)
+    if responses:
+        login = None
+        write = False
+    else:
+        if WDUSER is None:
+            raise ValueError("WDUSER and WDPASS must be specified in local.py or as environment variables")
+        login = wdi_login.WDLogin(user=WDUSER, pwd=WDPASS)
     if wdi_core.WDItemEngine.logger is not None:
         wdi_core.WDItemEngine.logger.handles = []
         wdi_core.WDItemEngine.logger.handlers = []
@@ -777,7 +917,7 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
         organism_info = organisms_info[taxid]
         # make sure all chromosome items are found in wikidata
         cb = ChromosomeBot()
-        chr_num_wdid = cb.get_or_create(organism_info, login=login)
+        chr_num_wdid = cached("chromosomes_{}".format(taxid), lambda: cb.get_or_create(organism_info, login=login))
         chr_num_wdid = {k.upper(): v for k, v in chr_num_wdid.items()}
         if int(organism_info['taxid']) == 9606:
             bot = HumanGeneBot(organism_info, chr_num_wdid, login)
@@ -786,31 +926,40 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
     else:
         # check if its one of the reference microbial genomes
         # raises valueerror if not...
-        organism_info = mcb.get_organism_info(taxid)
-        refseq_qid_chrom = mcb.get_or_create_chromosomes(taxid, login)
+        organism_info = cached("organism_info_{}".format(taxid), lambda: mcb.get_organism_info(taxid))
+        refseq_qid_chrom = cached("chromosomes_{}".format(taxid), lambda: mcb.get_or_create_chromosomes(taxid, login))
         print(organism_info)
         bot = MicrobeGeneBot(organism_info, refseq_qid_chrom, login)
         validate_type = "microbial"
 
     # Get handle to mygene records
     mgd = MyGeneDownloader()
-    if entrez:
-        doc, total = mgd.get_mg_gene(entrez)
-        docs = iter([doc])
-    else:
-        doc_filter = lambda x: (x.get("type_of_gene") != "biological-region") and ("entrezgene" in x)
-        docs, total = mgd.get_mg_cursor(taxid, doc_filter)
+    with timer.stage('download'):
+        if entrez:
+            docs = cached("mygene_{}_{}".format(taxid, entrez), lambda: [mgd.get_mg_gene(entrez)[0]])
+        else:
+            doc_filter = lambda x: (x.get("type_of_gene") != "biological-region") and ("entrezgene" in x)
+            # the scroll_id/cursor times out from mygene if we iterate. So.... get the whole thing now
+            docs = cached("mygene_{}".format(taxid), lambda: list(mgd.get_mg_cursor(taxid, doc_filter)[0]))
+    total = len(docs)
     print("total number of records: {}".format(total))
-    # the scroll_id/cursor times out from mygene if we iterate. So.... get the whole thing now
-    docs = list(docs)
-    docs = HelperBot.validate_docs(docs, validate_type, PROPS['Entrez Gene ID'])
-    records = HelperBot.tag_mygene_docs(docs, metadata)
+    docs = timer.iter('validate', HelperBot.validate_docs(docs, validate_type, PROPS['Entrez Gene ID']))
+    records = timer.iter('tag', HelperBot.tag_mygene_docs(docs, metadata))
+
+    if benchmark:
+        return benchmark_statements(bot, records)
 
     bot.run(records, total=total, fast_run=fast_run, write=write)
+    last_edit_time = datetime.utcnow()
+    print(timer)
+    if responses:
+        # the cleanup needs the live endpoint and a login
+        return None
     for frc in wdi_core.WDItemEngine.fast_run_store:
         frc.clear()
-    print("done updating, waiting 10 min")
-    time.sleep(10 * 60)
+    if write:
+        print("done updating, waiting for the query service to catch up")
+        wdi_helpers.wait_for_last_modified(last_edit_time)
     releases = dict()
     releases_to_remove = set()
     last_updated = dict()
@@ -828,7 +977,7 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
         else:
             last_updated[source_items[k]] = datetime.strptime(v["timestamp"], "%Y%m%d")
     print(last_updated)
-    bot.cleanup(releases_to_remove, last_updated)
+    bot.cleanup(releases_to_remove, last_updated, write=write)
 
 
 if __name__ == "__main__":
@@ -844,6 +993,12 @@ if __name__ == "__main__":
     parser.add_argument('--fastrun', dest='fastrun', action='store_true')
     parser.add_argument('--no-fastrun', dest='fastrun', action='store_false')
     parser.add_argument('--entrez', help="Run only this one gene")
+    parser.add_argument('--benchmark', help='only build the statements and report the throughput, no writes',
+                        action='store_true')
+    parser.add_argument('--release-cache', help='json file caching release item QIDs across runs', type=str)
+    parser.add_argument('--record', help='dummy run, recording all responses into this directory', type=str)
+    parser.add_argument('--offline', help='dummy run, replaying the responses recorded in this directory', type=str)
+    parser.add_argument('--timings', help='save the per-stage timings as json to this file', type=str)
     parser.set_defaults(fastrun=True)
     args = parser.parse_args()
     log_dir = args.log_dir if args.log_dir else "./logs"
@@ -851,18 +1006,25 @@ if __name__ == "__main__":
     __metadata__['run_id'] = run_id
     taxon = args.taxon
     fast_run = args.fastrun
+    if args.release_cache:
+        HelperBot.release_registry.load(args.release_cache)
+    responses = None
+    if args.record or args.offline:
+        responses = RecordedResponses(args.record or args.offline, record=bool(args.record)).start()
     mcb = MicrobialChromosomeBot()
 
     # get metadata about sources
     mgd = MyGeneDownloader()
     metadata = dict()
-    src = mgd.get_metadata()['src']
+    src = responses.cached_json("mygene_metadata", mgd.get_metadata)['src'] if responses else mgd.get_metadata()['src']
     for source in src.keys():
         metadata[source] = src[source]["version"]
 
     if args.entrez:
         main(taxon, metadata, run_id=run_id, log_dir=log_dir, fast_run=fast_run,
-             write=not args.dummy, entrez=args.entrez)
+             write=not args.dummy, entrez=args.entrez, responses=responses)
+        if args.timings:
+            timer.save(args.timings)
         sys.exit(0)
 
     if "microbe" in taxon:
@@ -871,10 +1033,13 @@ if __name__ == "__main__":
 
     for taxon1 in taxon.split(","):
         try:
-            main(taxon1, metadata, run_id=run_id, log_dir=log_dir, fast_run=fast_run, write=not args.dummy)
+            main(taxon1, metadata, run_id=run_id, log_dir=log_dir, fast_run=fast_run, write=not args.dummy,
+                 benchmark=args.benchmark, responses=responses)
         except Exception as e:
             # if one taxon fails, still try to run the others
             traceback.print_exc()
         # done with this run, clear fast run container to save on RAM
         wdi_core.WDItemEngine.fast_run_store = []
         wdi_core.WDItemEngine.fast_run_container = None
+    if args.timings:
+        timer.save(args.timings)
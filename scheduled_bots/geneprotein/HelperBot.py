@@ -1,5 +1,8 @@
+import json
+import os
 import sys
 from datetime import datetime
+from functools import lru_cache
 
 import copy
 from cerberus import Validator
@@ -222,6 +225,73 @@ def tag_mygene_docs(docs, metadata):
         yield tagged_doc
 
 
+class ReleaseRegistry:
+    """
+    Resolves the release item for each (source, release) once per run, instead of once per reference.
+    Optionally backed by a json file so the QIDs are kept across runs.
+    """
+
+    def __init__(self, cache_path=None):
+        # (source, release) -> release QID
+        self.releases = dict()
+        self.cache_path = None
+        if cache_path:
+            self.load(cache_path)
+
+    def load(self, cache_path):
+        self.cache_path = cache_path
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                self.releases.update({tuple(k.split("|", 1)): v for k, v in json.load(f).items()})
+
+    def save(self):
+        if self.cache_path:
+            with open(self.cache_path, 'w') as f:
+                json.dump({"|".join(k): v for k, v in self.releases.items()}, f, indent=2)
+
+    def get(self, source, release, login=None):
+        release = str(release)
+        key = (source, release)
+        if key not in self.releases:
+            title = "{} Release {}".format(source, release)
+            description = "Release {} of {}".format(release, source)
+            qid = wdi_helpers.Release(title, description, release,
+                                      edition_of_wdid=source_items[source]).get_or_create(login)
+            if not qid:
+                # don't cache a failure, it might be created by a later call with a login
+                return qid
+            self.releases[key] = qid
+            self.save()
+        return self.releases[key]
+
+
+release_registry = ReleaseRegistry()
+
+
+@lru_cache(maxsize=None)
+def shared_snak(datatype, value, prop_nr, is_reference=False, is_qualifier=False):
+    """
+    A reference or qualifier snak that is the same for many genes in a taxon (stated in, retrieved, chromosome,
+    genomic assembly), built once and reused. WDItemEngine only reads these. Don't modify them.
+    """
+    return datatype(value, prop_nr, is_reference=is_reference, is_qualifier=is_qualifier)
+
+
+@lru_cache(maxsize=None)
+def item_qualifiers(*pairs):
+    """
+    List of WDItemID qualifiers from (value, prop_nr) pairs. The same list is handed out to every statement asking
+    for the same qualifiers. Don't modify it.
+    """
+    return [shared_snak(wdi_core.WDItemID, value, prop_nr, is_qualifier=True) for value, prop_nr in pairs]
+
+
+@lru_cache(maxsize=None)
+def retrieved_snak(date_string):
+    retrieved = datetime.strptime(date_string, "%Y%m%d")
+    return shared_snak(wdi_core.WDTime, retrieved.strftime('+%Y-%m-%dT00:00:00Z'), 'P813', is_reference=True)
+
+
 def make_ref_source(source_doc, id_prop, identifier, login=None):
     """
     Reference is made up of:
@@ -248,19 +318,13 @@ def make_ref_source(source_doc, id_prop, identifier, login=None):
 
     if "release" in source_doc:
         source_doc['release'] = str(source_doc['release'])
-        title = "{} Release {}".format(source_doc['id'], source_doc['release'])
-        description = "Release {} of {}".format(source_doc['release'], source_doc['id'])
-        edition_of_wdid = source_items[source_doc['id']]
-        release = wdi_helpers.Release(title, description, source_doc['release'],
-                                      edition_of_wdid=edition_of_wdid).get_or_create(login)
+        release = release_registry.get(source, source_doc['release'], login)
 
-        stated_in = wdi_core.WDItemID(value=release, prop_nr='P248', is_reference=True)
+        stated_in = shared_snak(wdi_core.WDItemID, release, 'P248', is_reference=True)
         reference = [stated_in, link_to_id]
     else:
-        date_string = source_doc['timestamp']
-        retrieved = datetime.strptime(date_string, "%Y%m%d")
-        stated_in = wdi_core.WDItemID(value=source_items[source], prop_nr='P248', is_reference=True)
-        retrieved = wdi_core.WDTime(retrieved.strftime('+%Y-%m-%dT00:00:00Z'), prop_nr='P813', is_reference=True)
+        stated_in = shared_snak(wdi_core.WDItemID, source_items[source], 'P248', is_reference=True)
+        retrieved = retrieved_snak(source_doc['timestamp'])
         reference = [stated_in, retrieved, link_to_id]
     return reference
 
@@ -8,8 +8,6 @@ from scheduled_bots.geneprotein import PROPS
 from wikidataintegrator import wdi_core, wdi_helpers
 from wikidataintegrator.wdi_helpers import prop2qid
 
-core_props = get_default_core_props()
-
 
 class MicrobialChromosomeBot:
     chr_type_map = {'chromosome': 'Q37748',
@@ -136,7 +134,7 @@ class MicrobialChromosomeBot:
         wd_item = wdi_core.WDItemEngine(data=statements,
                                         append_value=['P31'], fast_run=True,
                                         fast_run_base_filter={'P703': organism_qid, 'P2249': ''},
-                                        core_props=core_props)
+                                        core_props=get_default_core_props())
         if wd_item.wd_item_id:
             return wd_item.wd_item_id
         if login is None:
@@ -13,7 +13,10 @@ https://www.wikidata.org/wiki/Q20976936
 import argparse
 import json
 import os
-from collections import defaultdict
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from tqdm import tqdm
@@ -21,9 +24,11 @@ from tqdm import tqdm
 from scheduled_bots import get_default_core_props, PROPS
 from scheduled_bots.geneprotein import HelperBot
 from scheduled_bots.geneprotein.Downloader import MyGeneDownloader
+from scheduled_bots.geneprotein.ortholog_table import OrthologTable
 from wikidataintegrator import wdi_login, wdi_core, wdi_helpers
 
 core_props = get_default_core_props()
+fast_run_store_lock = threading.Lock()
 
 try:
     from scheduled_bots.local import WDUSER, WDPASS
@@ -40,7 +45,7 @@ __metadata__ = {'name': 'OrthologBot',
                 }
 
 
-def main(metadata, log_dir="./logs", fast_run=True, write=True):
+def main(metadata, log_dir="./logs", fast_run=True, write=True, workers=4):
     """
     Main function for creating/updating genes
 
@@ -52,6 +57,8 @@ def main(metadata, log_dir="./logs", fast_run=True, write=True):
     :type fast_run: bool
     :param write: actually perform write
     :type write: bool
+    :param workers: number of taxa written at the same time
+    :type workers: int
     :return: None
     """
 
@@ -75,28 +82,14 @@ def main(metadata, log_dir="./logs", fast_run=True, write=True):
     mgd = MyGeneDownloader(q="_exists_:homologene AND type_of_gene:protein-coding",
                            fields=','.join(['taxid', 'homologene', 'entrezgene']))
     docs, total = mgd.query()
-    docs = list(tqdm(docs, total=total))
-    records = HelperBot.tag_mygene_docs(docs, metadata)
-
-    # group together all orthologs
-    # d[taxid][entrezgene] = { set of entrezgene ids for orthologs }
-    d = defaultdict(lambda: defaultdict(set))
-    entrez_taxon = dict()  # keep this for the qualifier on the statements
-    for doc in records:
-        this_taxid = doc['taxid']['@value']
-        this_entrez = doc['entrezgene']['@value']
-        entrez_taxon[str(this_entrez)] = str(this_taxid)
-        if str(this_entrez) not in entrez_wdid:
-            continue
-        for taxid, entrez in doc['homologene']['@value']['genes']:
-            if taxid == 4932 and this_taxid == 559292:
-                # ridiculous workaround because entrez has the taxid for the strain and homologene has it for the species
-                # TODO: This needs to be fixed if you want to use other things that may have species/strains .. ?`
-                continue
-            if taxid != this_taxid and str(entrez) in entrez_wdid:
-                d[str(this_taxid)][str(this_entrez)].add(str(entrez))
+    records = HelperBot.tag_mygene_docs(tqdm(docs, total=total), metadata)
 
-    print("taxid: # of genes  : {}".format({k: len(v) for k, v in d.items()}))
+    # group together all orthologs, streamed into a table on disk. not in the log dir, where every file is read as a log
+    work_dir = tempfile.mkdtemp(prefix="orthologs")
+    table = OrthologTable(os.path.join(work_dir, "orthologs.sqlite"))
+    table.load(records, entrez_wdid)
+    taxa = table.taxa()
+    print("taxid: # of genes  : {}".format(taxa))
 
     homogene_ver = metadata['homologene']
     release = wdi_helpers.Release("HomoloGene build{}".format(homogene_ver), "Version of HomoloGene", homogene_ver,
@@ -107,38 +100,59 @@ def main(metadata, log_dir="./logs", fast_run=True, write=True):
     reference = lambda homogeneid: [wdi_core.WDItemID(release, PROPS['stated in'], is_reference=True),
                                     wdi_core.WDExternalID(homogeneid, PROPS['HomoloGene ID'], is_reference=True)]
 
-    ec = 0
-    for taxid, subd in tqdm(d.items()):
-        for entrezgene, orthologs in tqdm(subd.items(), leave=False):
+    def do_taxon(taxid):
+        # all genes of a taxon use the same fast run container, which is dropped once the taxon is done
+        ec = 0
+        for entrezgene, orthologs in table.iter_orthologs(taxid):
             try:
-                do_item(entrezgene, orthologs, reference, entrez_homo, entrez_taxon, taxon_wdid, entrez_wdid, login,
-                        write)
+                do_item(entrezgene, taxid, orthologs, reference, entrez_homo, taxon_wdid, entrez_wdid, login, write,
+                        fast_run)
             except Exception as e:
-                wdi_helpers.format_msg(entrezgene, PROPS['Entrez Gene ID'], None, str(e), type(e))
+                wdi_core.WDItemEngine.log("ERROR", wdi_helpers.format_msg(entrezgene, PROPS['Entrez Gene ID'], None,
+                                                                          str(e), type(e)))
                 ec += 1
-        # clear the fast run store once we move on to the next taxon
-        wdi_core.WDItemEngine.fast_run_store = []
-        wdi_core.WDItemEngine.fast_run_container = None
+        drop_fast_run_container(taxon_wdid.get(taxid))
+        return ec
+
+    # the largest taxa first, so they don't end up last on their own
+    taxids = sorted(taxa, key=taxa.get, reverse=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        ec = sum(tqdm(executor.map(do_taxon, taxids), total=len(taxids)))
+    table.close()
+    shutil.rmtree(work_dir)
 
     print("Completed succesfully with {} exceptions".format(ec))
 
 
-def do_item(entrezgene, orthologs, reference, entrez_homo, entrez_taxon, taxon_wdid, entrez_wdid, login, write):
+def drop_fast_run_container(taxon_qid):
+    # the fast run containers are found by their base filter, so each taxon has its own. they are removed from the
+    # store in place, as the workers of the other taxa keep appending theirs to the same list
+    store = wdi_core.WDItemEngine.fast_run_store
+    with fast_run_store_lock:
+        for c in [c for c in store if c.base_filter.get(PROPS['found in taxon']) == taxon_qid]:
+            store.remove(c)
+
+
+def do_item(entrezgene, taxid, orthologs, reference, entrez_homo, taxon_wdid, entrez_wdid, login, write,
+            fast_run=True):
+    """
+    :param orthologs: ortholog entrez -> ortholog taxid
+    """
     entrezgene = str(entrezgene)
     s = []
     this_ref = reference(entrez_homo[entrezgene])
-    for ortholog in orthologs:
+    for ortholog, ortholog_taxid in orthologs.items():
         ortholog = str(ortholog)
         if ortholog == entrezgene:
             continue
-        if ortholog not in entrez_taxon:
+        if ortholog_taxid is None:
             raise ValueError("missing taxid for: " + ortholog)
-        qualifier = wdi_core.WDItemID(taxon_wdid[entrez_taxon[ortholog]], PROPS['found in taxon'], is_qualifier=True)
+        qualifier = wdi_core.WDItemID(taxon_wdid[ortholog_taxid], PROPS['found in taxon'], is_qualifier=True)
         s.append(wdi_core.WDItemID(entrez_wdid[ortholog], PROPS['ortholog'],
                                    references=[this_ref], qualifiers=[qualifier]))
     item = wdi_core.WDItemEngine(wd_item_id=entrez_wdid[entrezgene], data=s, fast_run=fast_run,
                                  fast_run_base_filter={PROPS['Entrez Gene ID']: '',
-                                                       PROPS['found in taxon']: taxon_wdid[entrez_taxon[entrezgene]]},
+                                                       PROPS['found in taxon']: taxon_wdid[taxid]},
                                  core_props=core_props)
     wdi_helpers.try_write(item, entrezgene, PROPS['Entrez Gene ID'], edit_summary="edit orthologs", login=login,
                           write=write)
@@ -154,6 +168,7 @@ if __name__ == "__main__":
     parser.add_argument('--dummy', help='do not actually do write', action='store_true')
     parser.add_argument('--fastrun', dest='fastrun', action='store_true')
     parser.add_argument('--no-fastrun', dest='fastrun', action='store_false')
+    parser.add_argument('--workers', help='number of taxa to write at the same time', type=int, default=4)
     parser.set_defaults(fastrun=True)
     args = parser.parse_args()
     log_dir = args.log_dir if args.log_dir else "./logs"
@@ -174,4 +189,4 @@ if __name__ == "__main__":
     wdi_core.WDItemEngine.setup_logging(log_dir=log_dir, log_name=log_name, header=json.dumps(__metadata__),
                                         logger_name='orthologs')
 
-    main(metadata, log_dir=log_dir, fast_run=fast_run, write=not args.dummy)
+    main(metadata, log_dir=log_dir, fast_run=fast_run, write=not args.dummy, workers=args.workers)
@@ -23,7 +23,6 @@ import argparse
 import json
 import os
 import sys
-import time
 import traceback
 from datetime import datetime
 from itertools import chain
@@ -34,20 +33,22 @@ from scheduled_bots import get_default_core_props, PROPS
 from scheduled_bots.geneprotein import HelperBot, descriptions_by_type
 from scheduled_bots.geneprotein import organisms_info
 from scheduled_bots.geneprotein.Downloader import MyGeneDownloader
-from scheduled_bots.geneprotein.GeneBot import remove_deprecated_statements
+from scheduled_bots.geneprotein.GeneBot import cleanup_taxon
 from scheduled_bots.geneprotein.HelperBot import make_ref_source, parse_mygene_src_version, source_items
 from scheduled_bots.geneprotein.MicrobeBotResources import get_all_taxa, get_organism_info
+from scheduled_bots.utils import StageTimer, RecordedResponses
 from wikidataintegrator import wdi_login, wdi_core, wdi_helpers
 from wikidataintegrator.ref_handlers import update_retrieved_if_new
-from wikidataintegrator.wdi_fastrun import FastRunContainer
 from wikidataintegrator.wdi_helpers import id_mapper, format_msg
 
-core_props = get_default_core_props()
 
 FASTRUN_PROPS = {'Entrez Gene ID', 'encodes', 'OMIM ID', 'Ensembl Protein ID', 'encoded by', 'instance of',
                  'found in taxon', 'Mouse Genome Informatics ID', 'Saccharomyces Genome Database ID',
                  'RefSeq Protein ID', 'UniProt ID'}
 
+# per-stage timings for the run: download, validate, tag, statements, fastrun, write
+timer = StageTimer()
+
 
 try:
     from scheduled_bots.local import WDUSER, WDPASS
@@ -56,7 +57,8 @@ except ImportError:
         WDUSER = os.environ['WDUSER']
         WDPASS = os.environ['WDPASS']
     else:
-        raise ValueError("WDUSER and WDPASS must be specified in local.py or as environment variables")
+        # only needed to login, which --offline/--record runs don't do
+        WDUSER = WDPASS = None
 
 __metadata__ = {
     'name': 'ProteinBot',
@@ -197,10 +199,11 @@ class Protein:
 
         key = 'RefSeq Protein ID'
         if key in self.external_ids:
+            # the same reference (to the entrez gene) for every refseq protein
+            refseq_ref = make_ref_source(self.record['refseq']['@source'], PROPS['Entrez Gene ID'], entrez_gene,
+                                         login=self.login)
             for id in self.external_ids[key]:
-                ref = make_ref_source(self.record['refseq']['@source'], PROPS['Entrez Gene ID'], entrez_gene,
-                                      login=self.login)
-                s.append(wdi_core.WDString(id, PROPS[key], references=[ref]))
+                s.append(wdi_core.WDString(id, PROPS[key], references=[refseq_ref]))
 
         ############
         # Protein statements
@@ -227,15 +230,17 @@ class Protein:
 
         try:
             statements = [wdi_core.WDItemID(self.protein_wdid, PROPS['encodes'], references=[uniprot_ref])]
-            wd_item_gene = wdi_core.WDItemEngine(wd_item_id=self.gene_wdid,data=statements,
-                                                 append_value=[PROPS['encodes']], fast_run=fast_run,
-                                                 fast_run_base_filter={PROPS['Entrez Gene ID']: '',
-                                                                       PROPS['found in taxon']: self.organism_info[
-                                                                           'wdid']},
-                                                 global_ref_mode="CUSTOM", ref_handler=update_retrieved_if_new,
-                                                 core_props=core_props)
-            wdi_helpers.try_write(wd_item_gene, self.external_ids['UniProt ID'], PROPS['UniProt ID'], self.login,
-                                  write=write)
+            with timer.stage('fastrun'):
+                wd_item_gene = wdi_core.WDItemEngine(wd_item_id=self.gene_wdid,data=statements,
+                                                     append_value=[PROPS['encodes']], fast_run=fast_run,
+                                                     fast_run_base_filter={PROPS['Entrez Gene ID']: '',
+                                                                           PROPS['found in taxon']: self.organism_info[
+                                                                               'wdid']},
+                                                     global_ref_mode="CUSTOM", ref_handler=update_retrieved_if_new,
+                                                     core_props=get_default_core_props())
+            with timer.stage('write'):
+                wdi_helpers.try_write(wd_item_gene, self.external_ids['UniProt ID'], PROPS['UniProt ID'], self.login,
+                                      write=write)
         except Exception as e:
             exc_info = sys.exc_info()
             traceback.print_exception(*exc_info)
@@ -245,22 +250,24 @@ class Protein:
 
     def create_item(self, fast_run=True, write=True):
         try:
-            self.parse_external_ids()
-            self.statements = self.create_statements()
-            self.create_label()
-            self.create_description()
-            self.create_aliases()
-
-            wd_item_protein = wdi_core.WDItemEngine(data=self.statements,
-                                                    append_value=[PROPS['instance of'], PROPS['encoded by']],
-                                                    # PROPS['Ensembl Protein ID'], PROPS['RefSeq Protein ID']],
-                                                    fast_run=fast_run,
-                                                    fast_run_base_filter={PROPS['UniProt ID']: '',
-                                                                          PROPS['found in taxon']: self.organism_info[
-                                                                              'wdid']},
-                                                    fast_run_use_refs=True, ref_handler=update_retrieved_if_new,
-                                                    global_ref_mode="CUSTOM",
-                                                    core_props=core_props)
+            with timer.stage('statements'):
+                self.parse_external_ids()
+                self.statements = self.create_statements()
+                self.create_label()
+                self.create_description()
+                self.create_aliases()
+
+            with timer.stage('fastrun'):
+                wd_item_protein = wdi_core.WDItemEngine(data=self.statements,
+                                                        append_value=[PROPS['instance of'], PROPS['encoded by']],
+                                                        # PROPS['Ensembl Protein ID'], PROPS['RefSeq Protein ID']],
+                                                        fast_run=fast_run,
+                                                        fast_run_base_filter={PROPS['UniProt ID']: '',
+                                                                              PROPS['found in taxon']:
+                                                                                  self.organism_info['wdid']},
+                                                        fast_run_use_refs=True, ref_handler=update_retrieved_if_new,
+                                                        global_ref_mode="CUSTOM",
+                                                        core_props=get_default_core_props())
             wd_item_protein.set_label(self.label)
             wd_item_protein.set_description(self.description, lang='en')
 
@@ -270,9 +277,9 @@ class Protein:
             if "protein" in aliases:
                 aliases.remove("protein")
             wd_item_protein.set_aliases(aliases, append=False)
-            self.status = wdi_helpers.try_write(wd_item_protein, self.external_ids['UniProt ID'], PROPS['UniProt ID'],
-                                                self.login,
-                                                write=write)
+            with timer.stage('write'):
+                self.status = wdi_helpers.try_write(wd_item_protein, self.external_ids['UniProt ID'],
+                                                    PROPS['UniProt ID'], self.login, write=write)
             self.protein_wdid = wd_item_protein.wd_item_id
             return wd_item_protein
         except Exception as e:
@@ -287,22 +294,25 @@ class Protein:
     def update_item(self, qid, fast_run=True, write=True):
         print("updating protein: {}".format(qid))
         try:
-            self.parse_external_ids()
-            self.statements = self.create_statements()
-
-            wd_item_protein = wdi_core.WDItemEngine(wd_item_id=qid, data=self.statements,
-                                                    append_value=[PROPS['instance of'], PROPS['encoded by'],
-                                                                  PROPS['Ensembl Protein ID'],
-                                                                  PROPS['RefSeq Protein ID']],
-                                                    fast_run=fast_run,
-                                                    fast_run_base_filter={PROPS['UniProt ID']: '',
-                                                                          PROPS['found in taxon']: self.organism_info[
-                                                                              'wdid']},
-                                                    fast_run_use_refs=True, ref_handler=update_retrieved_if_new,
-                                                    global_ref_mode="CUSTOM",
-                                                    core_props=core_props)
-            wdi_helpers.try_write(wd_item_protein, self.external_ids['UniProt ID'], PROPS['UniProt ID'], self.login,
-                                  write=write)
+            with timer.stage('statements'):
+                self.parse_external_ids()
+                self.statements = self.create_statements()
+
+            with timer.stage('fastrun'):
+                wd_item_protein = wdi_core.WDItemEngine(wd_item_id=qid, data=self.statements,
+                                                        append_value=[PROPS['instance of'], PROPS['encoded by'],
+                                                                      PROPS['Ensembl Protein ID'],
+                                                                      PROPS['RefSeq Protein ID']],
+                                                        fast_run=fast_run,
+                                                        fast_run_base_filter={PROPS['UniProt ID']: '',
+                                                                              PROPS['found in taxon']:
+                                                                                  self.organism_info['wdid']},
+                                                        fast_run_use_refs=True, ref_handler=update_retrieved_if_new,
+                                                        global_ref_mode="CUSTOM",
+                                                        core_props=get_default_core_props())
+            with timer.stage('write'):
+                wdi_helpers.try_write(wd_item_protein, self.external_ids['UniProt ID'], PROPS['UniProt ID'],
+                                      self.login, write=write)
             self.protein_wdid = wd_item_protein.wd_item_id
             return wd_item_protein
         except Exception as e:
@@ -379,22 +389,19 @@ class ProteinBot:
             else:
                 yield record
 
-    def cleanup(self, releases, last_updated):
+    def cleanup(self, releases, last_updated, write=True):
         print(self.failed)
         uniprot_wdid = wdi_helpers.id_mapper(PROPS['UniProt ID'],
                                              ((PROPS['found in taxon'], self.organism_info['wdid']),))
         print(len(uniprot_wdid))
         uniprot_wdid = {uniprot: qid for uniprot, qid in uniprot_wdid.items() if uniprot not in self.failed}
         print(len(uniprot_wdid))
-        filter = {PROPS['UniProt ID']: '', PROPS['found in taxon']: self.organism_info['wdid']}
-        frc = FastRunContainer(wdi_core.WDBaseDataType, wdi_core.WDItemEngine, base_filter=filter, use_refs=True)
-        frc.clear()
         props = [PROPS[x] for x in FASTRUN_PROPS]
-        for qid in tqdm(uniprot_wdid.values()):
-            remove_deprecated_statements(qid, frc, releases, last_updated, props, self.login)
+        cleanup_taxon(uniprot_wdid.values(), PROPS['UniProt ID'], self.organism_info, releases, last_updated, props,
+                      self.login, write=write)
 
 
-def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=True, entrez=None):
+def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=True, entrez=None, responses=None):
     """
     Main function for creating/updating proteins
 
@@ -410,8 +417,12 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
     :type write: bool
     :param entrez: Only run this one protein (given by entrezgene id)
     :type entrez: int
+    :param responses: record or replay wikidata, mygene and ncbi responses with this. No login, no writes
+    :type responses: RecordedResponses
     :return: None
     """
+    # the data that doesn't come through `requests` is recorded separately
+    cached = responses.cached_json if responses else lambda name, f: f()
 
     # make sure the organism is found in wikidata
     taxid = int(taxid)
@@ -421,7 +432,13 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
         return None
 
     # login
-    login = wdi_login.WDLogin(user=WDUSER, pwd=WDPASS)
+    if responses:
+        login = None
+        write = False
+    else:
+        if WDUSER is None:
+            raise ValueError("WDUSER and WDPASS must be specified in local.py or as environment variables")
+        login = wdi_login.WDLogin(user=WDUSER, pwd=WDPASS)
     if wdi_core.WDItemEngine.logger is not None:
         wdi_core.WDItemEngine.logger.handles = []
         wdi_core.WDItemEngine.logger.handlers = []
@@ -438,7 +455,7 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
     else:
         # check if its one of the microbe refs
         # raises valueerror if not...
-        organism_info = get_organism_info(taxid)
+        organism_info = cached("organism_info_{}".format(taxid), lambda: get_organism_info(taxid))
         validate_type = 'microbial'
         print(organism_info)
 
@@ -449,23 +466,31 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
 
     # Get handle to mygene records
     mgd = MyGeneDownloader()
-    if entrez:
-        doc, total = mgd.get_mg_gene(entrez)
-        docs = iter([doc])
-    else:
-        doc_filter = lambda x: (x.get("type_of_gene") == "protein-coding") and ("uniprot" in x) and ("entrezgene" in x)
-        docs, total = mgd.get_mg_cursor(taxid, doc_filter)
+    with timer.stage('download'):
+        if entrez:
+            docs = cached("mygene_{}_{}".format(taxid, entrez), lambda: [mgd.get_mg_gene(entrez)[0]])
+        else:
+            doc_filter = lambda x: (x.get("type_of_gene") == "protein-coding") and ("uniprot" in x) and (
+                "entrezgene" in x)
+            # the scroll_id/cursor times out from mygene if we iterate. So.... get the whole thing now
+            docs = cached("mygene_protein_{}".format(taxid), lambda: list(mgd.get_mg_cursor(taxid, doc_filter)[0]))
+    total = len(docs)
     print("total number of records: {}".format(total))
-    # the scroll_id/cursor times out from mygene if we iterate. So.... get the whole thing now
-    docs = list(docs)
-    docs = HelperBot.validate_docs(docs, validate_type, PROPS['Entrez Gene ID'])
-    records = HelperBot.tag_mygene_docs(docs, metadata)
+    docs = timer.iter('validate', HelperBot.validate_docs(docs, validate_type, PROPS['Entrez Gene ID']))
+    records = timer.iter('tag', HelperBot.tag_mygene_docs(docs, metadata))
 
     bot.run(records, total=total, fast_run=fast_run, write=write)
+    last_edit_time = datetime.utcnow()
+    print(timer)
+    if responses:
+        # the cleanup needs the live endpoint and a login
+        return None
     for frc in wdi_core.WDItemEngine.fast_run_store:
         frc.clear()
 
-    time.sleep(10 * 60)
+    if write:
+        # wait for the query service to catch up with our edits
+        wdi_helpers.wait_for_last_modified(last_edit_time)
     releases = dict()
     releases_to_remove = set()
     last_updated = dict()
@@ -483,7 +508,7 @@ def main(taxid, metadata, log_dir="./logs", run_id=None, fast_run=True, write=Tr
         else:
             last_updated[source_items[k]] = datetime.strptime(v["timestamp"], "%Y%m%d")
     print(last_updated)
-    bot.cleanup(releases_to_remove, last_updated)
+    bot.cleanup(releases_to_remove, last_updated, write=write)
 
     # after the run is done, disconnect the logging handler
     # so that if we start another, it doesn't write twice
@@ -504,6 +529,10 @@ if __name__ == "__main__":
     parser.add_argument('--fastrun', dest='fastrun', action='store_true')
     parser.add_argument('--no-fastrun', dest='fastrun', action='store_false')
     parser.add_argument('--entrez', help="Run only this one protein (specified by entrez gene ID)")
+    parser.add_argument('--release-cache', help='json file caching release item QIDs across runs', type=str)
+    parser.add_argument('--record', help='dummy run, recording all responses into this directory', type=str)
+    parser.add_argument('--offline', help='dummy run, replaying the responses recorded in this directory', type=str)
+    parser.add_argument('--timings', help='save the per-stage timings as json to this file', type=str)
     parser.set_defaults(fastrun=True)
     args = parser.parse_args()
     log_dir = args.log_dir if args.log_dir else "./logs"
@@ -511,11 +540,16 @@ if __name__ == "__main__":
     __metadata__['run_id'] = run_id
     taxon = args.taxon
     fast_run = args.fastrun
+    if args.release_cache:
+        HelperBot.release_registry.load(args.release_cache)
+    responses = None
+    if args.record or args.offline:
+        responses = RecordedResponses(args.record or args.offline, record=bool(args.record)).start()
 
     # get metadata about sources
     mgd = MyGeneDownloader()
     metadata = dict()
-    src = mgd.get_metadata()['src']
+    src = responses.cached_json("mygene_metadata", mgd.get_metadata)['src'] if responses else mgd.get_metadata()['src']
     for source in src.keys():
         metadata[source] = src[source]["version"]
 
@@ -527,7 +561,9 @@ if __name__ == "__main__":
 
     if args.entrez:
         main(taxon, metadata, run_id=run_id, log_dir=log_dir, fast_run=fast_run,
-             write=not args.dummy, entrez=args.entrez)
+             write=not args.dummy, entrez=args.entrez, responses=responses)
+        if args.timings:
+            timer.save(args.timings)
         sys.exit(0)
 
     if "microbe" in taxon:
@@ -535,7 +571,9 @@ if __name__ == "__main__":
         taxon = taxon.replace("microbe", ','.join(map(str, microbe_taxa)))
 
     for taxon1 in taxon.split(","):
-        main(taxon1, metadata, log_dir=log_dir, fast_run=fast_run, write=not args.dummy)
+        main(taxon1, metadata, log_dir=log_dir, fast_run=fast_run, write=not args.dummy, responses=responses)
         # done with this run, clear fast run container to save on RAM
         wdi_core.WDItemEngine.fast_run_store = []
         wdi_core.WDItemEngine.fast_run_container = None
+    if args.timings:
+        timer.save(args.timings)
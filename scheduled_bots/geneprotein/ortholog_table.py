@@ -0,0 +1,85 @@
+"""
+An on-disk table of ortholog pairs, loaded from a stream of tagged mygene docs so the homologene records never have to
+be in memory all at once, and read back one taxon at a time
+
+table = OrthologTable("orthologs.sqlite")
+table.load(records, entrez_wdid)
+for entrez, orthologs in table.iter_orthologs("9606"):
+    # orthologs: {ortholog entrez: ortholog taxid}
+"""
+import itertools
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS genes (entrez TEXT PRIMARY KEY, taxid TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pairs (taxid TEXT, entrez TEXT, ortholog TEXT,
+                                  PRIMARY KEY (taxid, entrez, ortholog)) WITHOUT ROWID;
+"""
+
+
+def ortholog_rows(doc, entrez_wdid):
+    # (taxid, entrez, ortholog) for each ortholog of the gene in the doc, in another taxon, that is in wikidata
+    this_taxid = doc['taxid']['@value']
+    this_entrez = str(doc['entrezgene']['@value'])
+    if this_entrez not in entrez_wdid:
+        return
+    for taxid, entrez in doc['homologene']['@value']['genes']:
+        if taxid == 4932 and this_taxid == 559292:
+            # ridiculous workaround because entrez has the taxid for the strain and homologene has it for the species
+            # TODO: This needs to be fixed if you want to use other things that may have species/strains .. ?`
+            continue
+        if taxid != this_taxid and str(entrez) in entrez_wdid:
+            yield str(this_taxid), this_entrez, str(entrez)
+
+
+class OrthologTable:
+    def __init__(self, path, fresh=True):
+        """
+        :param path: sqlite file
+        :param fresh: start from an empty table
+        """
+        if fresh and os.path.exists(path):
+            os.remove(path)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def load(self, records, entrez_wdid, batch_size=10000):
+        """
+        :param records: tagged mygene docs with taxid, entrezgene and homologene
+        :param entrez_wdid: entrez -> wdid of the genes in wikidata. only pairs of those are kept
+        """
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            with self.conn:
+                # the taxon of every gene, for the qualifier on the statements
+                self.conn.executemany("INSERT OR REPLACE INTO genes VALUES (?, ?)",
+                                      [(str(doc['entrezgene']['@value']), str(doc['taxid']['@value'])) for doc in batch])
+                self.conn.executemany("INSERT OR IGNORE INTO pairs VALUES (?, ?, ?)",
+                                      [row for doc in batch for row in ortholog_rows(doc, entrez_wdid)])
+
+    def taxa(self):
+        # taxid -> number of genes with orthologs
+        return dict(self.conn.execute("SELECT taxid, COUNT(DISTINCT entrez) FROM pairs GROUP BY taxid"))
+
+    def iter_orthologs(self, taxid):
+        """
+        The orthologs of each gene in a taxon. Uses its own connection, so taxa can be read from different threads
+        :return: generator of (entrez, {ortholog entrez: ortholog taxid or None if it isn't known})
+        """
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute("SELECT pairs.entrez, pairs.ortholog, genes.taxid FROM pairs "
+                                "LEFT JOIN genes ON genes.entrez = pairs.ortholog "
+                                "WHERE pairs.taxid = ? ORDER BY pairs.entrez", (str(taxid),))
+            for entrez, group in itertools.groupby(rows, key=lambda row: row[0]):
+                yield entrez, {ortholog: ortholog_taxid for _, ortholog, ortholog_taxid in group}
+        finally:
+            conn.close()
@@ -0,0 +1,46 @@
+from datetime import datetime
+from unittest.mock import patch
+
+from wikidataintegrator import wdi_core
+
+from scheduled_bots.geneprotein import HelperBot
+from scheduled_bots.geneprotein.GeneBot import find_deprecated_candidates, is_deprecated_ref, cleanup_taxon
+
+
+def test_find_deprecated_candidates():
+    queries = []
+
+    def execute_sparql_query(query):
+        queries.append(query)
+        item = "Q{}".format(len(queries))
+        return {'results': {'bindings': [{'item': {'value': "http://www.wikidata.org/entity/" + item}}]}}
+
+    releases = {"Q{}".format(x) for x in range(120)}
+    last_updated = {'Q20641742': datetime(2017, 5, 6)}
+    with patch('scheduled_bots.geneprotein.GeneBot.wdi_core.WDItemEngine.execute_sparql_query',
+               side_effect=execute_sparql_query):
+        qids = find_deprecated_candidates("Q15978631", "P351", releases, last_updated, ["P351", "P594"])
+    # 3 chunks of releases, 1 query for the stale retrieved dates
+    assert len(queries) == 4
+    assert qids == {"Q1", "Q2", "Q3", "Q4"}
+    assert '"2017-01-06T00:00:00Z"^^xsd:dateTime' in queries[-1]
+
+
+def test_is_deprecated_ref():
+    last_updated = {'Q20641742': datetime(2017, 5, 6)}
+    old_release = [wdi_core.WDItemID("Q29458763", 'P248', is_reference=True)]
+    assert is_deprecated_ref(old_release, {29458763}, last_updated)
+    assert is_deprecated_ref(HelperBot.make_reference('entrez', 'P351', '1017', datetime(2016, 5, 1)), set(),
+                             last_updated)
+    assert not is_deprecated_ref(HelperBot.make_reference('entrez', 'P351', '1017', datetime(2017, 5, 1)), set(),
+                                 last_updated)
+
+
+def test_cleanup_taxon():
+    organism_info = {'name': "Homo sapiens", 'wdid': "Q15978631", 'taxid': 9606}
+    last_updated = {'Q20641742': datetime(2017, 5, 6)}
+    with patch('scheduled_bots.geneprotein.GeneBot.find_deprecated_candidates', return_value={"Q1", "Q3", "Q9"}), \
+            patch('scheduled_bots.geneprotein.GeneBot.remove_deprecated_statements') as remove:
+        cleanup_taxon(["Q1", "Q2", "Q3"], "P351", organism_info, set(), last_updated, ["P351"], None, write=False)
+    # only the candidates of the taxon are touched, without a fastrun container for so few items
+    assert [c[0][:2] for c in remove.call_args_list] == [("Q1", None), ("Q3", None)]
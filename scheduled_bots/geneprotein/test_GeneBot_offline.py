@@ -0,0 +1,191 @@
+"""
+Runs GeneBot over a recorded session (see scheduled_bots.utils.RecordedResponses), so the gene item building path,
+from the tagged mygene records through the references, statements and fastrun, is tested without the network.
+
+The session in fixtures/genebot_offline was recorded from the stand-in wikidata below, which answers the sparql
+queries from a small graph and the api from a few entities. To record it again after the bot's requests change:
+python -m scheduled_bots.geneprotein.test_GeneBot_offline
+"""
+import json
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+import requests
+from rdflib import Graph, Literal, URIRef
+from wikidataintegrator import wdi_core, wdi_helpers
+
+from scheduled_bots import get_default_core_props
+from scheduled_bots.geneprotein import HelperBot
+from scheduled_bots.geneprotein.GeneBot import ChromosomalGeneBot
+from scheduled_bots.utils import RecordedResponses
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "genebot_offline")
+
+METADATA = {'entrez': '20170506', 'ensembl': 88}
+ORGANISM_INFO = {"name": "Mus musculus", "type": "mammalian", "wdid": "Q83310", 'taxid': 10090}
+CHR_NUM_WDID = {'1': 'Q15304656'}
+ENSEMBL_88 = "Q29475932"
+
+ENTITY = "http://www.wikidata.org/entity/"
+PREFIXES = """
+@prefix wd: <http://www.wikidata.org/entity/> .
+@prefix wdt: <http://www.wikidata.org/prop/direct/> .
+@prefix p: <http://www.wikidata.org/prop/> .
+@prefix ps: <http://www.wikidata.org/prop/statement/> .
+@prefix pq: <http://www.wikidata.org/prop/qualifier/> .
+@prefix pr: <http://www.wikidata.org/prop/reference/> .
+@prefix prov: <http://www.w3.org/ns/prov#> .
+@prefix schema: <http://schema.org/> .
+@prefix wikibase: <http://wikiba.se/ontology#> .
+@prefix wds: <http://www.wikidata.org/entity/statement/> .
+"""
+
+# equivalent property/class, for WikibaseHelper. Entrez Gene ID is a distinct value property. Ensembl release 88
+STANDIN_GRAPH = PREFIXES + """
+wd:P1628 wdt:P1628 <http://www.w3.org/2002/07/owl#equivalentProperty> ; wikibase:directClaim wdt:P1628 .
+wd:P1709 p:P1628 wds:equivalent-class .
+wds:equivalent-class ps:P1628 <http://www.w3.org/2002/07/owl#equivalentClass> .
+wd:Q7187 p:P1709 wds:gene-class .
+wds:gene-class ps:P1709 <http://purl.obolibrary.org/obo/SO_0000704> .
+wd:P351 wdt:P2302 wd:Q21502410 .
+wd:Q29475932 wdt:P629 wd:Q1344256 ; wdt:P31 wd:Q3331189 ; p:P393 wds:ensembl-88 .
+wds:ensembl-88 ps:P393 "88" .
+"""
+
+PROPERTY_DATATYPES = {'P351': 'external-id', 'P671': 'external-id', 'P593': 'external-id', 'P594': 'external-id',
+                      'P704': 'external-id', 'P639': 'external-id', 'P703': 'wikibase-item', 'P31': 'wikibase-item',
+                      'P279': 'wikibase-item', 'P1057': 'wikibase-item', 'P2548': 'wikibase-item',
+                      'P644': 'string', 'P645': 'string', 'P248': 'wikibase-item', 'P813': 'time'}
+
+
+def claim(pid, value, n):
+    datatype = PROPERTY_DATATYPES[pid]
+    if datatype == 'wikibase-item':
+        datavalue = {'type': 'wikibase-entityid',
+                     'value': {'entity-type': 'item', 'id': value, 'numeric-id': int(value[1:])}}
+    else:
+        datavalue = {'type': 'string', 'value': value}
+    return {'id': "Q100$stand-in-{}".format(n), 'type': 'statement', 'rank': 'normal',
+            'mainsnak': {'snaktype': 'value', 'property': pid, 'datatype': datatype, 'datavalue': datavalue}}
+
+
+# gene 1 is already in wikidata, with only its entrez id and taxon. gene 2 isn't
+ITEMS = {'Q100': {'id': 'Q100', 'type': 'item', 'lastrevid': 1000, 'modified': "2017-05-01T00:00:00Z",
+                  'labels': {'en': {'language': 'en', 'value': 'Tst1'}}, 'descriptions': {}, 'aliases': {},
+                  'sitelinks': {}, 'claims': {'P351': [claim('P351', '1', 0)], 'P703': [claim('P703', 'Q83310', 1)]}}}
+
+
+def mygene_doc(entrez):
+    ensembl_gene = "ENSMUSG{:011d}".format(entrez)
+    return {'_id': str(entrez), 'entrezgene': entrez, 'name': "test gene {}".format(entrez),
+            'symbol': "Tst{}".format(entrez), 'taxid': 10090, 'type_of_gene': 'protein-coding',
+            'MGI': "MGI:{}".format(entrez),
+            'ensembl': {'gene': ensembl_gene, 'transcript': ["ENSMUST{:011d}".format(entrez)]},
+            'genomic_pos': {'chr': '1', 'start': 1000 * entrez, 'end': 1000 * entrez + 500, 'strand': 1,
+                            'ensemblgene': ensembl_gene},
+            'homologene': {'id': entrez, 'genes': [[10090, entrez]]}}
+
+
+class StandInWikidata:
+    """ answers sparql queries from STANDIN_GRAPH and the items, and wbgetentities from ITEMS and the properties """
+
+    def __init__(self):
+        self.graph = Graph()
+        self.graph.parse(data=STANDIN_GRAPH, format='turtle')
+        for qid, item in ITEMS.items():
+            for pid, claims in item['claims'].items():
+                for c in claims:
+                    value = c['mainsnak']['datavalue']['value']
+                    value = URIRef(ENTITY + value['id']) if isinstance(value, dict) else Literal(value)
+                    statement = URIRef(ENTITY + "statement/" + c['id'].replace("$", "-"))
+                    self.graph.add((URIRef(ENTITY + qid), URIRef("http://www.wikidata.org/prop/direct/" + pid), value))
+                    self.graph.add((URIRef(ENTITY + qid), URIRef("http://www.wikidata.org/prop/" + pid), statement))
+                    self.graph.add((statement, URIRef("http://www.wikidata.org/prop/statement/" + pid), value))
+        self.namespaces = dict(self.graph.namespaces())
+
+    def request(self, session, method, url, params=None, data=None, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = url
+        response.headers['Content-Type'] = 'application/json'
+        if 'query' in (data or params or dict()):
+            result = self.graph.query((data or params)['query'], initNs=self.namespaces)
+            body = json.loads(result.serialize(format='json'))
+            # rdflib gives one empty row for an empty group
+            body['results']['bindings'] = [b for b in body['results']['bindings'] if b]
+        else:
+            entities = dict()
+            for eid in (params or data)['ids'].split("|"):
+                if eid in ITEMS:
+                    entities[eid] = ITEMS[eid]
+                else:
+                    entities[eid] = {'id': eid, 'type': 'property', 'datatype': PROPERTY_DATATYPES[eid], 'labels': {},
+                                     'descriptions': {}, 'aliases': {}, 'claims': {}}
+            body = {'entities': entities, 'success': 1}
+        response._content = json.dumps(body).encode('utf-8')
+        return response
+
+
+def run_bot(responses):
+    """
+    One dummy run of two mouse genes, with nothing cached from earlier runs
+    :return: the bot, and the items passed to try_write
+    """
+    log_dir = tempfile.mkdtemp()
+    wdi_core.WDItemEngine.setup_logging(log_dir=log_dir, logger_name='WD_logger', log_name="offline.log")
+    wdi_core.WDItemEngine.fast_run_store = []
+    get_default_core_props.cache_clear()
+    with patch('scheduled_bots.geneprotein.HelperBot.release_registry', HelperBot.ReleaseRegistry()), \
+            patch.dict(wdi_helpers.Release._release_cache, clear=True), \
+            patch('scheduled_bots.geneprotein.GeneBot.wdi_helpers.try_write',
+                  wraps=wdi_helpers.try_write) as try_write:
+        docs = responses.cached_json("mygene_10090", lambda: [mygene_doc(1), mygene_doc(2)])
+        docs = HelperBot.validate_docs(docs, 'eukaryotic', 'P351')
+        records = HelperBot.tag_mygene_docs(docs, METADATA)
+        bot = ChromosomalGeneBot(ORGANISM_INFO, CHR_NUM_WDID, None)
+        bot.failed = []
+        bot.run(records, total=2, fast_run=True, write=False)
+    wdi_core.WDItemEngine.fast_run_store = []
+    get_default_core_props.cache_clear()
+    shutil.rmtree(log_dir)
+    return bot, [c[0][0] for c in try_write.call_args_list]
+
+
+def record_fixture(path=FIXTURE_PATH):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    with patch('requests.Session.request', StandInWikidata().request):
+        with RecordedResponses(path, record=True) as responses:
+            run_bot(responses)
+
+
+def statement_values(item, pid):
+    return sorted(str(s.get_value()) for s in item.statements if s.get_prop_nr() == pid)
+
+
+def test_genebot_offline():
+    with RecordedResponses(FIXTURE_PATH) as responses:
+        bot, items = run_bot(responses)
+    assert bot.failed == []
+    # the release and core property lookups once, the fastrun queries once per property, and per gene only the core
+    # id lookups and the item itself. a new request anywhere in the path fails the replay
+    assert responses.n_requests == 19
+
+    existing, new = items
+    assert existing.wd_item_id == "Q100" and existing.require_write and not existing.create_new_item
+    assert new.create_new_item and new.get_wd_json_representation()['labels']['en']['value'] == "Tst2"
+    assert statement_values(new, 'P351') == ['2']
+    assert statement_values(new, 'P671') == ['MGI:2']
+    assert statement_values(new, 'P594') == ['ENSMUSG00000000002']
+    assert statement_values(new, 'P644') == ['2000'] and statement_values(new, 'P645') == ['2500']
+    assert statement_values(new, 'P1057') == ['15304656']
+    # the ensembl statements are stated in the release item found in the recorded session
+    ensembl = [s for s in new.statements if s.get_prop_nr() == 'P594'][0]
+    assert [r.get_value() for r in ensembl.get_references()[0] if r.get_prop_nr() == 'P248'] == [int(ENSEMBL_88[1:])]
+
+
+if __name__ == "__main__":
+    record_fixture()
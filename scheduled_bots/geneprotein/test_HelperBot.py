@@ -1,4 +1,6 @@
-from .HelperBot import make_ref_source, validate_doc_eukaryotic, validate_doc_microbial
+from unittest.mock import patch
+
+from .HelperBot import make_ref_source, validate_doc_eukaryotic, validate_doc_microbial, ReleaseRegistry
 from nose.tools import assert_raises
 
 # PASS
@@ -184,3 +186,25 @@ def test_make_reference_release():
                                    'snaktype': 'value'}]}]
 
     assert [x.get_json_representation() for x in ref] == correct_json_rep
+
+
+def test_release_registry_one_lookup_per_release():
+    registry = ReleaseRegistry()
+    with patch('scheduled_bots.geneprotein.HelperBot.wdi_helpers.Release') as Release:
+        Release.return_value.get_or_create.side_effect = lambda login: "Q{}".format(Release.call_count)
+        with patch('scheduled_bots.geneprotein.HelperBot.release_registry', registry):
+            for identifier in range(100):
+                make_ref_source({'id': 'ensembl', 'release': '86'}, 'P594', str(identifier))
+                make_ref_source({'id': 'ensembl', 'release': 86}, 'P704', str(identifier))
+                make_ref_source({'id': 'refseq', 'release': '80'}, 'P639', str(identifier))
+    assert Release.call_count == 2
+    assert registry.releases == {('ensembl', '86'): 'Q1', ('refseq', '80'): 'Q2'}
+
+
+def test_make_reference_shares_snaks():
+    ref1 = make_ref_source({'id': 'entrez', 'timestamp': '20161204'}, 'P351', '1234')
+    ref2 = make_ref_source({'id': 'entrez', 'timestamp': '20161204'}, 'P351', '5678')
+    # stated in and retrieved are the same objects, the link to the id is not
+    assert ref1[0] is ref2[0] and ref1[1] is ref2[1]
+    assert ref1[2] is not ref2[2]
+    assert ref2[2].get_value() == '5678'
@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+from scheduled_bots.geneprotein.ortholog_table import OrthologTable
+
+
+def doc(taxid, entrez, genes):
+    return {'taxid': {'@value': taxid}, 'entrezgene': {'@value': entrez}, 'homologene': {'@value': {'genes': genes}}}
+
+
+def test_ortholog_table():
+    genes = [[9606, 1017], [10090, 12566], [10116, 362817], [4932, 852457]]
+    records = iter([doc(9606, 1017, genes), doc(10090, 12566, genes), doc(10116, 362817, genes),
+                    doc(559292, 852457, genes)])
+    # the rat gene isn't in wikidata
+    entrez_wdid = {'1017': 'Q14911732', '12566': 'Q18049645', '852457': 'Q27548439'}
+
+    table = OrthologTable(os.path.join(tempfile.mkdtemp(), "orthologs.sqlite"))
+    table.load(records, entrez_wdid, batch_size=2)
+    assert table.taxa() == {'9606': 1, '10090': 1, '559292': 1}
+    assert list(table.iter_orthologs('9606')) == [('1017', {'12566': '10090', '852457': '559292'})]
+    # the yeast species in homologene is the strain in entrez
+    assert list(table.iter_orthologs('559292')) == [('852457', {'1017': '9606', '12566': '10090'})]
+    table.close()
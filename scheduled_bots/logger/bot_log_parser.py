@@ -2,37 +2,97 @@ import glob
 import os
 import webbrowser
 from ast import literal_eval
-from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from json import JSONDecodeError
 
 import click
 import pandas as pd
 import json
-import sys
 
 import re
 import requests
 from dateutil.parser import parse as dateutil_parse
 from jinja2 import Template
 
+from scheduled_bots.logger.log_store import LogStore
+
 pd.options.display.max_colwidth = 100
 
+FORMATTER_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "bot_log_parser_formatters.json")
+# files written next to a log for its report
+INFO_TABLE_SUFFIX = ".info.js"
+REPORT_EXTENSIONS = (".html", ".js")
 
-@lru_cache()
-def get_prop_formatter(pid):
-    if not (pid.startswith("P") and isint(pid[1:])):
-        return None
+
+class FormatterCache:
+    """
+    Formatter URLs (P1630) of properties, fetched in batches and optionally kept in a json file across runs.
+    Properties without a formatter URL are stored as None
+    """
+
+    def __init__(self, cache_path=None):
+        # pid -> formatter URL
+        self.formatters = dict()
+        # formatters fetched since this was loaded
+        self.new = dict()
+        self.cache_path = None
+        if cache_path:
+            self.load(cache_path)
+
+    def load(self, cache_path):
+        self.cache_path = cache_path
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                self.formatters.update(json.load(f))
+
+    def save(self):
+        if self.cache_path:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, 'w') as f:
+                json.dump(self.formatters, f, indent=2)
+
+    def update(self, formatters):
+        self.formatters.update(formatters)
+        self.new.update(formatters)
+
+    def prefetch(self, pids, chunk_size=50):
+        # get the formatters for all `pids` we don't have yet, `chunk_size` properties per request
+        pids = sorted(set(pid for pid in pids if pid not in self.formatters and is_pid(pid)))
+        for i in range(0, len(pids), chunk_size):
+            chunk = pids[i:i + chunk_size]
+            try:
+                entities = requests.get("https://www.wikidata.org/w/api.php",
+                                        params={'action': 'wbgetentities', 'ids': "|".join(chunk),
+                                                'props': 'claims', 'format': 'json'}).json()['entities']
+            except Exception as e:
+                print("Getting formatter URLs failed: {}".format(e))
+                continue
+            self.update({pid: get_formatter_from_entity(entities.get(pid, dict())) for pid in chunk})
+
+    def get(self, pid):
+        if pid not in self.formatters:
+            self.prefetch([pid])
+        return self.formatters.get(pid)
+
+
+def get_formatter_from_entity(entity):
     try:
-        d = requests.get("https://www.wikidata.org/wiki/Special:EntityData/{}.json".format(pid)).json()
-        return d['entities'][pid]['claims']['P1630'][0]['mainsnak']['datavalue']['value']
-    except Exception:
+        return entity['claims']['P1630'][0]['mainsnak']['datavalue']['value']
+    except (KeyError, IndexError):
         return None
 
 
+def is_pid(s):
+    return s.startswith("P") and isint(s[1:])
+
+
+formatter_cache = FormatterCache()
+
+
 def parse_log(file_path):
     # todo: Actually parse the header and col names
     # note, missing Rev ID in the old logs will just be NaN and won't throw an error
-    df = pd.read_csv(file_path, sep=",",
+    df = pd.read_csv(file_path,
                      names=['Level', 'Timestamp', 'External ID', 'Prop', 'QID', 'Message', 'Msg Type', 'Rev ID'],
                      skiprows=2, dtype={'External ID': str, 'Rev ID': str},
                      comment='#', quotechar='"', skipinitialspace=True, delimiter=';')
@@ -43,22 +103,27 @@ def parse_log(file_path):
     return df
 
 
-def gen_ext_id_links(df: pd.DataFrame):
+def gen_ext_id_links(df: pd.DataFrame, formatters=None):
     # given the columns "Prop" and "External ID", if prop is a wikidata property, get the formatter URL
-    # and create links to the external ID
-    df['External ID'] = df.apply(lambda row: get_ext_id_link(row['Prop'], row['External ID']), axis=1)
+    # and create links to the external ID. the links are built for all rows of each property at once
+    formatters = formatters if formatters is not None else formatter_cache
+    formatters.prefetch(df['Prop'].unique())
+    ext_id = df['External ID']
+    links = ext_id.copy()
+    for pid, idx in df.groupby('Prop').groups.items():
+        formatter = formatters.get(pid) if is_pid(pid) else None
+        if not formatter:
+            continue
+        ids = ext_id[idx]
+        parts = formatter.split("$1")
+        url = parts[0]
+        for part in parts[1:]:
+            url = url + ids + part
+        links[idx] = '<a href="' + url + '">' + ids + '</a>'
+    df['External ID'] = links
     return df
 
 
-def get_ext_id_link(pid, ext_id):
-    formatter = get_prop_formatter(pid)
-    if formatter:
-        url = formatter.replace("$1", ext_id)
-        return '<a href="{}">{}</a>'.format(url, ext_id)
-    else:
-        return ext_id
-
-
 def process_log(file_path):
     """
     Expects header as first line in log file. Header begins with comment character '#'. The line is a json string dump of
@@ -123,15 +188,15 @@ def isint(s):
 
 
 def url_qid(df, col):
-    href = "<a href=https://www.wikidata.org/wiki/{}>{}</a>"
-    f = lambda x: href.format(x, x) if x.startswith("Q") and isint(x[1:]) else x
-    # df.is_copy = False
-    df.loc[:, col] = df[col].apply(f)
+    values = df[col]
+    is_qid = values.str.match(r"Q\d+$")
+    df.loc[:, col] = values.where(~is_qid, "<a href=https://www.wikidata.org/wiki/" + values + ">" + values + "</a>")
     return df
 
 
-def escape_html_chars(s):
-    return s.replace("&", r'&amp;').replace("<", r'&lt;').replace(">", r'&gt;')
+def escape_html_series(s: pd.Series):
+    return s.str.replace("&", '&amp;', regex=False).str.replace("<", '&lt;', regex=False).str.replace(
+        ">", '&gt;', regex=False)
 
 
 def try_json(s):
@@ -152,6 +217,19 @@ def wiki_links_to_html(s):
     return s
 
 
+FORMATTED_ERROR_TYPES = ["WDApiError", "NonUniqueLabelDescriptionPairError", "ManualInterventionReqException"]
+
+
+def format_errors(df):
+    # only the messages with an error type that gets formatted are looked at row by row
+    needs_format = df['Msg Type'].str.contains("|".join(FORMATTED_ERROR_TYPES), regex=True)
+    messages = df['Message'].astype(object)
+    if needs_format.any():
+        rows = df[needs_format]
+        messages[needs_format] = [format_error(t, m) for t, m in zip(rows['Msg Type'], rows['Message'])]
+    return messages
+
+
 def format_error(error_type, s):
     # attempts to format an error message, depending on the type of error
     if "WDApiError" in error_type or "NonUniqueLabelDescriptionPairError" in error_type:
@@ -187,77 +265,110 @@ def format_wdapierror(d):
         return d
 
 
+def df_to_json(df):
+    # rows of a table for the template, which renders one page of them at a time
+    rows = df.astype(str).values.tolist()
+    # keep a "</script>" in a message from closing the script tag the table is in
+    return json.dumps({'columns': list(df.columns), 'rows': rows}).replace("</", "<\\/")
+
+
+def write_table_js(path, table_id, df):
+    # a table too big to be inline in the report, as a script the report loads when the table is shown.
+    # a script tag can load it from a report opened from the file system, where a json file can't be fetched
+    with open(path, 'w') as f:
+        f.write("window.LOG_TABLES = window.LOG_TABLES || {};\n")
+        f.write("LOG_TABLES[{}] = {};\n".format(json.dumps(table_id), df_to_json(df)))
+
+
+def _main_safe(log_path, formatters, store_path=None):
+    # for processing a directory of logs in parallel. returns the formatter URLs fetched by this process
+    formatter_cache.update(formatters)
+    formatter_cache.new = dict()
+    try:
+        _main(log_path, store_path=store_path)
+    except Exception as e:
+        print("Parsing log failed: {}".format(log_path))
+    return formatter_cache.new
+
+
 @click.command()
 @click.argument('log-path')
 @click.option('--show-browser', default=False, is_flag=True, help='show log in browser')
-def main(log_path, show_browser=False):
+@click.option('--formatter-cache', 'cache_path', default=FORMATTER_CACHE_PATH,
+              help='json file to keep formatter URLs in across runs')
+@click.option('--processes', default=None, type=int, help='number of logs to parse at once in a directory')
+@click.option('--store', 'store_path', default=None,
+              help='sqlite log store to load the logs into, and to read them from for the reports')
+def main(log_path, show_browser=False, cache_path=FORMATTER_CACHE_PATH, processes=None, store_path=None):
+    formatter_cache.load(cache_path)
     if os.path.isdir(log_path):
-        # run on all files in dir (that don't end in html), and ignore show_browser
+        # run on all files in dir (that aren't reports), and ignore show_browser
         files = [x for x in glob.glob(os.path.join(log_path, "*")) if
-                 not x.endswith(".html") and os.stat(x).st_size != 0]
-        for file in files:
-            try:
-                _main(file)
-            except Exception as e:
-                print("Parsing log failed: {}".format(file))
+                 not x.endswith(REPORT_EXTENSIONS) and os.stat(x).st_size != 0]
+        if store_path:
+            # load the logs once, here, so the reports only read from the store
+            store = LogStore(store_path)
+            store.ingest_dir(log_path)
+            store.close()
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for new in executor.map(_main_safe, files, [formatter_cache.formatters] * len(files),
+                                    [store_path] * len(files)):
+                formatter_cache.update(new)
     else:
-        _main(log_path, show_browser)
+        _main(log_path, show_browser, store_path=store_path)
+    formatter_cache.save()
 
 
-def _main(log_path, show_browser=False):
+def _main(log_path, show_browser=False, store_path=None):
     print(log_path)
-    df, metadata = process_log(log_path)
+    if store_path:
+        store = LogStore(store_path)
+        df, metadata = store.get_log(log_path)
+        store.close()
+    else:
+        df, metadata = process_log(log_path)
     del df['Timestamp']
-    df['Msg Type'] = df['Msg Type'].apply(escape_html_chars)
-    df['Message'] = df['Message'].apply(escape_html_chars)
-    # df['Message'] = df['Message'].apply(try_json)
-    df['Message'] = df.apply(lambda row: format_error(row['Msg Type'], row['Message']), 1)
-    df['Rev ID'] = df['Rev ID'].apply(lambda x: '<a href="https://www.wikidata.org/w/index.php?oldid={}&diff=prev">{}</a>'.format(x,x) if x else x)
+    df['Msg Type'] = escape_html_series(df['Msg Type'])
+    df['Message'] = escape_html_series(df['Message'])
+    df['Message'] = format_errors(df)
+    rev_id = df['Rev ID']
+    df['Rev ID'] = rev_id.where(rev_id == '', '<a href="https://www.wikidata.org/w/index.php?oldid=' + rev_id +
+                                '&diff=prev">' + rev_id + '</a>')
 
     level_counts, info_counts, warning_counts, error_counts = generate_summary(df)
 
-    warnings_df = df.query("Level == 'WARNING'")
-    warnings_df.is_copy = False
-    del warnings_df['Level']
-    if not warnings_df.empty:
-        warnings_df = gen_ext_id_links(warnings_df)
-        warnings_df = url_qid(warnings_df, "QID")
-
-    errors_df = df.query("Level == 'ERROR'")
-    errors_df.is_copy = False
-    del errors_df['Level']
-    if not errors_df.empty:
-        errors_df = gen_ext_id_links(errors_df)
-        errors_df = url_qid(errors_df, "QID")
-        # errors_df['Message'] = errors_df['Message'].apply(try_format_error)
-
-    info_df = df.query("Level == 'INFO'")
-    info_df.is_copy = False
-    del info_df['Level']
-    if not info_df.empty:
-        info_df = gen_ext_id_links(info_df)
-        info_df = url_qid(info_df, "QID")
-        info_df.Message = info_df.Message.str.replace("SKIP", "No Action")
-
-    with pd.option_context('display.max_colwidth', -1):
+    tables = dict()
+    for level in ['INFO', 'WARNING', 'ERROR']:
+        level_df = df[df.Level == level].drop(columns='Level')
+        if not level_df.empty:
+            level_df = gen_ext_id_links(level_df)
+            level_df = url_qid(level_df, "QID")
+        if level == 'INFO' and not level_df.empty:
+            level_df['Message'] = level_df['Message'].str.replace("SKIP", "No Action", regex=False)
+        tables[level] = level_df
+
+    with pd.option_context('display.max_colwidth', None):
         # this class nonsense is an ugly hack: https://stackoverflow.com/questions/15079118/js-datatables-from-pandas/41536906
         level_counts = level_counts.to_frame().to_html(escape=False)
         info_counts = info_counts.to_frame().to_html(escape=False)
         warning_counts = warning_counts.to_frame().to_html(escape=False)
         error_counts = error_counts.to_frame().to_html(escape=False)
-        info_df = info_df.to_html(escape=False, classes='df" id = "info_df')
-        warnings_df = warnings_df.to_html(escape=False, classes='df" id = "warning_df')
-        errors_df = errors_df.to_html(escape=False, classes='df" id = "error_df')
 
-    template = Template(open(os.path.join(sys.path[0], "template.html")).read())
+    # the INFO rows, one for every item the bot touched, are in their own file next to the report, so the report's
+    # size doesn't grow with the run
+    out_path = log_path.rsplit(".", 1)[0] + ".html"
+    info_path = log_path.rsplit(".", 1)[0] + INFO_TABLE_SUFFIX
+    write_table_js(info_path, "info_df", tables['INFO'])
+
+    template = Template(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "template.html")).read())
 
     s = template.render(name=metadata['name'], run_id=metadata['run_id'],
                         level_counts=level_counts,
                         info_counts=info_counts,
                         warning_counts=warning_counts,
                         error_counts=error_counts,
-                        warnings_df=warnings_df, errors_df=errors_df, info_df=info_df)
-    out_path = log_path.rsplit(".", 1)[0] + ".html"
+                        warnings_df=df_to_json(tables['WARNING']), errors_df=df_to_json(tables['ERROR']),
+                        info_file=os.path.basename(info_path))
     with open(out_path, 'w') as f:
         f.write(s)
 
@@ -0,0 +1,179 @@
+"""
+A local SQLite store of WDItemEngine log files, for querying across runs without parsing the logs again.
+
+Log files are ingested once, and again only if they changed since they were last ingested.
+
+Example: the entrez IDs that errored in each of the last 10 GeneBot runs
+    store = LogStore()
+    store.ingest_dir("logs")
+    store.errored_ids("GeneBot", last=10)
+"""
+import glob
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+LOG_STORE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "bot_logs.sqlite")
+
+# column in the log file -> column in the store
+COLUMNS = {'Level': 'level', 'Timestamp': 'timestamp', 'External ID': 'external_id', 'Prop': 'prop', 'QID': 'qid',
+           'Message': 'message', 'Msg Type': 'msg_type', 'Rev ID': 'rev_id'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL,
+                                 run_id TEXT, name TEXT, timestamp TEXT, metadata TEXT);
+CREATE TABLE IF NOT EXISTS log (run INTEGER REFERENCES runs(run), level TEXT, timestamp TEXT, external_id TEXT,
+                                prop TEXT, qid TEXT, message TEXT, msg_type TEXT, rev_id TEXT);
+CREATE INDEX IF NOT EXISTS runs_run_id ON runs(run_id);
+CREATE INDEX IF NOT EXISTS runs_name ON runs(name, timestamp);
+CREATE INDEX IF NOT EXISTS log_run ON log(run);
+CREATE INDEX IF NOT EXISTS log_level ON log(level, run);
+CREATE INDEX IF NOT EXISTS log_external_id ON log(external_id);
+CREATE INDEX IF NOT EXISTS log_qid ON log(qid);
+"""
+
+
+class LogStore:
+    def __init__(self, path=LOG_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = os.path.abspath(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def ingest(self, file_path):
+        """
+        Load a log file into the store, replacing what was stored for it if the file changed since
+        :return: the run key of the file in the store
+        """
+        from scheduled_bots.logger.bot_log_parser import process_log
+
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        row = self.conn.execute("SELECT run, size, mtime FROM runs WHERE path = ?", (file_path,)).fetchone()
+        if row and row[1] == stat.st_size and row[2] == stat.st_mtime:
+            return row[0]
+
+        df, metadata = process_log(file_path)
+        df = df.rename(columns=COLUMNS)
+        df['timestamp'] = df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        timestamp = str(metadata['timestamp']) if metadata.get('timestamp') else None
+        run_id = metadata.get('run_id') or os.path.basename(file_path)
+        with self.conn:
+            if row:
+                self.conn.execute("DELETE FROM log WHERE run = ?", (row[0],))
+                self.conn.execute("DELETE FROM runs WHERE run = ?", (row[0],))
+            cursor = self.conn.execute(
+                "INSERT INTO runs (path, size, mtime, run_id, name, timestamp, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_path, stat.st_size, stat.st_mtime, run_id, metadata.get('name', ''), timestamp,
+                 json.dumps(metadata, default=str)))
+            run = cursor.lastrowid
+            df.insert(0, 'run', run)
+            self.conn.executemany("INSERT INTO log ({}) VALUES ({})".format(
+                ", ".join(df.columns), ", ".join("?" * len(df.columns))), df.itertuples(index=False, name=None))
+        return run
+
+    def ingest_dir(self, log_dir):
+        # ingest all of the log files in a directory, skipping the reports (and the store, if it's there)
+        files = [x for x in glob.glob(os.path.join(log_dir, "*")) if not x.endswith((".html", ".js"))
+                 and os.path.isfile(x) and os.stat(x).st_size != 0 and not os.path.abspath(x).startswith(self.path)]
+        runs = []
+        for file in sorted(files):
+            try:
+                runs.append(self.ingest(file))
+            except Exception as e:
+                print("Ingesting log failed: {}: {}".format(file, e))
+        return runs
+
+    def get_log(self, file_path):
+        """
+        Get a log file from the store, ingesting it if needed
+        :return: (df, metadata), like `bot_log_parser.process_log`
+        """
+        run = self.ingest(file_path)
+        metadata = json.loads(self.conn.execute("SELECT metadata FROM runs WHERE run = ?", (run,)).fetchone()[0])
+        df = pd.read_sql_query("SELECT {} FROM log WHERE run = ? ORDER BY rowid".format(", ".join(COLUMNS.values())),
+                               self.conn, params=(run,))
+        df = df.rename(columns={v: k for k, v in COLUMNS.items()})
+        df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+        return df, metadata
+
+    def runs(self, name=None, last=None):
+        """
+        The runs in the store, most recent first
+        :param name: only runs of the task with this name
+        :param last: only the `last` most recent runs
+        """
+        query = "SELECT run, run_id, name, timestamp, path FROM runs"
+        params = []
+        if name is not None:
+            query += " WHERE name = ?"
+            params.append(name)
+        query += " ORDER BY timestamp DESC"
+        if last is not None:
+            query += " LIMIT ?"
+            params.append(last)
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    def query(self, level=None, name=None, last=None, external_ids=None, qids=None, run_ids=None):
+        """
+        Get log rows across runs, with the run_id and name of the run for each row
+        :param level: 'INFO', 'WARNING' or 'ERROR'
+        :param name: only runs of the task with this name
+        :param last: only the `last` most recent runs (of `name`, if given)
+        :param external_ids: only rows with these external IDs
+        :param qids: only rows on these items
+        :param run_ids: only these runs
+        """
+        where = []
+        params = []
+        if last is not None:
+            runs = list(self.runs(name=name, last=last)['run'])
+            where.append("log.run IN ({})".format(", ".join("?" * len(runs))))
+            params.extend(runs)
+        elif name is not None:
+            where.append("runs.name = ?")
+            params.append(name)
+        for column, values in [('log.external_id', external_ids), ('log.qid', qids), ('runs.run_id', run_ids)]:
+            if values is not None:
+                values = list(values)
+                where.append("{} IN ({})".format(column, ", ".join("?" * len(values))))
+                params.extend(values)
+        if level is not None:
+            where.append("log.level = ?")
+            params.append(level)
+        query = "SELECT runs.run_id, runs.name, log.* FROM log JOIN runs ON log.run = runs.run"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        return pd.read_sql_query(query + " ORDER BY log.run, log.rowid", self.conn, params=params)
+
+    def errored_ids(self, name, last=10):
+        # {run_id: set of external IDs that errored in that run}, for the `last` runs of `name`
+        df = self.query(level='ERROR', name=name, last=last)
+        return {run_id: set(group['external_id']) for run_id, group in df.groupby('run_id')}
+
+    def level_counts(self, name=None, last=None):
+        """
+        Count of rows in each level, and the fraction of rows that are errors, for each run
+        :return: DataFrame indexed by run_id, most recent first
+        """
+        runs = self.runs(name=name, last=last)
+        keys = list(runs['run'])
+        counts = pd.read_sql_query(
+            "SELECT run, level, COUNT(*) AS count FROM log WHERE run IN ({}) GROUP BY run, level".format(
+                ", ".join("?" * len(keys))), self.conn, params=keys)
+        counts = counts.pivot(index='run', columns='level', values='count').reindex(keys).fillna(0).astype(int)
+        for level in ['INFO', 'WARNING', 'ERROR']:
+            if level not in counts:
+                counts[level] = 0
+        counts = counts[['INFO', 'WARNING', 'ERROR']]
+        total = counts.sum(axis=1)
+        counts['error_rate'] = (counts['ERROR'] / total.where(total > 0)).fillna(0)
+        counts.index = runs['run_id']
+        counts.columns.name = None
+        return counts
@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+import pandas as pd
+
+from scheduled_bots.logger import bot_log_parser
+from scheduled_bots.logger.bot_log_parser import FormatterCache, gen_ext_id_links, url_qid, format_errors, _main
+
+log = """#{"name": "GeneBot", "run_id": "20180601_10:00", "timestamp": "2018-06-01T10:00:00"}
+Level;Timestamp;External ID;Prop;QID;Message;Msg Type;Rev ID
+INFO;06/01/2018 10:00:00;1017;P351;Q14911732;SKIP;;
+INFO;06/01/2018 10:00:01;1018;P351;Q14911733;UPDATE;;123
+WARNING;06/01/2018 10:00:02;1019;P351;;no genomic position <b>;WARNING;
+ERROR;06/01/2018 10:00:03;1020;P351;;"More than one WD item has the same property value Property: P351, items affected: ['Q1', 'Q2']";ManualInterventionReqException;
+"""
+
+
+def test_gen_ext_id_links():
+    formatters = FormatterCache()
+    formatters.update({'P351': "https://www.ncbi.nlm.nih.gov/gene/$1", 'P352': None})
+    df = pd.DataFrame({'Prop': ['P351', 'P352', '', 'P351'], 'External ID': ['1017', 'P04637', 'x', '1018'],
+                       'QID': ['Q14911732', 'Q', 'Q1a', '']})
+    with mock.patch('scheduled_bots.logger.bot_log_parser.requests.get', side_effect=AssertionError):
+        df = gen_ext_id_links(df, formatters)
+    assert df['External ID'].tolist() == ['<a href="https://www.ncbi.nlm.nih.gov/gene/1017">1017</a>', 'P04637', 'x',
+                                          '<a href="https://www.ncbi.nlm.nih.gov/gene/1018">1018</a>']
+    df = url_qid(df, "QID")
+    assert df['QID'].tolist() == ['<a href=https://www.wikidata.org/wiki/Q14911732>Q14911732</a>', 'Q', 'Q1a', '']
+
+
+def test_formatter_cache_prefetch():
+    response = mock.Mock()
+    response.json.return_value = {'entities': {
+        'P351': {'claims': {'P1630': [{'mainsnak': {'datavalue': {'value': "https://www.ncbi.nlm.nih.gov/gene/$1"}}}]}},
+        'P31': {'claims': {}}}}
+    path = os.path.join(tempfile.mkdtemp(), "formatters.json")
+    formatters = FormatterCache(path)
+    with mock.patch('scheduled_bots.logger.bot_log_parser.requests.get', return_value=response) as get:
+        formatters.prefetch(['P351', 'P31', 'P351', '', 'Q5'])
+        assert formatters.get('P31') is None
+    assert get.call_count == 1
+    formatters.save()
+    assert FormatterCache(path).formatters == {'P351': "https://www.ncbi.nlm.nih.gov/gene/$1", 'P31': None}
+
+
+def test_format_errors():
+    df = pd.DataFrame({'Msg Type': ['', 'ManualInterventionReqException'],
+                       'Message': ['UPDATE', "More than one WD item has the same property value Property: P351, "
+                                             "items affected: ['Q1']"]})
+    assert format_errors(df).tolist() == [
+        'UPDATE', 'More than one WD item has the same property value: '
+                  '<a href="https://www.wikidata.org/wiki/Q1#P351">Q1</a>']
+
+
+def test_main():
+    path = os.path.join(tempfile.mkdtemp(), "GeneBot.log")
+    with open(path, 'w') as f:
+        f.write(log)
+    bot_log_parser.formatter_cache.update({'P351': "https://www.ncbi.nlm.nih.gov/gene/$1"})
+    with mock.patch('scheduled_bots.logger.bot_log_parser.requests.get', side_effect=AssertionError):
+        _main(path)
+    with open(path.rsplit(".", 1)[0] + ".html") as f:
+        html = f.read()
+    # the INFO rows aren't in the report, but in a script next to it
+    assert 'info_df_data' not in html and '"info_df": "GeneBot.info.js"' in html
+    with open(path.rsplit(".", 1)[0] + ".info.js") as f:
+        info = json.loads(f.read().split('LOG_TABLES["info_df"] = ')[1].rstrip().rstrip(";"))
+    assert info['columns'] == ['External ID', 'Prop', 'QID', 'Message', 'Msg Type', 'Rev ID']
+    assert [row[3] for row in info['rows']] == ['No Action', 'UPDATE']
+    assert 'no genomic position &lt;b&gt;' in html
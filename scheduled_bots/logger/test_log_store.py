@@ -0,0 +1,49 @@
+import os
+import tempfile
+from unittest import mock
+
+from scheduled_bots.logger import bot_log_parser
+from scheduled_bots.logger.log_store import LogStore
+from scheduled_bots.logger.test_bot_log_parser import log
+
+
+def write_logs(log_dir):
+    # two GeneBot runs. 1020 errors in both, 1019 only in the second
+    run1 = log.replace("WARNING;06/01/2018 10:00:02;1019;P351;;no genomic position <b>;WARNING;",
+                       "INFO;06/01/2018 10:00:02;1019;P351;Q14911734;SKIP;;")
+    run2 = log.replace("20180601_10:00", "20180608_10:00").replace("2018-06-01", "2018-06-08").replace(
+        "WARNING;06/01/2018 10:00:02;1019;P351;;no genomic position <b>;WARNING;",
+        "ERROR;06/08/2018 10:00:02;1019;P351;;failed;Exception;")
+    for name, s in [("GeneBot-20180601.log", run1), ("GeneBot-20180608.log", run2)]:
+        with open(os.path.join(log_dir, name), 'w') as f:
+            f.write(s)
+
+
+def test_ingest_once():
+    log_dir = tempfile.mkdtemp()
+    write_logs(log_dir)
+    store = LogStore(os.path.join(log_dir, "store.sqlite"))
+    with mock.patch('scheduled_bots.logger.bot_log_parser.process_log', wraps=bot_log_parser.process_log) as parse:
+        runs = store.ingest_dir(log_dir)
+        assert store.ingest_dir(log_dir) == runs
+        df, metadata = store.get_log(os.path.join(log_dir, "GeneBot-20180601.log"))
+    # each file is only parsed the first time
+    assert parse.call_count == 2
+    assert metadata['run_id'] == "20180601_10:00"
+    expected, _ = bot_log_parser.process_log(os.path.join(log_dir, "GeneBot-20180601.log"))
+    assert df.equals(expected)
+
+
+def test_query_across_runs():
+    log_dir = tempfile.mkdtemp()
+    write_logs(log_dir)
+    store = LogStore(os.path.join(log_dir, "store.sqlite"))
+    store.ingest_dir(log_dir)
+    assert list(store.runs(name="GeneBot")['run_id']) == ["20180608_10:00", "20180601_10:00"]
+    assert store.errored_ids("GeneBot", last=10) == {"20180601_10:00": {'1020'}, "20180608_10:00": {'1019', '1020'}}
+    assert store.errored_ids("GeneBot", last=1) == {"20180608_10:00": {'1019', '1020'}}
+    assert list(store.query(qids=['Q14911734'])['external_id']) == ['1019']
+
+    counts = store.level_counts("GeneBot")
+    assert counts.loc["20180608_10:00"].tolist() == [2, 0, 2, 0.5]
+    assert counts.loc["20180601_10:00", 'ERROR'] == 1
@@ -1,12 +1,16 @@
 from wikidataintegrator import wdi_core, wdi_login, wdi_helpers
 import os
-import pprint
 import myvariant
 import datetime
 import copy
+from tqdm import tqdm
+
+from scheduled_bots.myvariant.dbsnp import DbSNPCache, current_query, current_from_bindings, plan_updates
 
 mv = myvariant.MyVariantInfo()
 
+# rsids and builds of the ClinVar variants, kept across runs
+CACHE_PATH = "clinvar_dbsnp.json"
 
 try:
     from scheduled_bots.local import WDUSER, WDPASS
@@ -33,27 +37,25 @@ def create_reference(dbsnp_id):
     return [refStatedIn, refRetrieved, refDbSNP]
 
 
-query = """
-SELECT * WHERE {
-   ?qid wdt:P1929 ?clinvar_variantID .
-}
-"""
-results = wdi_core.WDItemEngine.execute_sparql_query(query=query)
+# the dbSNP IDs in wikidata, and the ones from myvariant for all ClinVar IDs, in batches
+current = current_from_bindings(wdi_core.WDItemEngine.execute_sparql_query(query=current_query)["results"]["bindings"])
+dbsnp_version = mv.metadata().get('src', {}).get('dbsnp', {}).get('version')
+cache = DbSNPCache(CACHE_PATH, version=dbsnp_version)
+variants = cache.fetch(set.union(set(), *(item['clinvar'] for item in current.values())), mv)
+cache.save()
 
-for result in results["results"]["bindings"]:
+# only the items whose rsid or build changed
+for qid, clinvar_id, rsid, build in tqdm(plan_updates(current, variants)):
     data=[]
-    print(result["clinvar_variantID"]["value"])
-    mv_results = mv.query("clinvar.variant_id:"+str(result["clinvar_variantID"]["value"]), fields="dbsnp")
-    pprint.pprint(mv_results)
-    print(mv_results["hits"][0]["dbsnp"]["rsid"])
-    print(mv_results["hits"][0]["dbsnp"]["dbsnp_build"])
-    edition_qualifier = wdi_core.WDString(value=str(mv_results["hits"][0]["dbsnp"]["dbsnp_build"]), prop_nr="P393", is_qualifier=True)
-    data.append(wdi_core.WDString(mv_results["hits"][0]["dbsnp"]["rsid"],prop_nr="P6861",qualifiers=[edition_qualifier]))
-    #dbsnp_reference = create_reference(mv_results["hits"][0]["dbsnp"]["rsid"])
+    # the build is only stated when myvariant has it
+    qualifiers = [wdi_core.WDString(value=build, prop_nr="P393", is_qualifier=True)] if build else []
+    data.append(wdi_core.WDString(rsid,prop_nr="P6861",qualifiers=qualifiers))
+    #dbsnp_reference = create_reference(rsid)
     #for reference in mv_results["hits"][0]["dbsnp"]["citations"]:
     #    pmid_qid, _, _ = wdi_helpers.PublicationHelper(reference, id_type="pmid",
     #                                                   source="europepmc").get_or_create(login if True else None)
     #    if pmid_qid:
     #        data.append(wdi_core.WDItemID(value=pmid_qid, prop_nr="P1343", references=[copy.deepcopy(dbsnp_reference)]))
-    page = wdi_core.WDItemEngine(wd_item_id=result["qid"]["value"].replace("http://www.wikidata.org/entity/", ""),data=data)
-    print(page.write(login=login))
\ No newline at end of file
+    page = wdi_core.WDItemEngine(wd_item_id=qid, data=data)
+    wdi_helpers.try_write(page, record_id=clinvar_id, record_prop="P1929", edit_summary="Update dbSNP ID",
+                          login=login)
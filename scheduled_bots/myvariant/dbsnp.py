@@ -0,0 +1,102 @@
+"""
+dbSNP rsids and builds of ClinVar variants from myvariant.info, fetched in batches and cached on disk by ClinVar ID,
+and the P6861 (dbSNP ID) statements in wikidata that differ from them
+
+cache = DbSNPCache("dbsnp.json", version=dbsnp_version)
+variants = cache.fetch(clinvar_ids, myvariant.MyVariantInfo())
+cache.save()
+"""
+import json
+import os
+
+from scheduled_bots.utils import grouper
+
+# the ClinVar ID of each item, and its dbSNP IDs with their build
+current_query = """
+SELECT ?item ?clinvar ?rsid ?build WHERE {
+  ?item wdt:P1929 ?clinvar .
+  OPTIONAL { ?item p:P6861 ?statement . ?statement ps:P6861 ?rsid . OPTIONAL { ?statement pq:P393 ?build } }
+}"""
+
+
+class DbSNPCache:
+    """
+    ClinVar ID -> {'rsid', 'dbsnp_build'}, or None if myvariant has no dbSNP record for it. The cache is dropped when
+    it was made from another `version` of dbSNP
+    """
+
+    def __init__(self, cache_path=None, version=None):
+        self.variants = dict()
+        self.version = version
+        self.cache_path = None
+        if cache_path:
+            self.load(cache_path)
+
+    def load(self, cache_path):
+        self.cache_path = cache_path
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                d = json.load(f)
+            if d.get('version') == self.version:
+                self.variants.update(d['variants'])
+
+    def save(self):
+        if self.cache_path:
+            with open(self.cache_path, 'w') as f:
+                json.dump({'version': self.version, 'variants': self.variants}, f)
+
+    def fetch(self, clinvar_ids, mv, chunk_size=1000):
+        """
+        Get the variants that aren't cached yet, `chunk_size` per querymany call
+        :param mv: myvariant.MyVariantInfo
+        :return: ClinVar ID -> {'rsid', 'dbsnp_build'} or None. 'dbsnp_build' is None when myvariant doesn't have it
+        """
+        clinvar_ids = [str(x) for x in clinvar_ids]
+        missing = sorted(set(clinvar_ids) - set(self.variants))
+        for chunk in grouper(chunk_size, missing):
+            hits = mv.querymany(list(chunk), scopes='clinvar.variant_id', fields='dbsnp.rsid,dbsnp.dbsnp_build',
+                                verbose=False)
+            found = dict()
+            for hit in hits:
+                dbsnp = hit.get('dbsnp')
+                if hit.get('notfound') or not isinstance(dbsnp, dict) or 'rsid' not in dbsnp:
+                    continue
+                # the first hit, as with a query per variant
+                build = dbsnp.get('dbsnp_build')
+                found.setdefault(str(hit['query']),
+                                 {'rsid': dbsnp['rsid'], 'dbsnp_build': str(build) if build is not None else None})
+            for clinvar_id in chunk:
+                self.variants[clinvar_id] = found.get(clinvar_id)
+        return {clinvar_id: self.variants[clinvar_id] for clinvar_id in clinvar_ids}
+
+
+def current_from_bindings(bindings):
+    # qid -> {'clinvar': set of ClinVar IDs, 'dbsnp': set of (rsid, build or None)}
+    current = dict()
+    for b in bindings:
+        qid = b['item']['value'].replace("http://www.wikidata.org/entity/", "")
+        item = current.setdefault(qid, {'clinvar': set(), 'dbsnp': set()})
+        item['clinvar'].add(b['clinvar']['value'])
+        if 'rsid' in b:
+            item['dbsnp'].add((b['rsid']['value'], b['build']['value'] if 'build' in b else None))
+    return current
+
+
+def plan_updates(current, variants):
+    """
+    The items whose dbSNP ID or build isn't the one from myvariant
+    :param current: from `current_from_bindings`
+    :param variants: ClinVar ID -> {'rsid', 'dbsnp_build'} or None
+    :return: list of (qid, clinvar ID, rsid, build)
+    """
+    updates = []
+    for qid, item in sorted(current.items()):
+        targets = {(clinvar_id, variants[clinvar_id]['rsid'], variants[clinvar_id]['dbsnp_build'])
+                   for clinvar_id in item['clinvar'] if variants.get(clinvar_id)}
+        if len({target[1:] for target in targets}) != 1:
+            # no dbSNP record, or ClinVar IDs on the item that don't agree
+            continue
+        clinvar_id, rsid, build = sorted(targets)[0]
+        if item['dbsnp'] != {(rsid, build)}:
+            updates.append((qid, clinvar_id, rsid, build))
+    return updates
@@ -0,0 +1,50 @@
+import os
+import tempfile
+from unittest import mock
+
+from scheduled_bots.myvariant.dbsnp import DbSNPCache, current_from_bindings, plan_updates
+
+
+def querymany(ids, **kwargs):
+    dbsnp = {'12345': {'rsid': 'rs1', 'dbsnp_build': 151}, '23456': {'rsid': 'rs2', 'dbsnp_build': 155},
+             '34567': {'rsid': 'rs3'}}
+    return [{'query': x, 'dbsnp': dbsnp[x]} if x in dbsnp else {'query': x, 'notfound': True} for x in ids]
+
+
+def binding(qid, clinvar, rsid=None, build=None):
+    b = {'item': {'value': "http://www.wikidata.org/entity/" + qid}, 'clinvar': {'value': clinvar}}
+    if rsid:
+        b['rsid'] = {'value': rsid}
+    if build:
+        b['build'] = {'value': build}
+    return b
+
+
+def test_fetch_cached():
+    cache_path = os.path.join(tempfile.mkdtemp(), "dbsnp.json")
+    mv = mock.Mock(querymany=mock.Mock(side_effect=querymany))
+    cache = DbSNPCache(cache_path, version="155")
+    assert cache.fetch(['12345', '34567', '99999'], mv, chunk_size=1) == {
+        '12345': {'rsid': 'rs1', 'dbsnp_build': '151'}, '34567': {'rsid': 'rs3', 'dbsnp_build': None}, '99999': None}
+    assert mv.querymany.call_count == 3
+    cache.save()
+
+    mv.querymany.reset_mock()
+    cache = DbSNPCache(cache_path, version="155")
+    cache.fetch(['12345', '99999', '23456'], mv)
+    # only the new one
+    assert mv.querymany.call_args[0][0] == ['23456']
+    # a new dbSNP version fetches everything again
+    cache = DbSNPCache(cache_path, version="156")
+    assert cache.variants == {}
+
+
+def test_plan_updates():
+    current = current_from_bindings([binding('Q1', '12345', 'rs1', '151'), binding('Q2', '23456', 'rs2', '151'),
+                                     binding('Q3', '23456'), binding('Q4', '99999'), binding('Q5', '34567', 'rs3'),
+                                     binding('Q6', '34567', 'rs4')])
+    variants = {'12345': {'rsid': 'rs1', 'dbsnp_build': '151'}, '23456': {'rsid': 'rs2', 'dbsnp_build': '155'},
+                '34567': {'rsid': 'rs3', 'dbsnp_build': None}, '99999': None}
+    # an unknown build matches a statement without one
+    assert plan_updates(current, variants) == [('Q2', '23456', 'rs2', '155'), ('Q3', '23456', 'rs2', '155'),
+                                               ('Q6', '34567', 'rs3', None)]
@@ -6,11 +6,12 @@ Requires a obographs JSON file made from an owl file
 import json
 import multiprocessing
 import os
+import re
 import subprocess
 import traceback
 from collections import defaultdict
 from datetime import datetime
-from functools import partial
+from functools import partial, lru_cache
 from itertools import chain
 from time import strftime, gmtime
 
@@ -27,17 +28,58 @@ from wikidataintegrator.wdi_helpers import WikibaseHelper
 cu = CurieUtil()
 
 
+@lru_cache(maxsize=None)
+def uri_to_curie(uri):
+    # memoized cu.uri_to_curie. Returns None if the uri can't be converted
+    try:
+        return cu.uri_to_curie(uri)
+    except AssertionError:
+        return None
+
+
+@lru_cache(maxsize=None)
+def parse_curie(curie):
+    # memoized cu.parse_curie. Returns a tuple of (pid, ext_id)
+    return cu.parse_curie(curie)
+
+
+def prefix_regex(prefixes):
+    """
+    Compile a case-insensitive regex matching strings that start with any of `prefixes`
+    Use `prefix_regex(prefixes).match(s)` instead of `any(s.lower().startswith(p.lower()) for p in prefixes)`
+    """
+    # longest first, so a prefix that is the start of another prefix doesn't shadow it
+    prefixes = sorted(prefixes, key=len, reverse=True)
+    return re.compile("|".join(re.escape(prefix) for prefix in prefixes), re.IGNORECASE)
+
+
+class UriCurieConverter:
+    """
+    Converts URIs to CURIEs given a map of URI prefixes to CURIE prefixes, for URIs not handled by `cu`
+    e.g. {"http://linkedlifedata.com/resource/umls/id/": "UMLS:"}
+    Conversions are cached, so the same instance should be shared (e.g. as a Node class attribute)
+    """
+
+    def __init__(self, uri_curie_map):
+        self.uri_curie_map = dict(uri_curie_map)
+        self.regex = re.compile("|".join(re.escape(uri) for uri in self.uri_curie_map))
+        self.convert = lru_cache(maxsize=None)(self._convert)
+
+    def _convert(self, uri):
+        # returns None if no URI prefix is found in the uri
+        m = self.regex.search(uri)
+        if m:
+            return uri.replace(m.group(), self.uri_curie_map[m.group()])
+
+
 class Node:
     def __init__(self, json_node, graph):
         self.json_node = json_node
         self.id_uri = json_node['id']  # e.g. http://purl.obolibrary.org/obo/DOID_8718
-        try:
-            self.id_curie = cu.uri_to_curie(self.id_uri)
-        except AssertionError:
-            self.id_curie = None
+        self.id_curie = uri_to_curie(self.id_uri)
         try:
             # the wikidata property id for this node's id, and the value to be used in wikidata
-            self.id_pid, self.id_value = cu.parse_curie(self.id_curie)
+            self.id_pid, self.id_value = parse_curie(self.id_curie)
             self.id_pid = graph.helper.get_pid(self.id_pid)
         except Exception:
             self.id_pid = None
@@ -52,7 +94,7 @@ class Node:
         self.pids = set()  # set of pids this node used
 
         self.qid = None
-        # self.xrefs = set()
+        self.xrefs = set()
         self.item = None
         self.bpv = defaultdict(set)
 
@@ -68,8 +110,8 @@ class Node:
         if 'basicPropertyValues' in meta:
             for basicPropertyValue in meta['basicPropertyValues']:
                 self.bpv[basicPropertyValue['pred']].add(basicPropertyValue['val'])
-        #if 'xrefs' in meta:
-        #    self.xrefs = set([x['val'] for x in meta['xrefs']])
+        if 'xrefs' in meta:
+            self.xrefs = set(x['val'] for x in meta['xrefs'])
         self.descr = meta.get('definition', dict()).get('val')
         self.deprecated = meta.get('deprecated', False)
         self.synonyms = set(x['val'] for x in meta.get('synonyms', list()))
@@ -137,7 +179,7 @@ class Node:
                                        "curie prefix not found: {}".format(xref.split(":")[0]))
             wdi_core.WDItemEngine.log("WARNING", m)
             return None
-        pid, ext_id = cu.parse_curie(xref)
+        pid, ext_id = parse_curie(xref)
         pid = self.helper.get_pid(pid)
         self.pids.add(pid)
         return wdi_core.WDExternalID(ext_id, pid, references=[ref])
@@ -154,7 +196,7 @@ class Node:
         assert self.id_curie
         s = self.create_statements()
 
-        primary_ext_id_pid, primary_ext_id = cu.parse_curie(self.id_curie)
+        primary_ext_id_pid, primary_ext_id = parse_curie(self.id_curie)
         primary_ext_id_pid = self.helper.get_pid(primary_ext_id_pid)
         assert primary_ext_id_pid in self.graph.APPEND_PROPS
 
@@ -216,7 +258,7 @@ class Node:
         qid = self.qid
         if qid is None:
             return None
-        primary_ext_id_pid, primary_ext_id = cu.parse_curie(self.id_curie)
+        primary_ext_id_pid, primary_ext_id = parse_curie(self.id_curie)
         primary_ext_id_pid = self.helper.get_pid(primary_ext_id_pid)
 
         if frc is None:
@@ -523,7 +565,7 @@ class Graph:
                 mediawiki_api_url=self.mediawiki_api_url,
                 core_props=self.CORE_IDS
             )
-            this_pid, this_value = cu.parse_curie(cu.uri_to_curie(this_uri))
+            this_pid, this_value = parse_curie(uri_to_curie(this_uri))
             this_pid = self.helper.get_pid(this_pid)
             wdi_helpers.try_write(item, record_id=this_value, record_prop=this_pid,
                                   login=login, write=write)
@@ -556,7 +598,7 @@ class Graph:
 
         # if not, check if the prefix exists in wikidata
         try:
-            obj_pid, obj_value = cu.parse_curie(cu.uri_to_curie(edge_obj))
+            obj_pid, obj_value = parse_curie(uri_to_curie(edge_obj))
         except Exception as e:
             m = wdi_helpers.format_msg(None, None, None, "edge object not found: {}".format(edge_obj))
             print(m)
@@ -593,7 +635,7 @@ class Graph:
         dep_uri = [x.id_uri for x in self.deprecated_nodes]
         for uri in dep_uri:
             try:
-                pid, value = cu.parse_curie(cu.uri_to_curie(uri))
+                pid, value = parse_curie(uri_to_curie(uri))
             except Exception:
                 continue
             pid = self.helper.get_pid(pid)
@@ -5,16 +5,32 @@ mondo-minimal.owl is missing
 """
 
 import argparse
+import json
 import os
+import timeit
+from functools import lru_cache
 
 from scheduled_bots import utils
-from scheduled_bots.ontology.obographs import Graph, Node
+from scheduled_bots.ontology.obographs import Graph, Node, UriCurieConverter, prefix_regex
 from wikidataintegrator import wdi_login, wdi_helpers, wdi_core
 from scheduled_bots import PROPS
 
 
 class MondoNode(Node):
     mrh = None
+    # set of mapping relation type URIs, from mrh.ABV_MRT
+    mrts = None
+
+    # need a way to get from "http://linkedlifedata.com/resource/umls/id/C0265218" to UMLS:C0265218, for example
+    # ignoring meddra and snomed
+    uri_converter = UriCurieConverter({
+        "http://identifiers.org/omim/": "OMIM:",
+        "http://identifiers.org/mesh/": "MESH:",
+        "http://linkedlifedata.com/resource/umls/id/": "UMLS:",
+        "http://www.orpha.net/ORDO/Orphanet_": "Orphanet:",
+        "http://purl.obolibrary.org/obo/DOID_": "DOID:",
+        "http://purl.obolibrary.org/obo/NCIT_": "NCIT:"
+    })
 
     def set_aliases(self, wd_item):
         # filter out aliases containing these strings
@@ -23,12 +39,17 @@ class MondoNode(Node):
             aliases = [x for x in self.synonyms if all(y not in x for y in bad_things)]
             wd_item.set_aliases(aliases=aliases, append=True)
 
-    def _pre_create(self):
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def normalize_xref(xref):
         # remove leading zeros from GARD
-        self.xrefs = set("GARD:" + str(int(xref.replace("GARD:", ""))) if xref.startswith("GARD:") else xref for xref in self.xrefs)
-
+        if xref.startswith("GARD:"):
+            return "GARD:" + str(int(xref.replace("GARD:", "")))
         # change ICD10 to ICD10CM
-        self.xrefs = set([x.replace("ICD10:", "ICD10CM:").replace("ICD9:", "ICD9CM:") for x in self.xrefs])
+        return xref.replace("ICD10:", "ICD10CM:").replace("ICD9:", "ICD9CM:")
+
+    def _pre_create(self):
+        self.xrefs = set(map(self.normalize_xref, self.xrefs))
 
     def create_xref_statements(self):
         """
@@ -37,29 +58,13 @@ class MondoNode(Node):
 
         if not MondoNode.mrh:
             MondoNode.mrh = wdi_helpers.MappingRelationHelper(sparql_endpoint_url=self.graph.sparql_endpoint_url)
-
-        # need a way to get from "http://linkedlifedata.com/resource/umls/id/C0265218" to UMLS:C0265218, for example
-        # ignoring meddra and snomed
-        uri_to_curie_map = {
-            "http://identifiers.org/omim/": "OMIM:",
-            "http://identifiers.org/mesh/": "MESH:",
-            "http://linkedlifedata.com/resource/umls/id/": "UMLS:",
-            "http://www.orpha.net/ORDO/Orphanet_": "Orphanet:",
-            "http://purl.obolibrary.org/obo/DOID_": "DOID:",
-            "http://purl.obolibrary.org/obo/NCIT_": "NCIT:"
-        }
-
-        def uri_to_curie(uri):
-            for k, v in uri_to_curie_map.items():
-                if k in uri:
-                    uri = uri.replace(k, v)
-                    return uri
+            MondoNode.mrts = set(MondoNode.mrh.ABV_MRT.values())
 
         ss = []
         for mrt, xrefs in self.bpv.items():
-            if mrt in self.mrh.ABV_MRT.values():
+            if mrt in self.mrts:
                 for xref in xrefs:
-                    xref_curie = uri_to_curie(xref)
+                    xref_curie = self.uri_converter.convert(xref)
                     if not xref_curie:
                         continue
                     self.xrefs.discard(xref_curie)
@@ -132,27 +137,65 @@ class MondoGraph(Graph):
 
     NODE_CLASS = MondoNode
 
+    # only take xrefs starting with these (case-insensitive)
+    XREF_PREFIXES = prefix_regex({'UMLS', 'Orphanet:', 'DOID:', 'OMIM:', 'MESH:', 'NCIT:', 'ICD10', 'ICD9', 'GARD:',
+                                  'HP:'})
+
     def filter_nodes(self):
         super(MondoGraph, self).filter_nodes()
         # self.nodes = self.nodes[:20]
         # self.nodes = [x for x in self.nodes if x.id_curie == "MONDO:0005393"]
         print("starting with {} nodes".format(len(self.nodes)))
+        match = self.XREF_PREFIXES.match
         for node in self.nodes:
-            # only take these xrefs
-            prefixes = {'UMLS', 'Orphanet:', 'DOID:', 'OMIM:', 'MESH:', 'NCIT:', 'ICD10', 'ICD9', 'GARD:', 'HP:'}
-            node.xrefs = set(x for x in node.xrefs if any(x.lower().startswith(prefix.lower()) for prefix in prefixes))
+            node.xrefs = set(x for x in node.xrefs if match(x))
             if len(node.xrefs) == 0:
                 node.id_uri = None
         self.nodes = [x for x in self.nodes if x.id_uri]
         print("after filtering branch {} nodes".format(len(self.nodes)))
 
 
+def benchmark_xrefs(json_path, number=3):
+    """
+    Time the xref filtering, normalization and URI -> CURIE conversion done by the MONDO bot on all nodes of the
+    MONDO obographs json file. Doesn't need a wikibase
+    """
+    with open(json_path) as f:
+        d = json.load(f)
+    graph = {g['id']: g for g in d['graphs']}[MondoGraph.GRAPH_URI]
+    metas = [node.get('meta', dict()) for node in graph['nodes']]
+    node_xrefs = [set(x['val'] for x in meta.get('xrefs', [])) for meta in metas]
+    node_bpv_uris = [[x['val'] for x in meta.get('basicPropertyValues', [])] for meta in metas]
+    print("{} nodes, {} xrefs, {} property values".format(len(metas), sum(map(len, node_xrefs)),
+                                                           sum(map(len, node_bpv_uris))))
+
+    match = MondoGraph.XREF_PREFIXES.match
+
+    def filter_normalize():
+        for xrefs in node_xrefs:
+            set(map(MondoNode.normalize_xref, (x for x in xrefs if match(x))))
+
+    def convert():
+        for uris in node_bpv_uris:
+            for uri in uris:
+                MondoNode.uri_converter.convert(uri)
+
+    for name, f in [('filter and normalize xrefs', filter_normalize), ('convert uris to curies', convert)]:
+        t = timeit.timeit(f, number=number) / number
+        print("{}: {:.3f} s per pass".format(name, t))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='run wikidata monarch disease ontology bot')
     parser.add_argument("json_path", help="Path to json file")
     parser.add_argument("--local", help="preconfigured local wikibase port 7171 and 7272", action='store_true')
+    parser.add_argument("--benchmark", help="time the xref processing on the json file and exit", action='store_true')
     args = parser.parse_args()
 
+    if args.benchmark:
+        benchmark_xrefs(args.json_path)
+        exit(0)
+
     if args.local:
         mediawiki_api_url = "http://185.54.114.71:8181/w/api.php"
         sparql_endpoint_url = "http://185.54.114.71:8282/proxy/wdqs/bigdata/namespace/wdq/sparql"
@@ -1,6 +1,9 @@
+from functools import lru_cache
+
 from wikidataintegrator import wdi_helpers, wdi_core
 
 
+@lru_cache(maxsize=None)
 def get_interpro_releases():
     """
     returns {'58.0': 'Q27877335',
@@ -10,11 +13,9 @@ def get_interpro_releases():
      """
     return wdi_helpers.id_mapper("P393", (("P629", "Q3047275"),))
 
-INTERPRO_RELEASES = get_interpro_releases()
-
 
 def remove_deprecated_statements(item, release_wdid, props, login):
-    releases = set(INTERPRO_RELEASES.values()) | {'Q3047275'}
+    releases = set(get_interpro_releases().values()) | {'Q3047275'}
     releases = set(int(x.replace("Q", "")) for x in releases)
     # don't count this release
     releases.discard(int(release_wdid.replace("Q", "")))
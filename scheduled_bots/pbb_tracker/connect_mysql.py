@@ -2,10 +2,10 @@ import pymysql
 import paramiko
 import pandas as pd
 from sshtunnel import SSHTunnelForwarder
+from functools import lru_cache
 from os.path import expanduser
 
 home = expanduser('~')
-mypkey = paramiko.RSAKey.from_private_key_file(home + "/.ssh/id_rsa")
 
 sql_hostname = 'wikidatawiki.labsdb'
 sql_main_database = 'wikidatawiki_p'
@@ -17,12 +17,48 @@ ssh_port = 22
 sql_port = 3306
 
 
+@lru_cache(maxsize=None)
+def get_pkey():
+    return paramiko.RSAKey.from_private_key_file(home + "/.ssh/id_rsa")
+
+
+class WikidataMySQL:
+    """
+    One SSH tunnel and MySQL connection to the wikidata replica, opened on the first query and reused for every
+    query until closed. Use as a context manager
+    """
+
+    def __init__(self):
+        self.tunnel = None
+        self.conn = None
+
+    def connect(self):
+        self.tunnel = SSHTunnelForwarder((ssh_host, ssh_port), ssh_username=ssh_user, ssh_pkey=get_pkey(),
+                                         remote_bind_address=(sql_hostname, sql_port))
+        self.tunnel.start()
+        self.conn = pymysql.connect(host='127.0.0.1', user=sql_user, password=sql_pass, db=sql_main_database,
+                                    port=self.tunnel.local_bind_port)
+
+    def query(self, query):
+        if self.conn is None:
+            self.connect()
+        return pd.read_sql_query(query, self.conn)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.tunnel is not None:
+            self.tunnel.stop()
+            self.tunnel = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def query_wikidata_mysql(query):
-    with SSHTunnelForwarder((ssh_host, ssh_port), ssh_username=ssh_user, ssh_pkey=mypkey,
-                            remote_bind_address=(sql_hostname, sql_port)) as tunnel:
-        conn = pymysql.connect(host='127.0.0.1', user=sql_user, password=sql_pass, db=sql_main_database,
-                               port=tunnel.local_bind_port)
-
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-    return df
+    with WikidataMySQL() as db:
+        return db.query(query)
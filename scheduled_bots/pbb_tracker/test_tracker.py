@@ -0,0 +1,117 @@
+import datetime
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+import pandas as pd
+import pytest
+from nose.tools import assert_raises
+
+from scheduled_bots.pbb_tracker.tracker import Change, detect_changes, process_changes, process_revisions, \
+    download_revisions, get_revisions_past_weeks, load_checkpoint
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def claim(pid, value, references=None):
+    c = {'mainsnak': {'property': pid, 'datavalue': {'type': 'string', 'value': value}}}
+    if references is not None:
+        c['references'] = references
+    return c
+
+
+def revision(qid, revid, days_ago, claims, user="user"):
+    return {'_id': revid, 'id': qid, 'revid': revid, 'user': user, 'comment': '',
+            'timestamp': datetime.datetime.now() - datetime.timedelta(days=days_ago), 'claims': claims,
+            'labels': {}, 'descriptions': {}, 'aliases': {}}
+
+
+ref = [{'snaks': {'P248': []}}]
+
+# newest first, like the revisions stored by the tracker
+doid_revisions = [revision('Q1', 4, 1, {'P699': [claim('P699', 'DOID:2')]}),
+                  revision('Q1', 3, 2, {'P699': [claim('P699', 'DOID:1')]}),
+                  revision('Q1', 2, 3, {'P699': [claim('P699', 'DOID:1'), claim('P699', 'DOID:2', ref)]}),
+                  revision('Q1', 1, 4, {'P699': [claim('P699', 'DOID:1')]}),
+                  revision('Q1', 0, 5, [])]
+
+
+def test_detect_changes():
+    changes = {(c.revid, c.change_type, c.value): c for c in detect_changes(doid_revisions, 'Q1')}
+    assert sorted(changes) == [(1, 'ADD', 'DOID:1'), (2, 'ADD', 'DOID:2'), (3, 'REMOVE', 'DOID:2'),
+                               (4, 'ADD', 'DOID:2'), (4, 'REMOVE', 'DOID:1')]
+    # the added value keeps the references of its claim, a removed value within a prop doesn't have any
+    assert changes[(2, 'ADD', 'DOID:2')].reference == ref
+    assert changes[(3, 'REMOVE', 'DOID:2')].reference == []
+    assert changes[(4, 'ADD', 'DOID:2')].user == "user"
+
+
+def test_process_changes():
+    changes = detect_changes(doid_revisions, 'Q1')
+    changes = process_changes(changes)
+    # DOID:2 was added then removed, which cancels out. DOID:1 was removed, which cancels with its first add.
+    # DOID:2 being added back again isn't cancelled out
+    assert [(c.revid, c.change_type, c.value) for c in changes] == [(4, 'ADD', 'DOID:2')]
+
+
+def test_process_changes_other_items():
+    changes = [Change("REMOVE", qid='Q2', pid='P699', value='DOID:1', timestamp=2),
+               Change("ADD", qid='Q1', pid='P699', value='DOID:1', timestamp=1)]
+    assert process_changes(changes) == changes[::-1]
+
+
+def test_process_revisions():
+    coll = mongomock.MongoClient().wikidata.revisions
+    coll.insert_many(doid_revisions + [revision('Q2', 10, 1, {'P699': [claim('P699', 'DOID:3')]}),
+                                       revision('Q2', 9, 2, []),
+                                       revision('Q3', 8, 30, [])])
+    with mock.patch.object(coll, 'aggregate', wraps=coll.aggregate) as aggregate:
+        changes = process_revisions(coll, ['Q1', 'Q2', 'Q3'], weeks=1)
+    assert aggregate.call_count == 1
+    assert sorted((c.qid, c.revid, c.change_type, c.value) for c in changes) == [
+        ('Q1', 4, 'ADD', 'DOID:2'), ('Q2', 10, 'ADD', 'DOID:3')]
+
+
+def mwclient_revision(qid, revid, claims):
+    content = {'id': qid, 'type': 'item', 'claims': claims, 'sitelinks': {'enwiki': {'title': 'x'}},
+               'labels': {'en': {'language': 'en', 'value': 'x'}, 'de': {'language': 'de', 'value': 'x'}},
+               'descriptions': {}, 'aliases': {}}
+    return {'revid': revid, 'pagetitle': qid, 'user': 'user', 'comment': '', 'contentmodel': 'wikibase-item',
+            'timestamp': time.gmtime(1500000000 + revid), '*': json.dumps(content)}
+
+
+def test_download_revisions():
+    coll = mongomock.MongoClient().wikidata.revisions
+    revs = {revid: mwclient_revision('Q1', revid, {'P699': [claim('P699', 'DOID:1')]}) for revid in range(10)}
+    revs[9] = {k: v for k, v in revs[9].items() if k != '*'}
+
+    def fetch(site, revision_ids):
+        return [dict(revs[revid]) for revid in revision_ids]
+
+    with mock.patch('scheduled_bots.pbb_tracker.tracker.get_site'), \
+            mock.patch('scheduled_bots.pbb_tracker.tracker.fetch_revisions', side_effect=fetch):
+        download_revisions(coll, set(range(5)), 'P699', {'Q1': 'DOID:1'}, chunk_size=2)
+        # storing revisions again, like after an interrupted download, doesn't fail
+        download_revisions(coll, set(range(10)), 'P699', {'Q1': 'DOID:1'}, chunk_size=2)
+    assert sorted(coll.distinct('_id')) == list(range(9))
+    doc = coll.find_one({'_id': 3})
+    assert doc['metadata'] == {'P699': 'DOID:1'}
+    assert isinstance(doc['timestamp'], datetime.datetime)
+    assert 'sitelinks' not in doc and list(doc['labels']) == ['en']
+
+
+def test_get_revisions_past_weeks_resume():
+    db = mock.Mock()
+    db.query.side_effect = [pd.DataFrame({'rev_id': [1, 2]}), ConnectionError(),
+                            pd.DataFrame({'rev_id': [3]}), pd.DataFrame({'rev_id': []})]
+    checkpoint_path = os.path.join(tempfile.mkdtemp(), "checkpoint.json")
+    with assert_raises(ConnectionError):
+        get_revisions_past_weeks(['Q1'], 3, db, checkpoint_path=checkpoint_path)
+    end = load_checkpoint(checkpoint_path)['end']
+    assert get_revisions_past_weeks(['Q1'], 3, db, checkpoint_path=checkpoint_path) == {1, 2, 3}
+    # the first week isn't queried again, and the weeks count back from when the backfill started
+    assert db.query.call_count == 4
+    assert end in db.query.call_args_list[0][0][0]
+    assert load_checkpoint(checkpoint_path)['end'] == end
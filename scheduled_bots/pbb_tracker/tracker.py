@@ -3,18 +3,21 @@ import os
 import click
 import time
 import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from time import mktime
-from itertools import chain, islice
+from itertools import chain, islice, groupby
 import json
 import copy
 import pandas as pd
 from cachetools import cached, TTLCache
-from pymongo.errors import DuplicateKeyError
 from tqdm import tqdm
 from mwclient import Site
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 
-from scheduled_bots.pbb_tracker.connect_mysql import query_wikidata_mysql
+from scheduled_bots.pbb_tracker.connect_mysql import WikidataMySQL
 from wikidataintegrator.wdi_helpers import id_mapper
 from wikidataintegrator.wdi_core import WDItemEngine
 
@@ -25,13 +28,19 @@ except ImportError:
         WDUSER = os.environ['WDUSER']
         WDPASS = os.environ['WDPASS']
     else:
-        raise ValueError("WDUSER and WDPASS must be specified in local.py or as environment variables")
+        WDUSER = WDPASS = None
 
 CACHE_SIZE = 99999
 CACHE_TIMEOUT_SEC = 300  # 5 min
 
-site = Site(('https', 'www.wikidata.org'))
-site.login(WDUSER, WDPASS)
+
+@lru_cache(maxsize=None)
+def get_site():
+    if WDUSER is None:
+        raise ValueError("WDUSER and WDPASS must be specified in local.py or as environment variables")
+    site = Site(('https', 'www.wikidata.org'))
+    site.login(WDUSER, WDPASS)
+    return site
 
 
 def chunks(iterable, size):
@@ -46,7 +55,7 @@ def chunks(iterable, size):
 def getConceptLabels(qids):
     qids = "|".join({qid.replace("wd:", "") if qid.startswith("wd:") else qid for qid in qids})
     try:
-        wd = site.api('wbgetentities', **{'ids': qids, 'languages': 'en', 'format': 'json', 'props': 'labels'})[
+        wd = get_site().api('wbgetentities', **{'ids': qids, 'languages': 'en', 'format': 'json', 'props': 'labels'})[
             'entities']
         return {k: v['labels']['en']['value'] if 'labels' in v and 'en' in v['labels'] else '' for k, v in wd.items()}
     except Exception as e:
@@ -54,6 +63,7 @@ def getConceptLabels(qids):
         return {k: "" for k in qids}
 
 
+@lru_cache(maxsize=None)
 def get_property_types():
     # {'CommonsMedia', 'Time', 'Quantity', 'WikibaseProperty', 'WikibaseItem', 'GlobeCoordinate',
     # 'String', 'ExternalId', 'Math', 'Monolingualtext', 'TabularData', 'Url', 'GeoShape'}
@@ -64,9 +74,6 @@ def get_property_types():
     return prop_wdtype
 
 
-PROP_TYPE = get_property_types()
-
-
 class Change:
     def __init__(self, change_type, qid='', pid='', value='', value_label='', user='',
                  timestamp='', reference=list(), revid=None, comment=''):
@@ -107,6 +114,7 @@ class Change:
 
     @staticmethod
     def lookupLabels(changes):
+        PROP_TYPE = get_property_types()
         pids = set(s.pid for s in changes)
         qids = set(s.qid for s in changes)
         values = set(s.value for s in changes if s.value and PROP_TYPE.get(s.pid) == "WikibaseItem")
@@ -179,74 +187,89 @@ def get_claim_value(claim):
     return 'none'
 
 
-def detect_claim_change(claimsx, claimsy):
+def flatten_claims(claims):
+    """
+    Reduce the claims of a revision to the values and references of each claim, computing each value once
+    :return: {pid: [(value, references), ...]}, one tuple per claim, in order
+    """
+    if len(claims) == 0:
+        return dict()
+    return {pid: [(get_claim_value(claim['mainsnak']), claim.get('references', [])) for claim in prop_claims]
+            for pid, prop_claims in claims.items()}
+
+
+def detect_flat_claim_change(flatx, flaty):
+    # changes going from revision x to y, both flattened with `flatten_claims`
     s = []
-    if len(claimsx) == 0:
-        claimsx = dict()
-    if len(claimsy) == 0:
-        claimsy = dict()
     # props in x but not in y
-    props_missing_y = set(claimsx.keys()) - set(claimsy.keys())
-    for prop in props_missing_y:
-        for claim in claimsx[prop]:
-            s.append(Change("REMOVE", pid=prop, value=get_claim_value(claim['mainsnak']),
-                            reference=claim.get('references', [])))
+    for prop in flatx.keys() - flaty.keys():
+        for value, reference in flatx[prop]:
+            s.append(Change("REMOVE", pid=prop, value=value, reference=reference))
 
     # props in y but not in x
-    props_missing_x = set(claimsy.keys()) - set(claimsx.keys())
-    for prop in props_missing_x:
-        for claim in claimsy[prop]:
-            s.append(Change("ADD", pid=prop, value=get_claim_value(claim['mainsnak']),
-                            reference=claim.get('references', [])))
+    for prop in flaty.keys() - flatx.keys():
+        for value, reference in flaty[prop]:
+            s.append(Change("ADD", pid=prop, value=value, reference=reference))
 
     # for props in both, get the values
-    props_in_both = set(claimsx.keys()) & set(claimsy.keys())
-    for prop in props_in_both:
-        values_x = set(get_claim_value(claim['mainsnak']) for claim in claimsx[prop])
-        values_y = set(get_claim_value(claim['mainsnak']) for claim in claimsy[prop])
+    for prop in flatx.keys() & flaty.keys():
+        if flatx[prop] == flaty[prop]:
+            continue
+        values_x = set(value for value, _ in flatx[prop])
+        # references of the first claim with each value
+        refs_y = dict()
+        for value, reference in flaty[prop]:
+            refs_y.setdefault(value, reference)
         # values in x but not in y
-        missing_y = values_x - values_y
-        # values in y but not in x
-        missing_x = values_y - values_x
-        for m in missing_y:
+        for m in values_x - refs_y.keys():
             s.append(Change("REMOVE", pid=prop, value=m))
-        for m in missing_x:
-            ref = [x.get('references', []) for x in claimsy[prop] if m == get_claim_value(x['mainsnak'])][0]
-            s.append(Change("ADD", pid=prop, value=m, reference=ref))
+        # values in y but not in x
+        for m in refs_y.keys() - values_x:
+            s.append(Change("ADD", pid=prop, value=m, reference=refs_y[m]))
     return s
 
 
+def detect_claim_change(claimsx, claimsy):
+    return detect_flat_claim_change(flatten_claims(claimsx), flatten_claims(claimsy))
+
+
 def detect_changes(revisions, qid):
+    # revisions are newest first. flatten each one once, and diff each with the one before it
+    flat = [flatten_claims(revision['claims']) for revision in revisions]
+    metadata = revisions[0]['metadata'] if revisions and 'metadata' in revisions[0] else dict()
     c = []
     for idx in range(len(revisions) - 1):
-        y = revisions[idx]
-        x = revisions[idx + 1]
-        claimsx = x['claims']
-        claimsy = y['claims']
-        changes = detect_claim_change(claimsx, claimsy)
-        changes = [x for x in changes if x]
+        changes = detect_flat_claim_change(flat[idx + 1], flat[idx])
         for change in changes:
             change.qid = qid
             change.user = revisions[idx]['user']
             change.timestamp = revisions[idx]['timestamp']
-            change.metadata = revisions[0]['metadata'] if 'metadata' in revisions[0] else dict()
+            change.metadata = metadata
             change.revid = revisions[idx]['revid']
             change.comment = revisions[idx]['comment']
-        if changes:
-            c.append(changes)
-    return list(chain(*c))
+        c.extend(changes)
+    return c
 
 
 def process_changes(changes):
     # if a user adds a value to a prop, and then another user removes it, cancel out both revisions
     # example: https://www.wikidata.org/w/index.php?title=Q27869338&action=history
+    # the earliest ADD of a (qid, pid, value) cancels out with all of the REMOVEs of it
     changes = sorted(changes, key=lambda x: x.timestamp)
+    first_add = dict()
+    removes = defaultdict(list)
     for c in changes:
-        for other in changes:
-            if (c != other) and (c.qid == other.qid) and (c.pid == other.pid) and (c.value == other.value):
-                if c.change_type == "ADD" and other.change_type == "REMOVE":
-                    changes = [x for x in changes if x not in {c, other}]
-    return changes
+        key = (c.qid, c.pid, c.value)
+        if c.change_type == "ADD":
+            first_add.setdefault(key, c)
+        elif c.change_type == "REMOVE":
+            removes[key].append(c)
+    cancelled = set()
+    for key, c in first_add.items():
+        if key in removes:
+            cancelled.add(id(c))
+            cancelled.update(id(other) for other in removes[key])
+    return [c for c in changes if id(c) not in cancelled]
 
 
 def process_ld_changes(changes):
@@ -267,51 +290,100 @@ def process_alias_changes(changes):
         return []
 
 
-def store_revision(coll, rev, metadata):
+def make_revision_doc(rev, metadata):
+    """
+    Make the document stored for a revision from mwclient's revision dict. Only the english labels, descriptions and
+    aliases are kept, and sitelinks are dropped, as those are all that get compared
+    :return: dict, or None if the revision was deleted
+    """
     if '*' not in rev:
         # this revision was deleted
         return None
     d = json.loads(rev['*'])
-    del rev['*']
+    rev = {k: v for k, v in rev.items() if k != '*'}
     d.update(rev)
+    d.pop('sitelinks', None)
+    for key in ('labels', 'descriptions', 'aliases'):
+        d[key] = {'en': d[key]['en']} if d.get(key) and 'en' in d[key] else dict()
     d['_id'] = d['revid']
     d['metadata'] = metadata if metadata else dict()
     if isinstance(d['timestamp'], time.struct_time):
         d['timestamp'] = datetime.datetime.fromtimestamp(mktime(d['timestamp']))
-    elif not isinstance(d['timestamp'], str):
-        d['timestamp'] = time.strftime(d['timestamp'], '%Y-%m-%dT%H:%M:%SZ')
+    elif isinstance(d['timestamp'], str):
+        d['timestamp'] = datetime.datetime.strptime(d['timestamp'], '%Y-%m-%dT%H:%M:%SZ')
+    return d
+
+
+def store_revisions(coll, docs):
+    # revisions don't change, so ones we already have are skipped and a batch can be stored again after a failure
+    if not docs:
+        return
     try:
-        coll.insert_one(d)
-    except DuplicateKeyError:
-        pass
+        coll.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+
 
+def week_windows(weeks, end):
+    # (start, end) of each of the `weeks` weeks before `end`, most recent first
+    return [(end - datetime.timedelta(weeks=week + 1), end - datetime.timedelta(weeks=week)) for week in range(weeks)]
 
-def get_revisions_past_weeks(qids, weeks):
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def get_revisions_past_weeks(qids, weeks, db, checkpoint_path=None):
     """
     Get the revision IDs for revisions on `qids` items in the past `weeks` weeks
     :param qids: set of qids
     :param weeks: int
+    :param db: WikidataMySQL, reused for each week's query
+    :param checkpoint_path: if given, the revisions for each week are saved here as they are retrieved, and
+        a run that failed continues from the weeks it had finished, counting back from the same end time
     :return:
     """
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is None:
+        checkpoint = {'end': datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'), 'weeks': dict()}
+    end = datetime.datetime.strptime(checkpoint['end'], '%Y%m%d%H%M%S')
+
     revisions = set()
     qids_str = '"' + '","'.join(qids) + '"'
-    for week in tqdm(range(weeks)):
+    for week, (week_start, week_end) in enumerate(tqdm(week_windows(weeks, end))):
+        if str(week) in checkpoint['weeks']:
+            revisions.update(checkpoint['weeks'][str(week)])
+            continue
         query = '''select rev_id, rev_page, rev_timestamp, page_id, page_namespace, page_title, page_touched FROM revision
                            inner join page on revision.rev_page = page.page_id WHERE
-                           rev_timestamp > DATE_FORMAT(DATE_SUB(DATE_SUB(NOW(),INTERVAL {week} WEEK), INTERVAL 1 WEEK),'%Y%m%d%H%i%s') AND
-                           rev_timestamp < DATE_FORMAT(DATE_SUB(NOW(), INTERVAL {week} WEEK),'%Y%m%d%H%i%s') AND
+                           rev_timestamp > '{start}' AND
+                           rev_timestamp < '{end}' AND
                            page_content_model = "wikibase-item" AND
                            page.page_title IN({qids});
-                    '''.format(qids=qids_str, week=week)
-        revision_df = query_wikidata_mysql(query)
+                    '''.format(qids=qids_str, start=week_start.strftime('%Y%m%d%H%M%S'),
+                               end=week_end.strftime('%Y%m%d%H%M%S'))
+        revision_df = db.query(query)
         print(len(revision_df))
-        print(revision_df.head(2))
-        print(revision_df.tail(2))
-        revisions.update(set(revision_df.rev_id))
+        week_revisions = set(int(x) for x in revision_df.rev_id)
+        revisions.update(week_revisions)
+        if checkpoint_path:
+            checkpoint['weeks'][str(week)] = sorted(week_revisions)
+            save_checkpoint(checkpoint_path, checkpoint)
     return revisions
 
 
-def get_merges(qids, weeks):
+def get_merges(qids, weeks, db):
     # input: a list of revision IDs
     # output: list of revision IDs that are tagged as a merge
     # comment example: /* wbcreateredirect:0||Q20948851|Q9410367 */
@@ -321,7 +393,7 @@ def get_merges(qids, weeks):
                   inner join redirect on page.page_id = redirect.rd_from WHERE
                   (page.page_title IN({qids}) OR
                   redirect.rd_title IN ({qids}));'''.format(qids=qids_str)
-    redirect_df = query_wikidata_mysql(query)
+    redirect_df = db.query(query)
     redirect_df.page_title = redirect_df.page_title.apply(bytes.decode)
     redirect_df.rd_title = redirect_df.rd_title.apply(bytes.decode)
     redirect_df.page_links_updated = redirect_df.page_links_updated.apply(
@@ -333,35 +405,59 @@ def get_merges(qids, weeks):
 
     return redirect_df2
 
-def get_revision_ids_needed(coll, qids, weeks=1):
+def get_revision_ids_needed(coll, qids, db, weeks=1, checkpoint_path=None):
     # Get the revision IDs for revisions on `qids` items in the past `weeks` weeks
     # # excluding the ones we already have in `coll`
 
-    revisions = get_revisions_past_weeks(qids, weeks)
-    have_revisions = set([x['_id'] for x in coll.find({}, {'id': True})])
+    revisions = get_revisions_past_weeks(qids, weeks, db, checkpoint_path=checkpoint_path)
+    have_revisions = set(x['_id'] for x in coll.find({'_id': {'$in': list(revisions)}}, {'_id': True}))
     print(len(have_revisions))
     need_revisions = revisions - have_revisions
     print(len(need_revisions))
     return need_revisions
 
 
-def download_revisions(coll, revision_ids, pid, qid_extid_map):
-    for chunk in tqdm(chunks(revision_ids, 100), total=len(revision_ids) / 100):
-        revs = site.revisions(chunk, prop='ids|timestamp|flags|comment|user|content')
-        for rev in revs:
-            qid = rev['pagetitle']
-            if rev.get('contentmodel') != "wikibase-item":
-                continue
-            store_revision(coll, rev, {pid: qid_extid_map.get(qid, '')})
+def fetch_revisions(site, revision_ids):
+    return site.revisions(revision_ids, prop='ids|timestamp|flags|comment|user|content')
+
+
+def download_revisions(coll, revision_ids, pid, qid_extid_map, chunk_size=100, workers=4):
+    # batches are fetched concurrently, and each is stored as it comes in. as revisions that are already stored are
+    # skipped by `get_revision_ids_needed`, an interrupted download continues where it left off
+    # the site is logged into once here, not by each worker
+    revision_ids = sorted(revision_ids)
+    site = get_site()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batches = executor.map(partial(fetch_revisions, site), chunks(revision_ids, chunk_size))
+        for revs in tqdm(batches, total=math.ceil(len(revision_ids) / chunk_size)):
+            docs = []
+            for rev in revs:
+                qid = rev['pagetitle']
+                if rev.get('contentmodel') != "wikibase-item":
+                    continue
+                doc = make_revision_doc(rev, {pid: qid_extid_map.get(qid, '')})
+                if doc:
+                    docs.append(doc)
+            store_revisions(coll, docs)
+
+
+def iter_item_revisions(coll, qids, weeks):
+    """
+    Get the revisions in the past `weeks` weeks for all of `qids` with one query, sorted and grouped by the database
+    :return: generator of (qid, list of revisions, newest first)
+    """
+    last_updated = datetime.datetime.now() - datetime.timedelta(weeks=weeks)
+    pipeline = [{'$match': {'id': {'$in': list(qids)}, 'timestamp': {'$gt': last_updated}}},
+                {'$sort': {'id': 1, 'timestamp': -1}}]
+    cursor = coll.aggregate(pipeline, allowDiskUse=True)
+    for qid, revisions in groupby(cursor, key=lambda x: x['id']):
+        yield qid, list(revisions)
 
 
 def process_revisions(coll, qids, weeks):
     # process the changes for each qid
-    last_updated = datetime.datetime.now() - datetime.timedelta(weeks=weeks)
     changes = []
-    for qid in tqdm(list(qids)[:]):
-        revisions = sorted(coll.find({'id': qid}), key=lambda x: x['timestamp'], reverse=True)
-        revisions = [r for r in revisions if r['timestamp'] > last_updated]
+    for qid, revisions in tqdm(iter_item_revisions(coll, qids, weeks)):
         c = detect_changes(revisions, qid)
         c = process_changes(c)
         changes.extend(c)
@@ -371,13 +467,8 @@ def process_revisions(coll, qids, weeks):
 def process_lda_revisions(coll, qids, weeks):
     # we only care about what happened between the first and last revision
     # not capturing intermediate changes
-    last_updated = datetime.datetime.now() - datetime.timedelta(weeks=weeks)
     changes = []
-    for qid in tqdm(list(qids)[:]):
-        revisions = sorted(coll.find({'id': qid}), key=lambda x: x['timestamp'], reverse=True)
-        revisions = [r for r in revisions if r['timestamp'] > last_updated]
-        if not revisions:
-            continue
+    for qid, revisions in tqdm(iter_item_revisions(coll, qids, weeks)):
         x = revisions[0]
         y = revisions[-1]
 
@@ -413,7 +504,8 @@ def process_lda_revisions(coll, qids, weeks):
 @click.option('--weeks', default=2, help='number of weeks ago')
 @click.option('--force-update', is_flag=True, help='skip checking for existing revision')
 @click.option('--filter-user', default="ProteinBoxBot", help='filter out changes by this user')
-def main(pid, weeks, idfilter, force_update, filter_user):
+@click.option('--workers', default=4, help='number of revision batches to download at once')
+def main(pid, weeks, idfilter, force_update, filter_user, workers):
     """
     from tracker import *
     pid="P699"
@@ -421,17 +513,19 @@ def main(pid, weeks, idfilter, force_update, filter_user):
     weeks=52
     force_update=False
     filter_user="ProteinBoxBot"
+    workers=4
     """
     coll_name = pid + "_" + idfilter if idfilter else pid
     save_name = coll_name + "_" + str(datetime.date.today()) + "_{}weeks".format(weeks) + ".xls"
+    checkpoint_path = coll_name + "_checkpoint.json"
     writer = pd.ExcelWriter(save_name)
     coll = MongoClient().wikidata[coll_name]
-    coll.create_index("id")
+    coll.create_index([("id", 1), ("timestamp", -1)])
     idfilter = [(k.split(":")[0], k.split(":")[1]) for k in idfilter.split(";")] if idfilter else []
     extid_qid = id_mapper(pid, idfilter)
     qid_extid = {v: k for k, v in extid_qid.items()}
     qids = extid_qid.values()
-    """
+
     # what are the date extents of these items?
     # get the most recent timestamp and figure out how many weeks ago it was
     # warning, only checks the most recent timestamp!
@@ -449,9 +543,13 @@ def main(pid, weeks, idfilter, force_update, filter_user):
                 print("Most recent revision stored: {}".format(max(timestamps)))
     print("Getting revisions from the past {} weeks".format(weeks_to_dl))
 
-    need_revisions = get_revision_ids_needed(coll, qids, weeks=weeks_to_dl)
+    # the replica connection is only open while it's queried, not through the download and processing
+    with WikidataMySQL() as db:
+        need_revisions = get_revision_ids_needed(coll, qids, db, weeks=weeks_to_dl, checkpoint_path=checkpoint_path)
     print("Downloading revisions")
-    download_revisions(coll, need_revisions, pid, qid_extid)
+    download_revisions(coll, need_revisions, pid, qid_extid, workers=workers)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
 
     print("Processing changes in the past {} weeks".format(weeks))
     changes = process_revisions(coll, qids, weeks)
@@ -480,10 +578,10 @@ def main(pid, weeks, idfilter, force_update, filter_user):
         lda_df = lda_df[["revid", "url", "timestamp", "user", "change_type", "comment",
                          "merge", "qid", "qid_label", "value"]]
     lda_df.to_excel(writer, sheet_name="labels")
-    """
-    
+
     print("Getting redirects")
-    redirect_df = get_merges(qids, weeks)
+    with WikidataMySQL() as db:
+        redirect_df = get_merges(qids, weeks, db)
     redirect_df['history_url'] = redirect_df.page_title.apply(lambda x: "https://www.wikidata.org/w/index.php?title={}&action=history".format(x))
     redirect_df['url'] = redirect_df.page_latest.apply(lambda x: "https://www.wikidata.org/w/index.php?diff={}".format(x))
     redirect_df.to_excel(writer, sheet_name="redirects")
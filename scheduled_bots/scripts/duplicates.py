@@ -0,0 +1,188 @@
+"""
+Find duplicate items by grouping them on a key (an external ID, a normalized label), instead of searching or
+self-joining per item, and merge them from a plan that can be reviewed before it's applied.
+
+find: rows (paged sparql query or json dump) -> index of key -> items -> groups of duplicates -> merge plan (tsv)
+apply: merge plan -> merges, rate limited, and journaled so an interrupted run can be resumed
+"""
+import gzip
+import json
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+from tqdm import tqdm
+from wikidataintegrator.wdi_core import WDItemEngine
+
+PLAN_COLUMNS = ['from_qid', 'to_qid', 'reason', 'from_label', 'to_label']
+
+
+def normalize_label(label):
+    # labels that only differ in case, unicode normalization or whitespace are the same
+    return " ".join(unicodedata.normalize("NFKC", label).casefold().split())
+
+
+def qid_number(qid):
+    return int(qid[1:])
+
+
+def query_pages(query, page_size=50000):
+    """
+    Rows of a sparql query, `page_size` at a time so a query over a big result doesn't time out.
+    The query must select ?item, and not have an ORDER BY or LIMIT
+    :return: generator of dicts, var -> value, with entity URIs shortened to their ID
+    """
+    offset = 0
+    while True:
+        page = query + "\nORDER BY ?item LIMIT {} OFFSET {}".format(page_size, offset)
+        bindings = WDItemEngine.execute_sparql_query(page)['results']['bindings']
+        for binding in bindings:
+            yield {k: v['value'].replace("http://www.wikidata.org/entity/", "") for k, v in binding.items()}
+        if len(bindings) < page_size:
+            return
+        offset += page_size
+
+
+def iter_dump(path):
+    # entities in a wikidata json dump (one entity per line), gzipped or not
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rt') as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if line in {"", "[", "]"}:
+                continue
+            yield json.loads(line)
+
+
+def claim_values(entity, pid):
+    values = []
+    for claim in entity.get('claims', dict()).get(pid, []):
+        value = claim['mainsnak'].get('datavalue', dict()).get('value')
+        if isinstance(value, dict):
+            value = value.get('id')
+        if value:
+            values.append(value)
+    return values
+
+
+def dump_rows(path, pid, group_pid=None, types=None):
+    """
+    The same rows as the `find` queries, from a json dump: one per item and value of `pid`, with the english label
+    and the value of `group_pid` (e.g. found in taxon) as 'group'
+    :param types: only items that are an instance or subclass of one of these
+    """
+    for entity in iter_dump(path):
+        values = claim_values(entity, pid)
+        if not values:
+            continue
+        if types and not set(claim_values(entity, 'P31') + claim_values(entity, 'P279')) & set(types):
+            continue
+        label = entity.get('labels', dict()).get('en', dict()).get('value', '')
+        groups = claim_values(entity, group_pid) if group_pid else []
+        for value in values:
+            for group in groups or ['']:
+                yield {'item': entity['id'], 'value': value, 'label': label, 'group': group}
+
+
+def build_index(rows, key):
+    """
+    :param key: function of a row, returns the key to group the row's item on, or None to skip the row
+    :return: {key: set of items}
+    """
+    index = defaultdict(set)
+    for row in rows:
+        k = key(row)
+        if k is not None:
+            index[k].add(row['item'])
+    return index
+
+
+def duplicate_groups(*indexes):
+    """
+    Groups of items that share a key in any of the indexes. Items linked through different keys end up in one group,
+    so each group gets merged into a single item
+    :return: list of (set of items, {item: set of keys})
+    """
+    parent = dict()
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    item_keys = defaultdict(set)
+    for index in indexes:
+        for key, items in index.items():
+            if len(items) < 2:
+                continue
+            items = sorted(items, key=qid_number)
+            for item in items:
+                parent.setdefault(item, item)
+                item_keys[item].add(key)
+            for item in items[1:]:
+                parent[find(item)] = find(items[0])
+
+    groups = defaultdict(set)
+    for item in parent:
+        groups[find(item)].add(item)
+    return [(items, {item: item_keys[item] for item in items}) for items in groups.values()]
+
+
+def merge_into_oldest(groups, labels=None):
+    """
+    A merge plan that merges every item of each group into the oldest (lowest numbered) one
+    :param groups: from `duplicate_groups`
+    :param labels: {item: label}, for reviewing the plan
+    """
+    labels = labels or dict()
+    rows = []
+    for items, item_keys in groups:
+        to_qid = min(items, key=qid_number)
+        for from_qid in sorted(items - {to_qid}, key=qid_number):
+            shared = item_keys[from_qid] & item_keys[to_qid]
+            reason = ";".join(sorted(map(str, shared))) if shared else "same group"
+            rows.append({'from_qid': from_qid, 'to_qid': to_qid, 'reason': reason,
+                         'from_label': labels.get(from_qid, ''), 'to_label': labels.get(to_qid, '')})
+    return pd.DataFrame(rows, columns=PLAN_COLUMNS)
+
+
+def save_merge_plan(plan, path):
+    # a tsv, to be reviewed. remove the rows of merges that shouldn't be done before applying it
+    plan.to_csv(path, sep="\t", index=False)
+
+
+def load_merge_plan(path):
+    return pd.read_csv(path, sep="\t", dtype=str, keep_default_na=False, comment="#")
+
+
+def apply_merge_plan(plan, merge, journal, limiter=None, workers=4):
+    """
+    Call merge(from_qid, to_qid) for each row in the plan that isn't in the journal yet. Merges into different items
+    are done at the same time, merges into the same item are done one after another
+    :param journal: scheduled_bots.utils.Journal, keyed by from_qid
+    :param limiter: scheduled_bots.utils.RateLimiter
+    """
+    by_target = defaultdict(list)
+    for row in plan.to_dict("records"):
+        if row['from_qid'] not in journal.done:
+            by_target[row['to_qid']].append(row)
+
+    def merge_all(rows):
+        for row in rows:
+            if limiter:
+                limiter.wait()
+            record = dict(row, key=row['from_qid'])
+            try:
+                merge(row['from_qid'], row['to_qid'])
+                record['success'] = True
+            except Exception as e:
+                print(row['from_qid'], row['to_qid'], e)
+                record.update(success=False, error=str(e))
+            journal.write(record)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(merge_all, rows) for rows in by_target.values()]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
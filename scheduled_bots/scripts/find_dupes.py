@@ -1,25 +1,32 @@
-# find other items with the same label
+# find DOID items with no other statements that have the same label as one other item, and merge them into it
+#
+# python find_dupes.py find --plan doid_merges.tsv
+# (review doid_merges.tsv, and remove the rows of merges that shouldn't be done)
+# python find_dupes.py apply --plan doid_merges.tsv --journal doid_merges.jsonl
+import json
+
+import click
+import pandas as pd
 import requests
-from pprint import pprint
 from tqdm import tqdm
 
-from wikidataintegrator import wdi_helpers, wdi_core, wdi_login
-from scheduled_bots.local import GREGUSER, GREGPASS
+from wikidataintegrator import wdi_core, wdi_login
+from scheduled_bots.scripts.duplicates import query_pages, build_index, normalize_label, qid_number, \
+    save_merge_plan, load_merge_plan, apply_merge_plan, PLAN_COLUMNS
+from scheduled_bots.utils import grouper, Journal, RateLimiter
 
+# DOID items whose only statement is the DOID
+stub_query = """SELECT ?item ?label WHERE {
+  ?item wdt:P699 ?doid ; wikibase:statements 1 ; rdfs:label ?label .
+  FILTER(LANG(?label) = "en")
+}"""
 
-def search(search_string):
-    params = {
-        'action': 'wbsearchentities',
-        'language': 'en',
-        'search': search_string,
-        'format': 'json',
-        'limit': 3
-    }
-    mediawiki_api_url = 'https://www.wikidata.org/w/api.php'
-    reply = requests.get(mediawiki_api_url, params=params)
-    reply.raise_for_status()
-    search_results = reply.json()
-    return search_results['search']
+# items with one of the labels
+label_query = """SELECT ?item ?label ?description WHERE {{
+  VALUES ?label {{ {labels} }}
+  ?item rdfs:label ?label .
+  OPTIONAL {{ ?item schema:description ?description . FILTER(LANG(?description) = "en") }}
+}}"""
 
 
 def create_redirect(from_id, to_id, login):
@@ -54,31 +61,82 @@ def create_redirect(from_id, to_id, login):
         raise ValueError(d)
 
 
-login = wdi_login.WDLogin(GREGUSER, GREGPASS)
-log = open("log.txt", "a")
-disease_qids = wdi_helpers.id_mapper("P699")
+def label_variants(label):
+    # rdfs:label matches are exact. these are the forms a label that only differs in case is likely to have
+    return {label, label.lower(), label.capitalize(), label.title()}
+
+
+def get_label_rows(labels, chunk_size=200):
+    # items with any of the labels, `chunk_size` labels per query
+    variants = sorted(set.union(set(), *(label_variants(label) for label in labels)))
+    for chunk in tqdm(grouper(chunk_size, variants), total=len(variants) / chunk_size):
+        values = " ".join(json.dumps(label, ensure_ascii=False) + "@en" for label in chunk)
+        bindings = wdi_core.WDItemEngine.execute_sparql_query(label_query.format(labels=values))['results']['bindings']
+        for binding in bindings:
+            yield {k: v['value'].replace("http://www.wikidata.org/entity/", "") for k, v in binding.items()}
+
+
+def find_merges(stub_rows, label_rows):
+    """
+    :param stub_rows: the DOID items to merge (item, label)
+    :param label_rows: items with the same labels (item, label, description)
+    :return: merge plan, of each stub into the one other item with its label
+    """
+    stub_label = {row['item']: row['label'] for row in stub_rows}
+    label_rows = [row for row in label_rows if row.get('description') != "scientific article"]
+    index = build_index(label_rows, lambda row: normalize_label(row['label']))
+    item_label = {row['item']: row['label'] for row in label_rows}
 
-for disease_qid in tqdm(sorted(list(disease_qids.values()))):
-    item = wdi_core.WDItemEngine(wd_item_id=disease_qid)
-    if not len(item.statements) == 1:
-        continue
+    rows = []
+    for stub, label in sorted(stub_label.items(), key=lambda x: qid_number(x[0])):
+        others = index.get(normalize_label(label), set()) - {stub}
+        if len(others) != 1:
+            continue
+        other = next(iter(others))
+        if other in stub_label and qid_number(other) > qid_number(stub):
+            # two stubs with the same label, only merge the newer one into the older one
+            continue
+        rows.append({'from_qid': stub, 'to_qid': other, 'reason': "label: " + label,
+                     'from_label': label, 'to_label': item_label[other]})
+    return pd.DataFrame(rows, columns=PLAN_COLUMNS)
 
-    label = item.get_label()
 
-    search_results = search(label)
-    search_results = [x for x in search_results if x.get('description') != "scientific article"]
-    search_results = [x for x in search_results if x['id'] != disease_qid]
-    search_results = [x for x in search_results if x['label'].lower() == label.lower()]
+@click.group()
+def cli():
+    pass
 
-    if len(search_results) != 1:
-        continue
-    to_merge_qid = search_results[0]['id']
+
+@cli.command()
+@click.option('--plan', 'plan_path', required=True, help='tsv to write the merge plan to')
+def find(plan_path):
+    stub_rows = list(query_pages(stub_query))
+    label_rows = list(get_label_rows(set(row['label'] for row in stub_rows)))
+    plan = find_merges(stub_rows, label_rows)
+    save_merge_plan(plan, plan_path)
+    print("{} merges in {}".format(len(plan), plan_path))
+
+
+@cli.command()
+@click.option('--plan', 'plan_path', required=True, help='reviewed merge plan')
+@click.option('--journal', 'journal_path', required=True, help='jsonl file of the merges done so far')
+@click.option('--retry-failed', is_flag=True, help='try again the merges that failed in the journal')
+@click.option('--workers', default=4)
+@click.option('--merges-per-minute', default=30)
+def apply(plan_path, journal_path, retry_failed, workers, merges_per_minute):
+    from scheduled_bots.local import GREGUSER, GREGPASS
+    login = wdi_login.WDLogin(GREGUSER, GREGPASS)
+
+    def merge(from_qid, to_qid):
+        wdi_core.WDItemEngine.merge_items(from_qid, to_qid, login_obj=login, ignore_conflicts='description')
+        create_redirect(from_qid, to_qid, login)
+
+    journal = Journal(journal_path, retry_failed=retry_failed)
     try:
-        wdi_core.WDItemEngine.merge_items(disease_qid, to_merge_qid, login_obj=login, ignore_conflicts='description')
-        create_redirect(disease_qid, to_merge_qid, login)
-    except Exception as e:
-        continue
-    s = [disease_qid, to_merge_qid, label, search_results[0]['label'],
-         "http://www.wikidata.org/entity/" + disease_qid, "http://www.wikidata.org/entity/" + to_merge_qid]
-    print("|".join(s), file=log)
-    print(" | ".join(s))
+        apply_merge_plan(load_merge_plan(plan_path), merge, journal, limiter=RateLimiter(merges_per_minute),
+                         workers=workers)
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    cli()
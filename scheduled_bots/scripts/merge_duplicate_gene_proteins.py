@@ -1,37 +1,94 @@
+# merge gene items with the same entrez ID in the same taxon, or protein items with the same uniprot ID
+# human items are left alone
+#
+# the items with an ID are fetched with paged queries (or read from a json dump with --dump), and grouped by the ID,
+# instead of self-joining on the ID in one query, which times out
+#
+# python merge_duplicate_gene_proteins.py find --type gene --plan gene_merges.tsv
+# (review gene_merges.tsv, and remove the rows of merges that shouldn't be done)
+# python merge_duplicate_gene_proteins.py apply --plan gene_merges.tsv --journal gene_merges.jsonl
+import click
 from tqdm import tqdm
 
-from wikidataintegrator.wdi_core import WDItemEngine, MergeError
+from wikidataintegrator.wdi_core import WDItemEngine
 from wikidataintegrator.wdi_login import WDLogin
-from scheduled_bots.local import WDUSER, WDPASS
-
-login = WDLogin(WDUSER, WDPASS)
-s_protein = """
-SELECT DISTINCT ?item1 ?item2 ?value {{
-	?item1 wdt:P352 ?value .
-	?item2 wdt:P352 ?value .
-    ?item1 wdt:P31|wdt:P279 wd:Q8054 .
-    ?item2 wdt:P31|wdt:P279 wd:Q8054 .
-    FILTER NOT EXISTS {{?item1 wdt:P703 wd:Q15978631}}
-	FILTER( ?item1 != ?item2 && STR( ?item1 ) < STR( ?item2 ) ) .
-}}"""
-
-s_gene = """
-SELECT DISTINCT ?item1 ?item2 ?value {{
-	?item1 wdt:P351 ?value .
-	?item2 wdt:P351 ?value .
-    ?item1 wdt:P703 ?taxon1 .
-    ?item2 wdt:P703 ?taxon2 .
-	FILTER( ?item1 != ?item2 && STR( ?item1 ) < STR( ?item2 ) && ?taxon1 = ?taxon2) .
-    FILTER NOT EXISTS {{?item1 wdt:P703 wd:Q15978631}}
-}}"""
-
-s = s_gene
-
-items = [{k: v['value'].split("/")[-1] for k, v in x.items()} for x in
-         WDItemEngine.execute_sparql_query(s)['results']['bindings']]
-for x in tqdm(items):
+from scheduled_bots.scripts.duplicates import query_pages, dump_rows, build_index, duplicate_groups, \
+    merge_into_oldest, save_merge_plan, load_merge_plan, apply_merge_plan
+from scheduled_bots.utils import Journal, RateLimiter
+
+HUMAN = "Q15978631"
+PROTEIN = "Q8054"
+
+queries = {
+    'gene': """SELECT ?item ?value ?group WHERE {
+  ?item wdt:P351 ?value ; wdt:P703 ?group .
+  FILTER(?group != wd:Q15978631)
+}""",
+    'protein': """SELECT ?item ?value WHERE {
+  ?item wdt:P352 ?value ; wdt:P31|wdt:P279 wd:Q8054 .
+  FILTER NOT EXISTS {?item wdt:P703 wd:Q15978631}
+}""",
+}
+
+# the property of the ID, and whether items are only duplicates within a taxon
+id_props = {'gene': ('P351', True), 'protein': ('P352', False)}
+
+
+def get_rows(item_type, dump=None, page_size=50000):
+    pid, by_taxon = id_props[item_type]
+    if dump is None:
+        return query_pages(queries[item_type], page_size=page_size)
+    types = [PROTEIN] if item_type == 'protein' else None
+    rows = list(dump_rows(dump, pid, group_pid='P703', types=types))
+    human = set(row['item'] for row in rows if row['group'] == HUMAN)
+    return [row for row in rows if row['item'] not in human]
+
+
+def find_merges(item_type, rows):
+    pid, by_taxon = id_props[item_type]
+    if by_taxon:
+        index = build_index(tqdm(rows), lambda row: (row['group'], pid, row['value']))
+    else:
+        index = build_index(tqdm(rows), lambda row: (pid, row['value']))
+    return merge_into_oldest(duplicate_groups(index))
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--type', 'item_type', type=click.Choice(['gene', 'protein']), default='gene')
+@click.option('--plan', 'plan_path', required=True, help='tsv to write the merge plan to')
+@click.option('--dump', default=None, help='wikidata json dump to read the items from, instead of querying')
+def find(item_type, plan_path, dump):
+    plan = find_merges(item_type, get_rows(item_type, dump))
+    save_merge_plan(plan, plan_path)
+    print("{} merges in {}".format(len(plan), plan_path))
+
+
+@cli.command()
+@click.option('--plan', 'plan_path', required=True, help='reviewed merge plan')
+@click.option('--journal', 'journal_path', required=True, help='jsonl file of the merges done so far')
+@click.option('--retry-failed', is_flag=True, help='try again the merges that failed in the journal')
+@click.option('--workers', default=4)
+@click.option('--merges-per-minute', default=30)
+def apply(plan_path, journal_path, retry_failed, workers, merges_per_minute):
+    from scheduled_bots.local import WDUSER, WDPASS
+    login = WDLogin(WDUSER, WDPASS)
+
+    def merge(from_qid, to_qid):
+        WDItemEngine.merge_items(from_id=from_qid, to_id=to_qid, login_obj=login,
+                                 ignore_conflicts='statement|description|sitelink')
+
+    journal = Journal(journal_path, retry_failed=retry_failed)
     try:
-        WDItemEngine.merge_items(from_id=x['item2'], to_id=x['item1'], login_obj=login, ignore_conflicts='statement|description|sitelink')
-    except MergeError as e:
-        print(e)
-        pass
+        apply_merge_plan(load_merge_plan(plan_path), merge, journal, limiter=RateLimiter(merges_per_minute),
+                         workers=workers)
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,77 @@
+import gzip
+import json
+import os
+import tempfile
+
+from scheduled_bots.scripts.duplicates import build_index, duplicate_groups, merge_into_oldest, normalize_label, \
+    save_merge_plan, load_merge_plan, apply_merge_plan, dump_rows
+from scheduled_bots.utils import Journal
+
+
+def entity(qid, label, entrez=None, taxon=None):
+    claims = dict()
+    if entrez:
+        claims['P351'] = [{'mainsnak': {'datavalue': {'value': entrez, 'type': 'string'}}}]
+    if taxon:
+        claims['P703'] = [{'mainsnak': {'datavalue': {'value': {'id': taxon}, 'type': 'wikibase-entityid'}}}]
+    return {'id': qid, 'labels': {'en': {'value': label}}, 'claims': claims}
+
+
+def test_duplicate_groups():
+    gene_rows = [{'item': 'Q30', 'group': 'Q184224', 'value': '1017'},
+                 {'item': 'Q5', 'group': 'Q184224', 'value': '1017'},
+                 {'item': 'Q7', 'group': 'Q83310', 'value': '1017'},
+                 {'item': 'Q8', 'group': 'Q83310', 'value': '1018'}]
+    label_rows = [{'item': 'Q30', 'label': 'CDK2'}, {'item': 'Q40', 'label': 'cdk2 '},
+                  {'item': 'Q8', 'label': 'Cdk3'}]
+    ids = build_index(gene_rows, lambda row: (row['group'], row['value']))
+    labels = build_index(label_rows, lambda row: normalize_label(row['label']))
+    groups = duplicate_groups(ids, labels)
+    # Q5 and Q30 share an ID, and Q30 and Q40 a label. Q7 has the same ID in another taxon
+    assert [items for items, _ in groups] == [{'Q5', 'Q30', 'Q40'}]
+
+    plan = merge_into_oldest(groups, labels={'Q30': 'CDK2'})
+    assert plan[['from_qid', 'to_qid', 'reason', 'from_label']].values.tolist() == [
+        ['Q30', 'Q5', "('Q184224', '1017')", 'CDK2'], ['Q40', 'Q5', 'same group', '']]
+
+
+def test_dump_rows():
+    path = os.path.join(tempfile.mkdtemp(), "dump.json.gz")
+    entities = [entity('Q1', 'a', '1017', 'Q184224'), entity('Q2', 'b'), entity('Q3', 'c', '1018')]
+    with gzip.open(path, 'wt') as f:
+        f.write("[\n" + ",\n".join(json.dumps(e) for e in entities) + "\n]\n")
+    assert list(dump_rows(path, 'P351', group_pid='P703')) == [
+        {'item': 'Q1', 'value': '1017', 'label': 'a', 'group': 'Q184224'},
+        {'item': 'Q3', 'value': '1018', 'label': 'c', 'group': ''}]
+
+
+def test_apply_merge_plan_resume():
+    d = tempfile.mkdtemp()
+    groups = duplicate_groups(build_index([{'item': 'Q{}'.format(i), 'value': str(i % 3)} for i in range(1, 13)],
+                                          lambda row: row['value']))
+    plan_path = os.path.join(d, "plan.tsv")
+    save_merge_plan(merge_into_oldest(groups), plan_path)
+    plan = load_merge_plan(plan_path)
+    assert len(plan) == 9
+
+    merged = []
+    attempts = []
+
+    def merge(from_qid, to_qid):
+        attempts.append(from_qid)
+        if attempts.count('Q12') == 1 and from_qid == 'Q12':
+            raise ValueError("conflict")
+        merged.append((from_qid, to_qid))
+
+    journal_path = os.path.join(d, "journal.jsonl")
+    journal = Journal(journal_path)
+    apply_merge_plan(plan, merge, journal)
+    journal.close()
+    assert len(merged) == 8
+    # merges into the same item are done in order
+    assert [x for x in merged if x[1] == 'Q1'] == [('Q4', 'Q1'), ('Q7', 'Q1'), ('Q10', 'Q1')]
+
+    journal = Journal(journal_path, retry_failed=True)
+    apply_merge_plan(plan, merge, journal)
+    journal.close()
+    assert merged[8:] == [('Q12', 'Q3')]
@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+import pandas as pd
+
+from scheduled_bots.scripts.undo_run import revert_targets, undo_targets, run_undos, Journal, EditSession
+
+# qid -> revisions, oldest first
+history = {'Q{}'.format(i): [100 + i, 200 + i, 300 + i] for i in range(120)}
+revid_page = {rev: qid for qid, revs in history.items() for rev in revs}
+
+
+class MockApi:
+    """ answers prop=revisions queries by revids or titles, counting requests """
+
+    def __init__(self):
+        self.n_requests = 0
+
+    def get(self, url, params=None):
+        self.n_requests += 1
+        if 'revids' in params:
+            revids = [int(x) for x in params['revids'].split("|")]
+            pages = {revid_page[rev]: {'title': revid_page[rev], 'revisions': [
+                {'revid': rev, 'parentid': rev - 100 if rev >= 200 else 0}]} for rev in revids}
+        else:
+            pages = {qid: {'title': qid, 'revisions': [{'revid': history[qid][-1]}]}
+                     for qid in params['titles'].split("|")}
+        response = mock.Mock()
+        response.json.return_value = {'query': {'pages': pages}}
+        return response
+
+
+class MockLogin:
+    def __init__(self):
+        self.s = mock.Mock()
+        self.s.post.side_effect = self.post
+        self.n_tokens = 0
+        self.edits = []
+
+    def get_edit_token(self):
+        self.n_tokens += 1
+        return "token"
+
+    def post(self, url, data=None):
+        self.edits.append(data)
+        response = mock.Mock()
+        response.json.return_value = {'edit': {'result': 'Success'}}
+        return response
+
+
+def run_edits():
+    # the run edited each item twice
+    rows = [(qid, str(revs[1 + i]), i) for i in range(2) for qid, revs in history.items()]
+    return pd.DataFrame(rows, columns=['qid', 'rev_id', 'timestamp'])
+
+
+def test_revert_targets():
+    api = MockApi()
+    targets = revert_targets(run_edits(), api)
+    # 120 items, 50 revids or titles per request
+    assert api.n_requests == 6
+    assert targets[0] == {'key': 'Q0', 'qid': 'Q0', 'undoafter': '100', 'undo': '300'}
+
+
+def test_undo_targets():
+    targets = undo_targets(run_edits())
+    assert len(targets) == 120
+    assert targets[0] == {'key': '419', 'qid': 'Q119', 'undo': '419'}
+
+
+def test_run_undos_resume():
+    journal_path = os.path.join(tempfile.mkdtemp(), "journal.jsonl")
+    targets = revert_targets(run_edits(), MockApi())
+    targets.append({'key': 'Q1000', 'qid': 'Q1000', 'undoafter': None, 'undo': '1', 'error': "no revision before 1"})
+
+    login = MockLogin()
+    journal = Journal(journal_path)
+    # interrupted after 30 items
+    run_undos(targets[:30], EditSession(login), journal)
+    journal.close()
+
+    journal = Journal(journal_path)
+    run_undos(targets, EditSession(login), journal)
+    journal.close()
+    assert sorted(edit['title'] for edit in login.edits) == sorted(history)
+    # one token per session
+    assert login.n_tokens == 2
+
+    with open(journal_path) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 121
+    assert [r['key'] for r in records if not r['success']] == ['Q1000']
+    # a failure is retried with retry_failed
+    assert Journal(journal_path, retry_failed=True).done == set(history)
+
+
+def test_run_undos_item_order():
+    # the run edited each item three times: two undos each, done newest first
+    rows = [(qid, str(revs[i]), i) for i in range(3) for qid, revs in history.items()]
+    targets = undo_targets(pd.DataFrame(rows, columns=['qid', 'rev_id', 'timestamp']))
+    journal = Journal(os.path.join(tempfile.mkdtemp(), "journal.jsonl"))
+    login = MockLogin()
+    run_undos(targets, EditSession(login), journal, workers=8)
+    journal.close()
+    assert len(login.edits) == 240
+    for qid, revs in history.items():
+        assert [edit['undo'] for edit in login.edits if edit['title'] == qid] == [str(revs[2]), str(revs[1])]
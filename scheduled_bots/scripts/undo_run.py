@@ -1,143 +1,228 @@
 # undo bad things from a log file, or a list of revids
-
-import pandas as pd
-from tqdm import tqdm
+#
+# the edits of a run are read from the log store (see scheduled_bots/logger/log_store.py), by log file or run_id.
+# two modes:
+#  undo: undo each edit from the log individually, except the first edit on each item
+#  revert: undo all edits on each item from the first one in the log until the most recent, current edit. Be careful
+#    if there were edits since the run was performed
+# every undo is written to the journal as it finishes, and running again with the same journal continues from there.
+# the undos of one item are done one after another, different items at the same time. --dry-run prints the undos
+# without doing them, and without --qids the run's edits on all items are undone, after a confirmation
+#
+# python undo_run.py --log-path "logs/Monarch Disease Ontology-20180727_17:11.log" --qids qids.txt --journal revert.jsonl
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
 import requests
-from wikidataintegrator.wdi_login import WDLogin
-from wikidataintegrator.wdi_core import WDItemEngine
-from scheduled_bots.local import GREGUSER, GREGPASS
-
-login = WDLogin(GREGUSER, GREGPASS)
-log_path = "/home/gstupp/projects/wikidata-biothings/scheduled_bots/scheduled_bots/ontology/logs/Monarch Disease Ontology-20180727_17:11.log"
-
-
-# from a sparql query, get a list of items that we want to undo edits from
-query = """
-select ?item (count(*) as ?c) where {
-  SELECT DISTINCT ?item ?mondo WHERE {
-    ?item wdt:P5270 ?mondo
-  }
-} group by ?item
-having (?c > 1)
-order by desc(?c)"""
-item_df = WDItemEngine.execute_sparql_query(query, as_dataframe=True)
-item_df.item = item_df.item.str.replace("http://www.wikidata.org/entity/", "")
-items = list(item_df.item)
-
-# read in a log of the run
-def parse_log(file_path):
-    df = pd.read_csv(file_path, sep=",",
-                     names=['Level', 'Timestamp', 'External ID', 'Prop', 'QID', 'Message', 'Msg Type', 'Rev ID'],
-                     skiprows=2, dtype={'External ID': str, 'Rev ID': str},
-                     comment='#', quotechar='"', skipinitialspace=True, delimiter=';')
-    df.fillna('', inplace=True)
-    df.replace("None", "", inplace=True)
-    df = df.apply(lambda x: x.str.strip())
-    df.Timestamp = pd.to_datetime(df.Timestamp, format='%m/%d/%Y %H:%M:%S')
-    return df
-
-#########################
-# Undo each edit from the log individually
-#########################
-
-df = parse_log(log_path)
-df = df[df.QID.isin(items)]
-df = df.sort_values("Timestamp")
-df.dropna(subset=["QID"], inplace=True)
-df.dropna(subset=["Rev ID"], inplace=True)
-# take only the LAST revisions for a QID. AKA, keep the first revision for an item
-df = df[df.duplicated("QID")]
-
-print("{} edits to undo".format(len(df)))
-records = df[['Rev ID', 'QID']].to_dict("records")
-records = records[::-1]
-
-for record in tqdm(records):
-    qid = record['QID']
-    revid = record['Rev ID']
-    # qid = "Q183130"
-    # revid = "717075555"
-
-    params = {
-        "action": "edit",
-        "title": qid,
-        "undo": revid,
-        "token": login.get_edit_token(),
-        "format": "json"
-    }
-    url = "https://www.wikidata.org/w/api.php"
-
-    r = login.s.post(url, data=params)
-    response = r.json()
-    record['response'] = response
-    if "error" in response:
-        print(response)
-        record['success'] = False
+from tqdm import tqdm
+
+from scheduled_bots.logger.log_store import LogStore, LOG_STORE_PATH, COLUMNS
+from scheduled_bots.utils import grouper, RateLimiter, Journal
+
+API_URL = "https://www.wikidata.org/w/api.php"
+# max titles or revids in one prop=revisions query
+MAX_TITLES = 50
+
+
+def get_run_edits(store, log_path=None, run_id=None, qids=None):
+    """
+    The edits (rows with a QID and a Rev ID) of a run in the log store, in the order they were made
+    :param qids: only edits on these items
+    :return: DataFrame with columns qid, rev_id, timestamp
+    """
+    if log_path:
+        df, _ = store.get_log(log_path)
+        df = df.rename(columns=COLUMNS)
     else:
-        print(response)
-        record['success'] = True
-
-#########################
-# Copy of above, but instead, perform a "revert" by undoing all edits from the specified one in the log
-# until the most recent, current edit. Be careful if there were edits since the run was performed
-#########################
-
-log_path = "/home/gstupp/projects/wikidata-biothings/scheduled_bots/scheduled_bots/ontology/logs/mondo/mondo.log"
-df = parse_log(log_path)
-df = df[df.QID.isin(items)]
-df = df.sort_values("Timestamp")
-df.dropna(subset=["QID"], inplace=True)
-df.dropna(subset=["Rev ID"], inplace=True)
-# take only the FIRST revision
-df = df[~df.duplicated("QID")]
-
-qid_revid = dict(zip(df['QID'], df['Rev ID']))
-
-for qid in tqdm(items[200:]):
-    revid = qid_revid[qid]
-    # get the revisions for a page
-    params = {
-        'rvdir': 'older',
-        'rvlimit': 2,
-        'action': 'query',
-        'prop': 'revisions',
-        'titles': qid,
-        'rvstartid': revid,
-        'format': 'json'
-    }
-    url = "https://www.wikidata.org/w/api.php"
-    p = requests.get(url, params=params).json()['query']['pages']
-    last_revision = list(p.values())[0]['revisions'][-1]['revid']
-
-    # get current revision
-    params = {
-        'rvlimit': 1,
-        'action': 'query',
-        'prop': 'revisions',
-        'titles': qid,
-        'format': 'json'
-    }
-    url = "https://www.wikidata.org/w/api.php"
-    p = requests.get(url, params=params).json()['query']['pages']
-    current_revision = list(p.values())[0]['revisions'][-1]['revid']
-
-    params = {
-        "action": "edit",
-        "title": qid,
-        "undoafter": last_revision,
-        "undo": current_revision,
-        "token": login.get_edit_token(),
-        "format": "json",
-        "summary": "‎Restore revision {}".format(last_revision)
-    }
-    url = "https://www.wikidata.org/w/api.php"
-
-    r = login.s.post(url, data=params)
-    response = r.json()
-    record['response'] = response
-    if "error" in response:
-        print(response)
-        record['success'] = False
+        df = store.query(run_ids=[run_id])
+    df = df[(df.qid != '') & (df.rev_id != '')]
+    if qids is not None:
+        df = df[df.qid.isin(set(qids))]
+    return df.sort_values("timestamp", kind="stable")[['qid', 'rev_id', 'timestamp']]
+
+
+def query_revisions(session, **params):
+    # one prop=revisions query. returns the pages, with the revisions in each
+    params = dict(params, action='query', prop='revisions', rvprop='ids', format='json')
+    return session.get(API_URL, params=params).json()['query']['pages'].values()
+
+
+def get_parent_revisions(revids, session=requests):
+    # revid -> the revision before it, MAX_TITLES revids per request
+    parents = dict()
+    for chunk in grouper(MAX_TITLES, revids):
+        for page in query_revisions(session, revids="|".join(map(str, chunk))):
+            for rev in page.get('revisions', []):
+                parents[str(rev['revid'])] = str(rev['parentid'])
+    return parents
+
+
+def get_current_revisions(qids, session=requests):
+    # qid -> current revision, MAX_TITLES items per request
+    current = dict()
+    for chunk in grouper(MAX_TITLES, qids):
+        for page in query_revisions(session, titles="|".join(chunk)):
+            if page.get('revisions'):
+                current[page['title']] = str(page['revisions'][-1]['revid'])
+    return current
+
+
+def undo_targets(edits):
+    # undo each edit except the first one on each item, most recent first
+    edits = edits[edits.duplicated("qid")][::-1]
+    return [{'key': revid, 'qid': qid, 'undo': revid} for qid, revid in zip(edits.qid, edits.rev_id)]
+
+
+def revert_targets(edits, session=requests):
+    """
+    Restore each item to the revision before the first edit on it in the run, by undoing everything from that revision
+    to the current one. Revisions are looked up for MAX_TITLES items at a time
+    """
+    first = edits[~edits.duplicated("qid")]
+    qid_revid = dict(zip(first.qid, first.rev_id))
+    parents = get_parent_revisions(list(qid_revid.values()), session)
+    current = get_current_revisions(list(qid_revid), session)
+    targets = []
+    for qid, revid in qid_revid.items():
+        target = {'key': qid, 'qid': qid, 'undoafter': parents.get(revid), 'undo': current.get(qid)}
+        if not target['undoafter'] or target['undoafter'] == '0':
+            # the item was created in the run, or the revision is gone
+            target['error'] = "no revision before {}".format(revid)
+        elif not target['undo']:
+            target['error'] = "item not found"
+        targets.append(target)
+    return targets
+
+
+class EditSession:
+    """
+    Posts edits with one edit token shared by all threads. The token is only renewed when the api rejects it
+    """
+
+    def __init__(self, login, limiter=None, maxlag_retries=5):
+        self.login = login
+        self.limiter = limiter
+        self.maxlag_retries = maxlag_retries
+        self.token = None
+        self.lock = threading.Lock()
+
+    def get_token(self, renew=False):
+        with self.lock:
+            if renew or self.token is None:
+                if renew:
+                    self.login.generate_edit_credentials()
+                self.token = self.login.get_edit_token()
+            return self.token
+
+    def post(self, params):
+        renewed = False
+        for attempt in range(self.maxlag_retries + 1):
+            if self.limiter:
+                self.limiter.wait()
+            response = self.login.s.post(API_URL, data=dict(params, token=self.get_token(), format='json')).json()
+            code = response.get('error', {}).get('code')
+            if code == 'badtoken' and not renewed:
+                self.get_token(renew=True)
+                renewed = True
+            elif code == 'maxlag':
+                time.sleep(5)
+            else:
+                return response
+        return response
+
+
+def apply_undo(target, session, summary=None):
+    params = {'action': 'edit', 'title': target['qid'], 'undo': target['undo']}
+    if target.get('undoafter'):
+        params['undoafter'] = target['undoafter']
+        params['summary'] = summary or "Restore revision {}".format(target['undoafter'])
+    elif summary:
+        params['summary'] = summary
+    response = session.post(params)
+    return dict(target, response=response, success="error" not in response)
+
+
+def run_undos(targets, session, journal, workers=4):
+    """
+    Undos of different items are done at the same time, the undos of one item one after another, in the order of
+    `targets`. Targets that couldn't be resolved are journaled as failures without an edit
+    """
+    targets = [t for t in targets if t['key'] not in journal.done]
+    for target in [t for t in targets if 'error' in t]:
+        journal.write(dict(target, success=False))
+    by_qid = defaultdict(list)
+    for target in targets:
+        if 'error' not in target:
+            by_qid[target['qid']].append(target)
+
+    def undo_all(item_targets):
+        for target in item_targets:
+            record = apply_undo(target, session)
+            if not record['success']:
+                print(record['response'])
+            journal.write(record)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(undo_all, item_targets) for item_targets in by_qid.values()]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+
+
+@click.command()
+@click.option('--log-path', help='log file of the run')
+@click.option('--run-id', help='run_id of a run in the log store, instead of a log file')
+@click.option('--store', 'store_path', default=LOG_STORE_PATH, help='sqlite log store')
+@click.option('--qids', 'qids_path', help='file with one QID per line. only edits on these items are undone')
+@click.option('--mode', type=click.Choice(['revert', 'undo']), default='revert')
+@click.option('--journal', 'journal_path', required=True, help='jsonl file of the undos done so far')
+@click.option('--retry-failed', is_flag=True, help='try again the undos that failed in the journal')
+@click.option('--dry-run', is_flag=True, help='only print the edits that would be undone')
+@click.option('--yes', is_flag=True, help="don't ask for confirmation without --qids")
+@click.option('--workers', default=4)
+@click.option('--edits-per-minute', default=60)
+def main(log_path, run_id, store_path, qids_path, mode, journal_path, retry_failed, dry_run, yes, workers,
+         edits_per_minute):
+    from wikidataintegrator.wdi_login import WDLogin
+    from scheduled_bots.local import GREGUSER, GREGPASS
+
+    if not (log_path or run_id):
+        raise click.UsageError("--log-path or --run-id is required")
+    qids = None
+    if qids_path:
+        with open(qids_path) as f:
+            qids = [line.strip() for line in f if line.strip()]
+
+    store = LogStore(store_path)
+    edits = get_run_edits(store, log_path=log_path, run_id=run_id, qids=qids)
+    journal = Journal(journal_path, retry_failed=retry_failed)
+    if mode == "undo":
+        targets = undo_targets(edits)
     else:
-        print(response)
-        record['success'] = True
\ No newline at end of file
+        # don't look up revisions for items that are done already
+        edits = edits[~edits.qid.isin(journal.done)]
+        targets = revert_targets(edits)
+    todo = [t for t in targets if t['key'] not in journal.done]
+    print("{} edits to undo on {} items".format(len(todo), len({t['qid'] for t in todo})))
+    if dry_run:
+        for target in todo:
+            print(target)
+        journal.close()
+        return
+    if qids is None and not yes:
+        # without --qids, every item the run edited is touched
+        click.confirm("No --qids given: undo the run's edits on all {} items?".format(len({t['qid'] for t in todo})),
+                      abort=True)
+
+    login = WDLogin(GREGUSER, GREGPASS)
+    session = EditSession(login, limiter=RateLimiter(edits_per_minute))
+    try:
+        run_undos(targets, session, journal, workers=workers)
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+ShEx conformance of many items at once.
+
+Instead of a SlurpyGraph per item, which makes sparql requests for every triple the evaluator looks at, the triples of a
+whole batch of focus nodes are fetched with a few CONSTRUCT queries into one local graph, and the batch is evaluated on
+that. Batches are fetched and evaluated in a pool of worker processes.
+
+Shapes that follow links more than `depth` hops away need triples that aren't fetched. For those, pass recheck=True to
+evaluate the nodes that don't conform again on a SlurpyGraph. That is the slow per-triple path, so it is off by default.
+
+results = check_conformance(qids, schema, workers=4)
+conformance_report(results, schema_url).serialize(destination='DoShEx.ttl', format='turtle')
+"""
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+import jsonasobj
+import requests
+from pyshex import ShExEvaluator
+from rdflib import Graph, URIRef, Literal
+from rdflib.namespace import DCTERMS
+from sparql_slurper import SlurpyGraph
+from wikidataintegrator import wdi_core, wdi_helpers
+
+from scheduled_bots.utils import grouper
+
+WDQS = "https://query.wikidata.org/sparql"
+ENTITY = "http://www.wikidata.org/entity/"
+# nodes that are part of an item: its statements, references and full values
+ITEM_PARTS = ("http://www.wikidata.org/entity/statement/", "http://www.wikidata.org/reference/",
+              "http://www.wikidata.org/value/")
+# the reports have always used dcterms:comment, which isn't a dcterms term that newer rdflib versions allow
+DCTERMS_COMMENT = URIRef("http://purl.org/dc/terms/comment")
+
+
+class TimeoutException(Exception):
+    pass
+
+
+@contextmanager
+def time_limit(seconds):
+    # raises TimeoutException if the block takes longer than `seconds`. only in the main thread, where SIGALRM is handled
+    if not seconds or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def timeout_handler(signum, frame):
+        raise TimeoutException
+
+    previous = signal.signal(signal.SIGALRM, timeout_handler)
+    signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def construct(subjects, endpoint=WDQS):
+    # all triples with any of `subjects` as the subject
+    query = "CONSTRUCT { ?s ?p ?o } WHERE { VALUES ?s { %s } ?s ?p ?o }" % " ".join("<{}>".format(s) for s in subjects)
+    r = requests.post(endpoint, data={'query': query}, headers={'Accept': 'text/turtle'})
+    r.raise_for_status()
+    graph = Graph()
+    graph.parse(data=r.text, format='turtle')
+    return graph
+
+
+def fetch_graph(focus_nodes, endpoint=WDQS, depth=1, chunk_size=100):
+    """
+    One local graph with the triples of the focus nodes, of their statements, references and values, and of the
+    entities they link to up to `depth` hops away (without the statements of those)
+    """
+    graph = Graph()
+    fetched = set()
+    # node -> hop. the parts of an item are at the same hop as the item, entities it links to one hop further
+    frontier = {str(node): 0 for node in focus_nodes}
+    while frontier:
+        new = Graph()
+        for chunk in grouper(chunk_size, sorted(frontier)):
+            new += construct(chunk, endpoint)
+        fetched.update(frontier)
+        next_frontier = dict()
+        for s, p, o in new:
+            o = str(o)
+            if o in fetched:
+                continue
+            hop = frontier[str(s)]
+            if o.startswith(ITEM_PARTS):
+                if hop == 0:
+                    next_frontier.setdefault(o, hop)
+            elif o.startswith(ENTITY) and hop < depth:
+                next_frontier.setdefault(o, hop + 1)
+        graph += new
+        frontier = next_frontier
+    return graph
+
+
+def evaluate(evaluator, graph, focus, timeout=120, debug=False):
+    # (focus, conforms, reason)
+    try:
+        with time_limit(timeout):
+            result = evaluator.evaluate(rdf=graph, focus=focus, debug=debug)[0]
+    except TimeoutException:
+        return focus, False, "ShEx times out"
+    return focus, result.result, result.reason
+
+
+def evaluate_batch(focus_nodes, schema, endpoint=WDQS, depth=1, timeout=120, recheck=False, debug=False):
+    """
+    Fetch the graph for a batch of focus nodes and evaluate each of them on it
+    :param recheck: evaluate the nodes that don't conform again with a SlurpyGraph, in case the shape needs triples
+        that weren't fetched. one sparql request per triple, so only for shapes that go past `depth`
+    :return: list of (focus, conforms, reason)
+    """
+    focus_nodes = [str(node) for node in focus_nodes]
+    try:
+        graph = fetch_graph(focus_nodes, endpoint, depth)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print("SPARQL endpoint does not return values: {}".format(e))
+        return [(focus, False, "SPARQL endpoint times out") for focus in focus_nodes]
+
+    evaluator = ShExEvaluator(schema=schema)
+    results = []
+    for focus in focus_nodes:
+        result = evaluate(evaluator, graph, focus, timeout, debug)
+        if recheck and not result[1] and result[2] != "ShEx times out":
+            result = evaluate(evaluator, SlurpyGraph(endpoint), focus, timeout, debug)
+        results.append(result)
+    return results
+
+
+def check_conformance(focus_nodes, schema, endpoint=WDQS, batch_size=100, workers=4, **kwargs):
+    """
+    Evaluate all the focus nodes against the schema (ShExC text), `batch_size` at a time, in `workers` processes
+    kwargs are passed to `evaluate_batch`
+    :return: generator of (focus, conforms, reason)
+    """
+    batches = list(grouper(batch_size, [str(node) for node in focus_nodes]))
+    f = partial(evaluate_batch, schema=schema, endpoint=endpoint, **kwargs)
+    if workers == 1:
+        for batch in batches:
+            yield from f(batch)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for results in executor.map(f, batches):
+            yield from results
+
+
+def conformance_report(results, schema_url, graph=None):
+    # dcterms:conformsTo the schema for each node that conforms, and dcterms:comment with the reason for each that doesn't
+    graph = graph if graph is not None else Graph()
+    for focus, conforms, reason in results:
+        if conforms:
+            graph.add((URIRef(focus), DCTERMS.conformsTo, URIRef(schema_url)))
+        else:
+            graph.add((URIRef(focus), DCTERMS_COMMENT, Literal(reason)))
+    return graph
+
+
+def check_manifest(manifest_url, **kwargs):
+    """
+    Check the items of each case in a ShEx manifest that has a sparql endpoint as its data
+    kwargs are passed to `check_conformance`
+    :return: generator of (case, generator of (focus, conforms, reason))
+    """
+    manifest = jsonasobj.loads(requests.get(manifest_url).text)
+    for case in manifest:
+        if case.data.startswith("Endpoint:"):
+            sparql_endpoint = case.data.replace("Endpoint: ", "")
+            schema = requests.get(case.schemaURL).text
+            sparql_query = case.queryMap.replace("SPARQL '''", "").replace("'''@START", "")
+            bindings = wdi_core.WDItemEngine.execute_sparql_query(sparql_query)["results"]["bindings"]
+            focus_nodes = [row["item"]["value"] for row in bindings]
+            yield case, check_conformance(focus_nodes, schema, endpoint=sparql_endpoint, **kwargs)
+
+
+def log_results(results):
+    # INFO for each node that conforms, ERROR with the reason for each that doesn't
+    for focus, conforms, reason in results:
+        if conforms:
+            print(focus + ": INFO")
+            wdi_core.WDItemEngine.log("INFO", wdi_helpers.format_msg(focus, focus, None, 'CONFORMS', ''))
+        else:
+            wdi_core.WDItemEngine.log("ERROR", wdi_helpers.format_msg(focus, focus, None, '', reason))
@@ -0,0 +1,108 @@
+"""
+Checks of Wikidata items against an EntitySchema, for bots that only edit items that conform to one.
+
+The schema is fetched and compiled once, and each item is checked on rdf made from its json, so checking many items
+doesn't make requests per item. The results for each item revision can be kept in a json file across runs:
+
+validator = EntitySchemaValidator("E323", cache_path="E323_results.json")
+prechecks = validator.validate_items(qids)  # qid -> {'result', 'reason', 'focus'}
+postcheck = validator.validate(item.get_wd_json_representation(), use_cache=False)  # an item with local changes
+validator.save()
+"""
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from pyshex import ShExEvaluator
+from wikidataintegrator import wdi_rdf
+from wikidataintegrator.wdi_config import config
+
+from scheduled_bots.utils import grouper
+
+
+class EntityRDFEngine(wdi_rdf.WDqidRDFEngine):
+    # rdf of an entity made from its json as is. WDqidRDFEngine fetches the entity again when it is given the qid
+    def __init__(self, json_data, **kwargs):
+        super().__init__(json_data=json_data, **kwargs)
+
+    def triplify(self):
+        self.qid = self.json_item['id']
+        super().triplify()
+
+
+def entity_rdf(entity):
+    # the metadata triples are about the saved revision, which an item with local changes doesn't have
+    return EntityRDFEngine(entity, fetch_metadata_rdf='lastrevid' in entity and 'modified' in entity).rdf_item
+
+
+def get_entities(qids, chunk_size=50):
+    # qid -> entity json, `chunk_size` items per request. deleted items are left out
+    entities = dict()
+    for chunk in grouper(chunk_size, qids):
+        r = requests.get("https://www.wikidata.org/w/api.php",
+                         params={'action': 'wbgetentities', 'ids': "|".join(chunk), 'format': 'json'})
+        r.raise_for_status()
+        entities.update({qid: entity for qid, entity in r.json()['entities'].items() if 'missing' not in entity})
+    return entities
+
+
+class EntitySchemaValidator:
+    """
+    Validates items against one EntitySchema. Results of items that have a revision id are cached by it, and kept
+    across runs in `cache_path` for as long as the schema doesn't change
+    """
+
+    def __init__(self, eid, entity_schema_repo=None, cache_path=None):
+        self.eid = eid
+        entity_schema_repo = config["ENTITY_SCHEMA_REPO"] if entity_schema_repo is None else entity_schema_repo
+        schema = requests.get(entity_schema_repo + eid).text
+        self.schema_hash = hashlib.sha1(schema.encode()).hexdigest()
+        self.evaluator = ShExEvaluator(schema=schema)
+        # the evaluator keeps the rdf and focus of the evaluation on itself
+        self.lock = threading.Lock()
+        # qid -> {'revid', 'result', 'reason', 'focus'}
+        self.results = dict()
+        self.cache_path = None
+        if cache_path:
+            self.load(cache_path)
+
+    def load(self, cache_path):
+        self.cache_path = cache_path
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                d = json.load(f)
+            if d['schema'] == self.schema_hash:
+                self.results.update(d['results'])
+
+    def save(self):
+        if self.cache_path:
+            with open(self.cache_path, 'w') as f:
+                json.dump({'eid': self.eid, 'schema': self.schema_hash, 'results': self.results}, f, indent=2)
+
+    def validate(self, entity, use_cache=True):
+        """
+        :param entity: entity json, from the api or `WDItemEngine.get_wd_json_representation`
+        :param use_cache: False for an item with changes that aren't saved, which still has the last revision id
+        :return: {'result': bool, 'reason': str, 'focus': str}
+        """
+        qid = entity['id']
+        revid = entity.get('lastrevid') if use_cache else None
+        cached = self.results.get(qid)
+        if revid is not None and cached and cached['revid'] == revid:
+            return {k: cached[k] for k in ('result', 'reason', 'focus')}
+
+        rdf = entity_rdf(entity)
+        with self.lock:
+            result = self.evaluator.evaluate(rdf=rdf, focus=config["CONCEPT_BASE_URI"] + qid)[0]
+        shex_result = {'result': bool(result.result), 'reason': result.reason, 'focus': str(result.focus)}
+        if revid is not None:
+            with self.lock:
+                self.results[qid] = dict(shex_result, revid=revid)
+        return shex_result
+
+    def validate_items(self, qids, chunk_size=50):
+        # qid -> result, for the current revision of each item
+        entities = get_entities(qids, chunk_size)
+        return {qid: self.validate(entity) for qid, entity in entities.items()}
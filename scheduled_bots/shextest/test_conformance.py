@@ -0,0 +1,106 @@
+import re
+from unittest import mock
+
+from rdflib import Graph, URIRef
+from rdflib.namespace import DCTERMS
+
+from scheduled_bots.shextest.conformance import check_conformance, conformance_report, fetch_graph, DCTERMS_COMMENT
+
+data = """
+@prefix wd: <http://www.wikidata.org/entity/> .
+@prefix wds: <http://www.wikidata.org/entity/statement/> .
+@prefix wdt: <http://www.wikidata.org/prop/direct/> .
+@prefix p: <http://www.wikidata.org/prop/> .
+@prefix ps: <http://www.wikidata.org/prop/statement/> .
+@prefix wdref: <http://www.wikidata.org/reference/> .
+@prefix pr: <http://www.wikidata.org/prop/reference/> .
+@prefix prov: <http://www.w3.org/ns/prov#> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+
+wd:Q1 wdt:P699 "DOID:1" ; wdt:P31 wd:Q12136 ; p:P699 wds:Q1-a .
+wds:Q1-a ps:P699 "DOID:1" ; prov:wasDerivedFrom wdref:r1 .
+wdref:r1 pr:P248 wd:Q5282129 .
+wd:Q2 wdt:P31 wd:Q12136 .
+wd:Q3 wdt:P699 "DOID:3" ; wdt:P31 wd:Q5 ; p:P699 wds:Q3-a .
+wds:Q3-a ps:P699 "DOID:3" .
+wd:Q12136 rdfs:label "disease" ; wdt:P279 wd:Q1 .
+wd:Q5 rdfs:label "human" ; wdt:P31 wd:Q55983715 .
+wd:Q55983715 rdfs:label "organisms known by a particular common name" .
+"""
+
+schema = """
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+PREFIX p: <http://www.wikidata.org/prop/>
+PREFIX ps: <http://www.wikidata.org/prop/statement/>
+PREFIX pr: <http://www.wikidata.org/prop/reference/>
+PREFIX prov: <http://www.w3.org/ns/prov#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+start = @<disease>
+<disease> { wdt:P699 LITERAL ; p:P699 @<doid_statement> ; wdt:P31 @<class> }
+<doid_statement> { ps:P699 LITERAL ; prov:wasDerivedFrom @<reference> }
+<reference> { pr:P248 IRI }
+<class> { rdfs:label ["disease"] }
+"""
+
+graph = Graph()
+graph.parse(data=data, format='turtle')
+
+
+class MockEndpoint:
+    """ answers the CONSTRUCT queries from `graph`, counting requests """
+
+    def __init__(self):
+        self.n_requests = 0
+
+    def post(self, url, data=None, headers=None):
+        self.n_requests += 1
+        subjects = [URIRef(s) for s in re.findall(r"<([^>]*)>", data['query'])]
+        result = Graph()
+        for s in subjects:
+            for triple in graph.triples((s, None, None)):
+                result.add(triple)
+        response = mock.Mock()
+        response.text = result.serialize(format='turtle')
+        return response
+
+
+def entity(qid):
+    return "http://www.wikidata.org/entity/" + qid
+
+
+def test_fetch_graph():
+    endpoint = MockEndpoint()
+    with mock.patch('scheduled_bots.shextest.conformance.requests.post', endpoint.post):
+        g = fetch_graph([entity('Q1'), entity('Q2'), entity('Q3')], depth=1)
+    # focus nodes, then their statements and the classes, then the references of the statements, then the source
+    # the reference states
+    assert endpoint.n_requests == 4
+    subjects = set(str(s) for s in g.subjects())
+    assert entity('Q12136') in subjects and entity('Q5') in subjects
+    assert "http://www.wikidata.org/reference/r1" in subjects
+    # entities two hops away aren't fetched
+    assert entity('Q55983715') not in subjects
+
+
+def test_check_conformance():
+    endpoint = MockEndpoint()
+    qids = [entity('Q1'), entity('Q2'), entity('Q3')]
+    with mock.patch('scheduled_bots.shextest.conformance.requests.post', endpoint.post):
+        results = list(check_conformance(qids, schema, workers=1))
+    assert [(focus, conforms) for focus, conforms, _ in results] == [(qid, qid == entity('Q1')) for qid in qids]
+    assert endpoint.n_requests == 4
+
+    report = conformance_report(results, "https://example.org/disease.shex")
+    assert (URIRef(entity('Q1')), DCTERMS.conformsTo, URIRef("https://example.org/disease.shex")) in report
+    assert len(list(report.objects(URIRef(entity('Q2')), DCTERMS_COMMENT))) == 1
+
+
+def test_recheck():
+    # without the linked class in the prefetched graph Q1 doesn't conform, until it is checked against the endpoint
+    endpoint = MockEndpoint()
+    with mock.patch('scheduled_bots.shextest.conformance.requests.post', endpoint.post):
+        results = list(check_conformance([entity('Q1')], schema, workers=1, depth=0))
+        assert not results[0][1]
+        with mock.patch('scheduled_bots.shextest.conformance.SlurpyGraph', return_value=graph):
+            results = list(check_conformance([entity('Q1')], schema, workers=1, depth=0, recheck=True))
+    assert results[0][1]
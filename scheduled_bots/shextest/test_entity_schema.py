@@ -0,0 +1,55 @@
+import os
+import tempfile
+from unittest import mock
+
+from scheduled_bots.shextest.entity_schema import EntitySchemaValidator
+
+schema = """
+PREFIX wd: <http://www.wikidata.org/entity/>
+PREFIX p: <http://www.wikidata.org/prop/>
+PREFIX ps: <http://www.wikidata.org/prop/statement/>
+start = @<disease>
+<disease> { p:P699 { ps:P699 LITERAL } ; p:P31 { ps:P31 [wd:Q12136] } }
+"""
+
+
+def entity(qid, revid, classes):
+    claims = {'P699': [{'mainsnak': {'snaktype': 'value', 'property': 'P699', 'datatype': 'external-id',
+                                     'datavalue': {'value': 'DOID:' + qid[1:], 'type': 'string'}},
+                        'type': 'statement', 'id': qid + '$1', 'rank': 'normal'}],
+              'P31': [{'mainsnak': {'snaktype': 'value', 'property': 'P31', 'datatype': 'wikibase-item',
+                                    'datavalue': {'value': {'entity-type': 'item', 'id': c},
+                                                  'type': 'wikibase-entityid'}},
+                       'type': 'statement', 'id': qid + '$' + c, 'rank': 'normal'} for c in classes]}
+    return {'id': qid, 'type': 'item', 'labels': {}, 'descriptions': {}, 'aliases': {}, 'sitelinks': {},
+            'claims': claims, 'lastrevid': revid, 'modified': '2020-01-01T00:00:00Z'}
+
+
+def get_validator(cache_path=None):
+    with mock.patch('scheduled_bots.shextest.entity_schema.requests.get', return_value=mock.Mock(text=schema)):
+        return EntitySchemaValidator("E323", cache_path=cache_path)
+
+
+def test_validate():
+    validator = get_validator()
+    assert validator.validate(entity('Q1', 10, ['Q12136']))['result']
+    result = validator.validate(entity('Q2', 10, ['Q5']))
+    assert not result['result'] and result['focus'] == "http://www.wikidata.org/entity/Q2"
+    # an item with local changes isn't cached under its last revision
+    assert not validator.validate(entity('Q1', 10, ['Q5']), use_cache=False)['result']
+    assert validator.validate(entity('Q1', 10, ['Q12136']))['result']
+
+
+def test_revision_cache():
+    cache_path = os.path.join(tempfile.mkdtemp(), "E323.json")
+    validator = get_validator(cache_path)
+    validator.validate(entity('Q1', 10, ['Q12136']))
+    validator.save()
+
+    validator = get_validator(cache_path)
+    with mock.patch('scheduled_bots.shextest.entity_schema.entity_rdf') as entity_rdf:
+        # same revision, not validated again
+        assert validator.validate(entity('Q1', 10, ['Q12136']))['result']
+        assert entity_rdf.call_count == 0
+    # new revision
+    assert not validator.validate(entity('Q1', 11, ['Q5']))['result']
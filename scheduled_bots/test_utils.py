@@ -0,0 +1,122 @@
+import os
+import re
+import tempfile
+import time
+from unittest import mock
+
+import requests
+from nose.tools import assert_raises
+
+from scheduled_bots.utils import get_values_multi, partition_mappings, StageTimer, RecordedResponses, \
+    Journal
+
+# value -> qids for a fake P1550 (Orphanet ID)
+orphanet_items = {'558': ['Q1051419'],
+                  '99': ['Q1124321', 'Q55786012'],
+                  '1234': ['Q18553247']}
+
+
+class MockEndpoint:
+    """ answers `values ?x {...} ?item wdt:PXXX ?x` queries from `items`, counting requests """
+
+    def __init__(self, items):
+        self.items = items
+        self.n_requests = 0
+
+    def post(self, url, data=None, **kwargs):
+        self.n_requests += 1
+        values = re.findall(r'"([^"]*)"', data['query'])
+        bindings = [{'x': {'type': 'literal', 'value': value},
+                     'item': {'type': 'uri', 'value': 'http://www.wikidata.org/entity/' + qid}}
+                    for value in values for qid in self.items.get(value, [])]
+        response = mock.Mock()
+        response.json.return_value = {'results': {'bindings': bindings}}
+        return response
+
+
+def test_get_values_multi():
+    endpoint = MockEndpoint(orphanet_items)
+    with mock.patch('scheduled_bots.utils.requests.post', endpoint.post):
+        d = get_values_multi("P1550", ['558', '99', '99', '1234', '7', None, float('nan')])
+    assert endpoint.n_requests == 1
+    assert d == {'558': {'Q1051419'}, '99': {'Q1124321', 'Q55786012'}, '1234': {'Q18553247'}}
+
+
+def test_get_values_multi_chunks():
+    items = {str(x): ['Q{}'.format(x)] for x in range(1050)}
+    endpoint = MockEndpoint(items)
+    with mock.patch('scheduled_bots.utils.requests.post', endpoint.post):
+        d = get_values_multi("P1550", list(items) * 2, chunk_size=500)
+    assert endpoint.n_requests == 3
+    assert len(d) == 1050
+
+
+def test_partition_mappings():
+    d = {'558': {'Q1051419'}, '99': {'Q1124321', 'Q55786012'}}
+    unique, multiple, absent = partition_mappings(['558', '99', '7'], d)
+    assert unique == {'558': 'Q1051419'}
+    assert multiple == {'99': {'Q1124321', 'Q55786012'}}
+    assert absent == {'7'}
+
+
+def test_stage_timer_nested():
+    timer = StageTimer()
+
+    def slow_items():
+        for x in range(3):
+            time.sleep(0.01)
+            yield x
+
+    with timer.stage('run'):
+        for x in timer.iter('download', slow_items()):
+            pass
+    report = timer.report()
+    assert report['download']['seconds'] >= 0.03
+    # time in the nested stage isn't counted again for the outer one
+    assert report['run']['seconds'] < 0.01
+    assert report['run']['count'] == 1
+
+
+def test_recorded_responses():
+    def live_request(session, method, url, params=None, data=None, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = url
+        response._content = '{"results": {"bindings": []}}'.encode('utf-8')
+        return response
+
+    url = "https://query.wikidata.org/sparql"
+    path = tempfile.mkdtemp()
+    with mock.patch('requests.Session.request', live_request):
+        with RecordedResponses(path, record=True) as responses:
+            requests.post(url, data={'query': 'select * {}', 'format': 'json'})
+            assert responses.cached_json("docs", lambda: [{'_id': '1017'}]) == [{'_id': '1017'}]
+
+    with RecordedResponses(path) as responses:
+        r = requests.post(url, data={'format': 'json', 'query': 'select * {}'})
+        assert r.json() == {"results": {"bindings": []}}
+        assert responses.cached_json("docs", lambda: None) == [{'_id': '1017'}]
+        with assert_raises(ValueError):
+            requests.post(url, data={'query': 'select ?x {}', 'format': 'json'})
+    assert requests.Session.request is not live_request
+
+
+def test_journal_cut_off_line():
+    path = os.path.join(tempfile.mkdtemp(), "journal.jsonl")
+    with open(path, 'w') as f:
+        f.write('{"key": "Q1", "success": true}\n{"key": "Q2", "success": true}\n{"key": "Q3", "suc')
+    # the job was killed while writing Q3
+    journal = Journal(path)
+    assert journal.done == {'Q1', 'Q2'}
+    journal.write({'key': 'Q3', 'success': True})
+    journal.close()
+    assert Journal(path).done == {'Q1', 'Q2', 'Q3'}
+
+    # a last record that is only missing its newline counts
+    with open(path, 'w') as f:
+        f.write('{"key": "Q1", "success": true}')
+    journal = Journal(path)
+    journal.write({'key': 'Q2', 'success': True})
+    journal.close()
+    assert Journal(path).done == {'Q1', 'Q2'}
@@ -0,0 +1,54 @@
+import os
+import tempfile
+from datetime import datetime
+from unittest import mock
+
+from scheduled_bots.xref_sync import read_mapping, current_from_bindings, plan_sync, query_current
+
+
+def binding(qid, key, value=None, retrieved=None):
+    b = {'item': {'value': "http://www.wikidata.org/entity/" + qid}, 'key': {'value': key}}
+    if value:
+        b['value'] = {'value': value}
+    if retrieved:
+        b['retrieved'] = {'value': retrieved + "T00:00:00Z"}
+    return b
+
+
+def test_read_mapping():
+    path = os.path.join(tempfile.mkdtemp(), "chebi_iedb.csv")
+    with open(path, 'w') as f:
+        f.write("CHEBI:15365|http://www.iedb.org/epitope/1\nCHEBI:27732|http://www.iedb.org/epitope/22\n")
+    assert read_mapping(path, sep="|", key_prefix="CHEBI:", value_prefix="http://www.iedb.org/epitope/") == \
+        {'15365': '1', '27732': '22'}
+
+
+def test_plan_sync():
+    bindings = [binding('Q1', '1'),
+                binding('Q2', '2', '20', '2020-01-01'), binding('Q2', '2', '20', '2020-05-01'),
+                binding('Q3', '3', '30', '2019-01-01'),
+                binding('Q4', '4', '40'),
+                binding('Q5', '5', '50', '2020-05-01'), binding('Q5', '5', '51'),
+                binding('Q6', '6'), binding('Q7', '6')]
+    key_items, current = current_from_bindings(bindings)
+    assert current['Q2'] == {'20': datetime(2020, 5, 1)}
+
+    mapping = {'1': '10', '2': '20', '3': '30', '4': '40', '5': '50', '6': '60', '9': '90'}
+    plan = plan_sync(mapping, key_items, current, today=datetime(2020, 6, 1))
+    assert dict(zip(plan.key, plan.action)) == {'1': 'add', '2': 'keep', '3': 'refresh', '4': 'refresh',
+                                                '5': 'replace', '6': 'ambiguous', '9': 'missing'}
+
+
+def test_query_current_keys():
+    queries = []
+
+    def execute_sparql_query(query):
+        queries.append(query)
+        return {'results': {'bindings': [binding('Q1', '562', 'GCA_1', '2020-05-01')] if '"562"' in query else []}}
+
+    with mock.patch('scheduled_bots.xref_sync.wdi_core.WDItemEngine.execute_sparql_query', execute_sparql_query):
+        key_items, current = query_current('P685', 'P4333', 'Q901755', ref_value=False, keys=[562, 9606, 10090],
+                                           chunk_size=2)
+    assert len(queries) == 2
+    assert 'VALUES ?key { "562" "9606" }' in queries[0] and "pr:P4333" not in queries[0]
+    assert key_items == {'562': {'Q1'}} and current == {'Q1': {'GCA_1': datetime(2020, 5, 1)}}
@@ -1,22 +1,74 @@
+import base64
+import hashlib
 import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
 import requests
 from cachetools import cached, TTLCache
 CACHE_SIZE = 10000
 CACHE_TIMEOUT_SEC = 300  # 5 min
 
-def get_values(pid, values):
-    # todo: integrate this into wdi_helpers
-    value_quotes = '"' + '" "'.join(map(str, values)) + '"'
+def _query_values(pid, values, endpoint='https://query.wikidata.org/sparql'):
+    # returns a list of (value, qid) pairs for the items having `pid` with a value in `values`
+    value_quotes = '"' + '" "'.join(str(x).replace('"', '\\"') for x in values) + '"'
     s = """select * where {
           values ?x {**value_quotes**}
           ?item wdt:**pid** ?x
         }""".replace("**value_quotes**", value_quotes).replace("**pid**", pid)
     params = {'query': s, 'format': 'json'}
-    request = requests.post('https://query.wikidata.org/sparql', data=params)
+    request = requests.post(endpoint, data=params)
     request.raise_for_status()
     results = request.json()['results']['bindings']
     dl = [{k: v['value'] for k, v in item.items()} for item in results]
-    return {x['x']: x['item'].replace("http://www.wikidata.org/entity/", "") for x in dl}
+    return [(x['x'], x['item'].replace("http://www.wikidata.org/entity/", "")) for x in dl]
+
+
+def get_values(pid, values):
+    # todo: integrate this into wdi_helpers
+    return dict(_query_values(pid, values))
+
+
+def get_values_multi(pid, values, endpoint='https://query.wikidata.org/sparql', chunk_size=500):
+    """
+    Resolve a column of external IDs to QIDs using one chunked `VALUES` query per `chunk_size` distinct values.
+    Unlike `get_values`, an ID used on more than one item keeps all of its QIDs.
+
+    :param pid: PID of the external ID property (e.g. "P354")
+    :param values: iterable of IDs. Duplicates and NaN/None are dropped before querying
+    :param endpoint: sparql endpoint url
+    :param chunk_size: max number of values per query
+    :return: dict of {value: set of qids}. IDs not found are absent
+    """
+    values = sorted(set(str(x) for x in values if x is not None and x == x))
+    d = defaultdict(set)
+    for chunk in grouper(chunk_size, values):
+        for value, qid in _query_values(pid, chunk, endpoint=endpoint):
+            d[value].add(qid)
+    return dict(d)
+
+
+def partition_mappings(values, value_qids):
+    """
+    Split the result of `get_values_multi` into one-to-one, one-to-many and missing values
+
+    :param values: the IDs that were looked up
+    :param value_qids: dict of {value: set of qids}, as returned by `get_values_multi`
+    :return: tuple of (dict of {value: qid}, dict of {value: set of qids}, set of absent values)
+    """
+    unique, multiple, absent = dict(), dict(), set()
+    for value in set(values):
+        qids = value_qids.get(value)
+        if not qids:
+            absent.add(value)
+        elif len(qids) == 1:
+            unique[value] = next(iter(qids))
+        else:
+            multiple[value] = qids
+    return unique, multiple, absent
 
 
 def login_to_wikidata(USER, PASS):
@@ -96,6 +148,224 @@ def grouper(n, iterable):
         yield chunk
 
 
+class RateLimiter:
+    """
+    Spaces out calls from any number of threads to at most `per_minute` a minute:
+
+    limiter = RateLimiter(60)
+    limiter.wait()  # before each edit
+    """
+
+    def __init__(self, per_minute):
+        self.interval = 60 / per_minute
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Journal:
+    """
+    The result of each step of a long running job (e.g. one undo or merge), one json line each with a 'key' and
+    'success', appended as soon as it's done, so the job can be resumed. `done` holds the keys already in the journal.
+    With retry_failed=True, only successful steps count as done
+    """
+
+    def __init__(self, path, retry_failed=False):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            # bytes up to the end of the last record that was written out
+            size = 0
+            with open(path, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        try:
+                            record = json.loads(line.decode('utf-8'))
+                        except ValueError:
+                            if line.endswith(b"\n"):
+                                raise
+                            # the job was killed while writing this last line. it's dropped, and that step done again
+                            break
+                        if record['success'] or not retry_failed:
+                            self.done.add(record['key'])
+                    size += len(line)
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+                # a last record that is only missing its newline is kept
+                if size:
+                    f.seek(size - 1)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+        self.f = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        with self.lock:
+            self.f.write(json.dumps(record) + "\n")
+            self.f.flush()
+            self.done.add(record['key'])
+
+    def close(self):
+        self.f.close()
+
+
+class StageTimer:
+    """
+    Accumulates wall clock time per stage of a bot run, e.g.:
+
+    timer = StageTimer()
+    with timer.stage('download'):
+        docs = list(docs)
+    records = timer.iter('validate', validate_docs(docs))
+    print(timer)
+
+    Stages can be nested (e.g. a lazy 'validate' pulled from inside 'tag'). Time spent in a nested stage is only
+    counted for that stage, so the stages add up to the total.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        # time spent in nested stages, for each stage currently running
+        self._nested = []
+
+    @contextmanager
+    def stage(self, name):
+        self._nested.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            self.seconds[name] += elapsed - nested
+            self.counts[name] += 1
+
+    def iter(self, name, iterable):
+        # time the production of each item of a (lazy) iterable
+        it = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def report(self):
+        return {name: {'seconds': self.seconds[name], 'count': self.counts[name]} for name in self.seconds}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def __str__(self):
+        lines = ["{:<20} {:>10} {:>10}".format("stage", "seconds", "count")]
+        for name, d in self.report().items():
+            lines.append("{:<20} {:>10.2f} {:>10}".format(name, d['seconds'], d['count']))
+        return "\n".join(lines)
+
+
+class RecordedResponses:
+    """
+    Offline stand-in for the wikidata query service, the mediawiki api and any other http source used through
+    `requests`. While active, every request is answered from a response recorded in `path`, one json file per request
+    named by a hash of the method, url, params and body. With record=True, requests go out for real and the responses
+    are saved, so a live dummy run can be captured once and replayed offline:
+
+    with RecordedResponses("fixtures/9606", record=True):
+        main(...)
+
+    or call start() and stop() around the run.
+
+    Data that doesn't come through `requests` (e.g. mygene docs) can be saved alongside with `cached_json`.
+    """
+
+    def __init__(self, path, record=False):
+        self.path = path
+        self.record = record
+        self.n_requests = 0
+        self._original_request = None
+        os.makedirs(os.path.join(path, "requests"), exist_ok=True)
+
+    @staticmethod
+    def request_key(method, url, params=None, data=None):
+        s = json.dumps([method.upper(), url, params, data], sort_keys=True, default=str)
+        return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+    def _request(self, session, method, url, params=None, data=None, **kwargs):
+        self.n_requests += 1
+        fn = os.path.join(self.path, "requests", self.request_key(method, url, params, data) + ".json")
+        if self.record:
+            response = self._original_request(session, method, url, params=params, data=data, **kwargs)
+            content = response.content
+            try:
+                record = {'text': content.decode('utf-8')}
+            except UnicodeDecodeError:
+                record = {'base64': base64.b64encode(content).decode('ascii')}
+            record.update({'method': method.upper(), 'url': url, 'status_code': response.status_code,
+                           'reason': response.reason, 'headers': dict(response.headers)})
+            with open(fn, 'w') as f:
+                json.dump(record, f)
+            return response
+
+        if not os.path.exists(fn):
+            raise ValueError("no recorded response for {} {} {}".format(method, url, params or data or ""))
+        with open(fn) as f:
+            record = json.load(f)
+        response = requests.Response()
+        response.status_code = record['status_code']
+        response.reason = record['reason']
+        response.headers.update(record['headers'])
+        # the recorded content is already decoded
+        response.headers.pop('Content-Encoding', None)
+        response.url = record['url']
+        response.encoding = 'utf-8'
+        response._content = record['text'].encode('utf-8') if 'text' in record else base64.b64decode(record['base64'])
+        return response
+
+    def cached_json(self, name, f):
+        """
+        Return f() when recording (and save it as `name`), or the saved value when replaying
+        """
+        fn = os.path.join(self.path, name + ".json")
+        if not self.record:
+            with open(fn) as fh:
+                return json.load(fh)
+        value = f()
+        with open(fn, 'w') as fh:
+            json.dump(value, fh)
+        return value
+
+    def start(self):
+        self._original_request = requests.Session.request
+        recorder = self
+
+        def request(session, method, url, params=None, data=None, **kwargs):
+            return recorder._request(session, method, url, params=params, data=data, **kwargs)
+
+        requests.Session.request = request
+        return self
+
+    def stop(self):
+        requests.Session.request = self._original_request
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
 def make_deletion_templates(qids, title, reason):
     s = '\n=={}==\n'.format(title)
     for group in grouper(90, list(qids)):
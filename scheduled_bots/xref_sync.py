@@ -0,0 +1,167 @@
+"""
+Bulk sync of one external identifier onto the items that have another one, from a two column mapping file
+(e.g. ChEBI ID -> IEDB Epitope ID).
+
+The items with the key identifier, and their current values and references for the synced one, come from one sparql
+query. Which items need an edit is decided from that, so only the items whose value or reference is stale are touched:
+
+mapping = read_mapping("chebi_iedb.csv", sep="|", key_prefix="CHEBI:", value_prefix="http://www.iedb.org/epitope/")
+key_items, current = query_current(PROPS['ChEBI ID'], PROPS['IEDB Epitope ID'], 'Q1653430')
+plan = plan_sync(mapping, key_items, current)
+sync(plan, PROPS['IEDB Epitope ID'], 'Q1653430', login, edit_summary="Add IEDB Epitope ID")
+"""
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from time import gmtime, strftime
+
+import pandas as pd
+from tqdm import tqdm
+
+from scheduled_bots import PROPS
+from scheduled_bots.utils import grouper
+from wikidataintegrator import wdi_core, wdi_helpers, ref_handlers
+
+# for each item with the key identifier, the values of the synced identifier and when a reference to the source
+# stating it was retrieved
+current_query = """
+SELECT ?item ?key ?value ?retrieved WHERE {{
+  {values}
+  ?item wdt:{key_pid} ?key .
+  OPTIONAL {{
+    ?item p:{value_pid} ?statement .
+    ?statement ps:{value_pid} ?value .
+    OPTIONAL {{
+      ?statement prov:wasDerivedFrom ?ref .
+      ?ref pr:{stated_in_pid} wd:{stated_in} {ref_value}.
+      OPTIONAL {{ ?ref pr:{retrieved_pid} ?retrieved }}
+    }}
+  }}
+}}"""
+
+PLAN_COLUMNS = ['key', 'value', 'qid', 'action']
+
+# actions that need an edit
+EDIT_ACTIONS = {'add', 'replace', 'refresh'}
+
+
+def read_mapping(path, sep=",", key_prefix="", value_prefix=""):
+    """
+    Two column file without a header (key, value)
+    :return: key -> value, with the prefixes removed
+    """
+    df = pd.read_csv(path, names=['key', 'value'], sep=sep, dtype=str)
+    keys = df.key.str.replace(key_prefix, "", regex=False)
+    values = df.value.str.replace(value_prefix, "", regex=False)
+    return dict(zip(keys, values))
+
+
+def query_current(key_pid, value_pid, stated_in, ref_value=True, keys=None, chunk_size=500):
+    """
+    :param key_pid: property of the identifier in the mapping keys
+    :param value_pid: property of the identifier to sync
+    :param stated_in: qid of the source, in the references
+    :param ref_value: the references also have the synced identifier
+    :param keys: only get the items with these keys, `chunk_size` keys per query, instead of all items with the key
+    :return: key -> set of qids, qid -> {value: latest retrieved date of a reference to the source, or None}
+    """
+    query = partial(current_query.format, key_pid=key_pid, value_pid=value_pid, stated_in=stated_in,
+                    stated_in_pid=PROPS['stated in'], retrieved_pid=PROPS['retrieved'],
+                    ref_value="; pr:{} ?value ".format(value_pid) if ref_value else "")
+    if keys is None:
+        queries = [query(values="")]
+    else:
+        queries = [query(values="VALUES ?key {{ {} }}".format(" ".join(json.dumps(str(key)) for key in chunk)))
+                   for chunk in grouper(chunk_size, sorted(set(keys)))]
+    bindings = []
+    for q in queries:
+        bindings.extend(wdi_core.WDItemEngine.execute_sparql_query(q)['results']['bindings'])
+    return current_from_bindings(bindings)
+
+
+def current_from_bindings(bindings):
+    key_items = defaultdict(set)
+    current = dict()
+    for b in bindings:
+        qid = b['item']['value'].replace("http://www.wikidata.org/entity/", "")
+        key_items[b['key']['value']].add(qid)
+        values = current.setdefault(qid, dict())
+        if 'value' not in b:
+            continue
+        value = b['value']['value']
+        retrieved = datetime.strptime(b['retrieved']['value'][:10], "%Y-%m-%d") if 'retrieved' in b else None
+        if retrieved and (values.get(value) is None or retrieved > values[value]):
+            values[value] = retrieved
+        else:
+            values.setdefault(value, None)
+    return dict(key_items), current
+
+
+def plan_sync(mapping, key_items, current, days=180, today=None):
+    """
+    What to do for each pair in the mapping:
+        missing: no item has the key, ambiguous: more than one item has it
+        add: the item has no value, replace: the item has other values, which the edit removes
+        refresh: the item has the value, but no reference to the source retrieved in the last `days` days
+        keep: nothing to do
+    :return: DataFrame with PLAN_COLUMNS
+    """
+    today = today or datetime.now()
+    rows = []
+    for key, value in mapping.items():
+        qids = key_items.get(key, set())
+        if len(qids) != 1:
+            rows.append({'key': key, 'value': value, 'qid': None, 'action': 'ambiguous' if qids else 'missing'})
+            continue
+        qid = next(iter(qids))
+        values = current.get(qid, dict())
+        if not values:
+            action = 'add'
+        elif set(values) != {value}:
+            action = 'replace'
+        elif values[value] is None or today - values[value] >= timedelta(days=days):
+            action = 'refresh'
+        else:
+            action = 'keep'
+        rows.append({'key': key, 'value': value, 'qid': qid, 'action': action})
+    return pd.DataFrame(rows, columns=PLAN_COLUMNS)
+
+
+def make_reference(value, value_pid, stated_in):
+    return [[wdi_core.WDItemID(value=stated_in, prop_nr=PROPS['stated in'], is_reference=True),
+             wdi_core.WDExternalID(value=value, prop_nr=value_pid, is_reference=True),
+             wdi_core.WDTime(strftime("+%Y-%m-%dT00:00:00Z", gmtime()), prop_nr=PROPS['retrieved'],
+                             is_reference=True)]]
+
+
+def sync(plan, value_pid, stated_in, login, edit_summary, write=True, core_props=None, reference=None, workers=1):
+    """
+    Write the value to each item in the plan that needs an edit. Pairs without an item are logged as warnings
+    :param reference: function of the value that returns the references of the statement. defaults to stated in
+        `stated_in`, the value, and retrieved today
+    :param workers: items written at the same time
+    :return: number of items that failed
+    """
+    reference = reference or partial(make_reference, value_pid=value_pid, stated_in=stated_in)
+    for row in plan[plan.action.isin({'missing', 'ambiguous'})].itertuples():
+        msg = wdi_helpers.format_msg(row.value, value_pid, None, "{} {}".format(row.key, row.action),
+                                     "key {}".format(row.action))
+        wdi_core.WDItemEngine.log("WARNING", msg)
+
+    def write_one(row):
+        try:
+            s = [wdi_core.WDExternalID(row.value, value_pid, references=reference(row.value))]
+            item = wdi_core.WDItemEngine(wd_item_id=row.qid, data=s, ref_handler=ref_handlers.update_retrieved_if_new,
+                                         global_ref_mode="CUSTOM", core_props=core_props)
+            wdi_helpers.try_write(item, row.value, value_pid, login, edit_summary=edit_summary, write=write)
+            return True
+        except Exception as e:
+            wdi_core.WDItemEngine.log("ERROR", wdi_helpers.format_msg(row.value, value_pid, row.qid, str(e), type(e)))
+            return False
+
+    edits = plan[plan.action.isin(EDIT_ACTIONS)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(tqdm(executor.map(write_one, edits.itertuples()), total=len(edits)))
+    return results.count(False)